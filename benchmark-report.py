@@ -0,0 +1,228 @@
+#! /opt/homebrew/bin/python3
+
+# Copyright 2024 Square Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmarks simple-sales-report.py against fake_square_server.py at several
+# data sizes.  For each size it starts a fake server, runs the report with
+# --timings, and collects the throughput, peak memory and time spent paging,
+# aggregating, enriching and writing the report.  The results are saved as JSON,
+# and can be compared with the results of an earlier run with --compare.
+
+import argparse, datetime, json, os, platform, shlex, socket, subprocess, sys, tempfile, time
+import urllib.request
+
+from prettytable import PrettyTable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPORT_SCRIPT = os.path.join(HERE, "simple-sales-report.py")
+SERVER_SCRIPT = os.path.join(HERE, "fake_square_server.py")
+
+# The fake server's orders have 1 to --max-line-items line items (2 on average)
+MAX_LINE_ITEMS = 3
+AVERAGE_LINE_ITEMS = (1 + MAX_LINE_ITEMS) / 2
+
+# The fake server's orders close during 2024
+START_DATE = "2024-01-01"
+END_DATE = "2025-01-01"
+
+
+# A free port on 127.0.0.1 for the fake server
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Start a fake server with about `line_items` line items, and wait until it answers
+def start_fake_server(line_items, args):
+    port = free_port()
+    command = [
+        sys.executable, SERVER_SCRIPT, "--port", str(port),
+        "--orders", str(max(1, round(line_items / AVERAGE_LINE_ITEMS))),
+        "--max-line-items", str(MAX_LINE_ITEMS),
+        "--catalog-copies", str(args.catalog_copies),
+        "--locations", str(args.locations),
+        "--start-date", START_DATE, "--end-date", END_DATE,
+        "--latency", str(args.latency),
+    ]
+    if args.rate_limit:
+        command += ["--rate-limit", str(args.rate_limit)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    url = "http://127.0.0.1:%d" % port
+    deadline = time.monotonic() + 120
+    while True:
+        try:
+            urllib.request.urlopen(url + "/v2/locations", timeout=5).close()
+            return server, url
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                print("The fake server didn't start")
+                sys.exit(1)
+            time.sleep(0.2)
+
+
+# Run the report once against the server at `url`, and return its timings
+def run_report(url, args, workdir):
+    report_args = shlex.split(args.report_args)
+    timings_file = os.path.join(workdir, "timings.json")
+    command = [
+        sys.executable, REPORT_SCRIPT,
+        "--start-date", START_DATE, "--end-date", END_DATE,
+        "--no-table", "--timings", timings_file,
+        "--checkpoint", os.path.join(workdir, "checkpoint.json"),
+        # Every fake server has its own port, so don't keep its location id
+        "--location-cache", "",
+    ] + report_args
+    env = dict(
+        os.environ,
+        SQUARE_ENVIRONMENT="custom",
+        SQUARE_BASE_URL=url,
+        SQUARE_ACCESS_TOKEN="benchmark",
+    )
+    if args.locations > 1 and "--locations" not in report_args:
+        command += ["--locations", "all"]
+
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        print(result.stdout)
+        print("The report failed")
+        sys.exit(1)
+
+    with open(timings_file) as f:
+        timings = json.load(f)
+    # The process's own elapsed time includes starting Python and importing modules
+    timings["process_seconds"] = round(elapsed, 3)
+    return timings
+
+
+# Benchmark one data size: the fastest of `runs` runs of the report
+def benchmark_size(line_items, args):
+    print(f"Benchmarking about {line_items} line items...")
+    server, url = start_fake_server(line_items, args)
+    try:
+        runs = []
+        for run in range(args.runs):
+            with tempfile.TemporaryDirectory() as workdir:
+                runs.append(run_report(url, args, workdir))
+            print(f"  run {run + 1}: {runs[-1]['elapsed_seconds']}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+    best = min(runs, key=lambda timings: timings["elapsed_seconds"])
+    return dict(best, size=line_items, runs=[timings["elapsed_seconds"] for timings in runs])
+
+
+# The commit the report script is at, if it's in a git checkout
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results, baseline=None):
+    baseline_sizes = {result["size"]: result for result in baseline["results"]} if baseline else {}
+
+    table = PrettyTable()
+    table.field_names = [
+        "Line items", "Elapsed (s)", "Line items/s", "Peak memory (MB)",
+        "Paging (s)", "Aggregation (s)", "Enrichment (s)", "Report (s)",
+    ] + (["vs baseline"] if baseline else [])
+    for result in results:
+        stages = result["stage_seconds"]
+        memory = result["peak_memory_bytes"]
+        row = [
+            result["line_items"],
+            result["elapsed_seconds"],
+            result["line_items_per_second"],
+            "N/A" if memory is None else round(memory / 2**20, 1),
+            stages["paging"],
+            stages["aggregation"],
+            stages["enrichment"],
+            stages["report"],
+        ]
+        if baseline:
+            before = baseline_sizes.get(result["size"])
+            row.append(
+                "{:+.1%}".format(result["elapsed_seconds"] / before["elapsed_seconds"] - 1)
+                if before else "N/A"
+            )
+        table.add_row(row)
+    print(table)
+    print("Stage times are added up over threads, so they can be more than the elapsed time.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the sales report against a local fake Square API"
+    )
+    parser.add_argument(
+        "--sizes", default="1000,100000,1000000",
+        help="Comma-separated numbers of line items to benchmark (default: 1000,100000,1000000)"
+    )
+    parser.add_argument("--runs", type=int, default=1, help="Runs of each size; the fastest is kept (default: 1)")
+    parser.add_argument(
+        "--report-args", default="",
+        help="Extra options for the report, for example \"--shards 8 --async\""
+    )
+    parser.add_argument("--locations", type=int, default=1, help="Locations in the fake data (default: 1)")
+    parser.add_argument(
+        "--catalog-copies", type=int, default=1,
+        help="Repeat the seed catalog this many times in the fake data (default: 1)"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="Average seconds of simulated latency for each request (default: 0)"
+    )
+    parser.add_argument("--rate-limit", type=float, help="Requests a second the fake server allows (default: no limit)")
+    parser.add_argument(
+        "--output", default="benchmark_results.json",
+        help="File to save the results to (default: benchmark_results.json)"
+    )
+    parser.add_argument("--compare", help="Results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = [benchmark_size(size, args) for size in sizes]
+    output = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "report_args": args.report_args,
+            "locations": args.locations,
+            "catalog_copies": args.catalog_copies,
+            "latency": args.latency,
+            "rate_limit": args.rate_limit,
+            "runs": args.runs,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+
+    print_results(results, baseline)
+    print(f"Benchmark results have been written to {args.output}")
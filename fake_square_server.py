@@ -0,0 +1,559 @@
+# Copyright 2024 Square Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A local stand-in for the parts of the Square API that the sample scripts read,
+# for trying out and benchmarking the sales report without a Sandbox account.
+#
+# It serves SearchOrders (with cursors), BatchRetrieveOrders, BatchRetrieveCatalogObjects,
+# SearchCatalogObjects, BatchRetrieveInventoryCounts and the Locations API from
+# synthetic data, generated from seed-data-catalog.json.  The same settings always
+# generate the same data.  Each request can be slowed down by a simulated network
+# latency, and requests over a rate limit get HTTP 429 responses, as from Square.
+#
+# It only listens on 127.0.0.1.  Point the scripts at it with
+#     SQUARE_ENVIRONMENT=custom SQUARE_BASE_URL=http://127.0.0.1:<port>
+
+import argparse, bisect, datetime, itertools, json, os, random, threading, time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Tags that the seed script puts on seed data (see seed-data.py)
+SEED_DATA_REFERENCE_ID = "SEED_DATA"
+SKU_PREFIX = SEED_DATA_REFERENCE_ID + "_"
+
+# Page sizes and request limits, as documented for the Square API
+ORDERS_PAGE_DEFAULT = 500
+ORDERS_PAGE_MAX = 1000
+SEARCH_LOCATIONS_LIMIT = 10
+CATALOG_BATCH_LIMIT = 1000
+CATALOG_SEARCH_PAGE = 100
+INVENTORY_PAGE = 1000
+
+# Sales aren't spread evenly through the day: the weight of each hour (UTC)
+# of the day when picking closing times for the orders
+SALES_BY_HOUR = [0, 0, 0, 0, 0, 0, 1, 2, 4, 6, 7, 9, 12, 11, 8, 7, 7, 8, 9, 8, 5, 3, 1, 0]
+
+# When the synthetic catalog and inventory were last changed
+GENERATED_AT = "2024-01-01T00:00:00.000Z"
+
+
+# RFC 3339 in the form Square uses (UTC, milliseconds)
+def format_timestamp(seconds):
+    dt = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + "%03dZ" % (dt.microsecond // 1000)
+
+
+def parse_timestamp(value):
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+class ApiError(Exception):
+    def __init__(self, status, code, detail, category="INVALID_REQUEST_ERROR"):
+        super().__init__(detail)
+        self.status = status
+        self.body = {"errors": [{"category": category, "code": code, "detail": detail}]}
+
+
+def bad_request(detail, code="INVALID_VALUE"):
+    return ApiError(400, code, detail)
+
+
+# The synthetic data the server answers from.
+#
+# The catalog is seed-data-catalog.json repeated `catalog_copies` times (each copy
+# of an item gets its own ids and a numbered name), with SEED_DATA_ SKUs as the
+# seed script gives them.  Each location has an inventory count for every variation.
+#
+# There are `orders` completed orders, with closing times spread over
+# [start_date, end_date) and weighted towards busy hours.  Only the closing times
+# and locations are kept in memory; the rest of an order is generated from its
+# index when a page of results is served, so millions of line items cost little.
+class FakeSquareData:
+    def __init__(self, orders=1000, catalog_copies=1, locations=1,
+                 start_date="2024-01-01", end_date="2025-01-01",
+                 max_line_items=3, seed=0, catalog_file=None):
+        self.seed = seed
+        self.max_line_items = max_line_items
+        rng = random.Random(seed)
+
+        self.locations = [
+            {
+                "id": "FAKELOCATION%02d" % (n + 1),
+                "name": "Location %d" % (n + 1),
+                "status": "ACTIVE",
+                "currency": "USD",
+                "country": "US",
+                "timezone": "UTC",
+            }
+            for n in range(locations)
+        ]
+        self.location_ids = [location["id"] for location in self.locations]
+
+        self.build_catalog(catalog_file, catalog_copies)
+
+        # Variations are sold with a long-tailed popularity
+        self.variation_weights = list(itertools.accumulate(
+            1 / (rank + 1) for rank in range(len(self.variations))
+        ))
+        rng.shuffle(self.variations)
+
+        # Closing times, sorted, and the location of each order
+        start = parse_timestamp(start_date)
+        days = max(1, int((parse_timestamp(end_date) - start) // 86400))
+        hours = rng.choices(range(24), weights=SALES_BY_HOUR, k=orders)
+        self.closed_at = array("d", sorted(
+            start + rng.randrange(days) * 86400 + hour * 3600 + rng.random() * 3600
+            for hour in hours
+        ))
+        self.order_location = array("H", (rng.randrange(locations) for _ in range(orders)))
+
+    def build_catalog(self, catalog_file, copies):
+        if catalog_file is None:
+            catalog_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "seed-data-catalog.json")
+        with open(catalog_file, "r") as catalog_data:
+            seed_catalog = json.load(catalog_data)["catalog"]
+
+        def object_id(temp_id, copy):
+            return "FAKE" + temp_id.lstrip("#").upper() + ("" if copy == 0 else "-%d" % copy)
+
+        def catalog_object(object_type, id, data):
+            return {
+                "type": object_type,
+                "id": id,
+                "updated_at": GENERATED_AT,
+                "version": 1,
+                "is_deleted": False,
+                "present_at_all_locations": True,
+                data[0]: data[1],
+            }
+
+        self.objects = {}
+        self.variations = []
+        for seed_object in seed_catalog:
+            if seed_object["type"] == "CATEGORY":
+                id = object_id(seed_object["id"], 0)
+                self.objects[id] = catalog_object("CATEGORY", id, ("category_data", seed_object["category_data"]))
+
+        for copy in range(copies):
+            for seed_object in seed_catalog:
+                if seed_object["type"] != "ITEM":
+                    continue
+                item_data = seed_object["item_data"]
+                item_id = object_id(seed_object["id"], copy)
+                name = item_data["name"] + ("" if copy == 0 else " %d" % (copy + 1))
+                variation_ids = []
+                for seed_variation in item_data["variations"]:
+                    variation_data = dict(seed_variation["item_variation_data"])
+                    variation_data["item_id"] = item_id
+                    variation_data["sku"] = SKU_PREFIX + variation_data["sku"] + ("" if copy == 0 else "-%d" % copy)
+                    id = object_id(seed_variation["id"], copy)
+                    self.objects[id] = catalog_object("ITEM_VARIATION", id, ("item_variation_data", variation_data))
+                    self.variations.append((id, name, variation_data["name"], variation_data["price_money"]["amount"]))
+                    variation_ids.append(id)
+
+                self.objects[item_id] = catalog_object("ITEM", item_id, ("item_data", {
+                    "name": name,
+                    "description": item_data.get("description", ""),
+                    "category_id": object_id(item_data["category_id"], 0),
+                    "product_type": item_data.get("product_type", "REGULAR"),
+                    "variations": [{"id": id, "type": "ITEM_VARIATION"} for id in variation_ids],
+                }))
+
+        # The variations in id order, for SearchCatalogObjects
+        self.variation_ids = sorted(id for id, *_ in self.variations)
+
+    # The order with the given index, generated from it
+    def order(self, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        closed_at = self.closed_at[index]
+        created_at = format_timestamp(closed_at - rng.randrange(60, 900))
+        closed = format_timestamp(closed_at)
+        id = "FAKEORDER%012d" % index
+
+        line_items = []
+        total = 0
+        for n, variation in enumerate(rng.choices(
+            self.variations, cum_weights=self.variation_weights, k=rng.randint(1, self.max_line_items)
+        )):
+            variation_id, name, variation_name, price = variation
+            quantity = rng.randint(1, 5)
+            amount = price * quantity
+            total += amount
+            line_items.append({
+                "uid": "%s-%d" % (id, n),
+                "catalog_object_id": variation_id,
+                "catalog_version": 1,
+                "quantity": str(quantity),
+                "name": name,
+                "variation_name": variation_name,
+                "item_type": "ITEM",
+                "base_price_money": {"amount": price, "currency": "USD"},
+                "variation_total_price_money": {"amount": amount, "currency": "USD"},
+                "gross_sales_money": {"amount": amount, "currency": "USD"},
+                "total_tax_money": {"amount": 0, "currency": "USD"},
+                "total_discount_money": {"amount": 0, "currency": "USD"},
+                "total_money": {"amount": amount, "currency": "USD"},
+            })
+
+        money = {"amount": total, "currency": "USD"}
+        zero = {"amount": 0, "currency": "USD"}
+        return {
+            "id": id,
+            "location_id": self.location_ids[self.order_location[index]],
+            "line_items": line_items,
+            "created_at": created_at,
+            "updated_at": closed,
+            "closed_at": closed,
+            "state": "COMPLETED",
+            "version": 4,
+            "source": {"name": SEED_DATA_REFERENCE_ID},
+            "total_money": money,
+            "total_tax_money": zero,
+            "total_discount_money": zero,
+            "total_tip_money": zero,
+            "total_service_charge_money": zero,
+            "net_amounts": {
+                "total_money": money,
+                "tax_money": zero,
+                "discount_money": zero,
+                "tip_money": zero,
+                "service_charge_money": zero,
+            },
+            "tenders": [{
+                "id": "FAKETENDER%012d" % index,
+                "location_id": self.location_ids[self.order_location[index]],
+                "transaction_id": id,
+                "created_at": closed,
+                "amount_money": money,
+                "type": "CASH",
+                "cash_details": {"buyer_tendered_money": money, "change_back_money": zero},
+                "payment_id": "FAKEPAYMENT%012d" % index,
+            }],
+            "net_amount_due_money": zero,
+        }
+
+    # The inventory count of a variation at a location (it never changes)
+    def inventory_count(self, variation_id, location_id):
+        rng = random.Random("%d:%s:%s" % (self.seed, variation_id, location_id))
+        return {
+            "catalog_object_id": variation_id,
+            "catalog_object_type": "ITEM_VARIATION",
+            "state": "IN_STOCK",
+            "location_id": location_id,
+            "quantity": str(rng.randint(0, 500)),
+            "calculated_at": GENERATED_AT,
+        }
+
+    # SearchOrders: completed seed orders at the given locations, closed in the
+    # given range (both ends inclusive), sorted by closed_at.  The cursor is the
+    # index of the next order to look at.
+    def search_orders(self, body):
+        location_ids = body.get("location_ids") or []
+        if not location_ids or len(location_ids) > SEARCH_LOCATIONS_LIMIT:
+            raise bad_request(
+                "Between 1 and %d location_ids must be provided." % SEARCH_LOCATIONS_LIMIT
+            )
+        for location_id in location_ids:
+            if location_id not in self.location_ids:
+                raise ApiError(403, "FORBIDDEN", "Location `%s` not found." % location_id,
+                               category="AUTHENTICATION_ERROR")
+        limit = body.get("limit", ORDERS_PAGE_DEFAULT)
+        if not 1 <= limit <= ORDERS_PAGE_MAX:
+            raise bad_request("`limit` must be between 1 and %d." % ORDERS_PAGE_MAX)
+
+        query = body.get("query", {})
+        query_filter = query.get("filter", {})
+        states = query_filter.get("state_filter", {}).get("states")
+        sources = query_filter.get("source_filter", {}).get("source_names")
+        if (states and "COMPLETED" not in states) or (sources and SEED_DATA_REFERENCE_ID not in sources):
+            return {}
+        sort = query.get("sort", {})
+        if sort.get("sort_order", "ASC") != "ASC":
+            raise bad_request("Only ascending sorts are supported by this server.")
+
+        closed_at = query_filter.get("date_time_filter", {}).get("closed_at", {})
+        start = bisect.bisect_left(self.closed_at, parse_timestamp(closed_at["start_at"])) if "start_at" in closed_at else 0
+        end = bisect.bisect_right(self.closed_at, parse_timestamp(closed_at["end_at"])) if "end_at" in closed_at else len(self.closed_at)
+
+        if body.get("cursor"):
+            try:
+                start = max(start, int(body["cursor"]))
+            except ValueError:
+                raise bad_request("Invalid cursor.", code="INVALID_CURSOR")
+
+        wanted = {self.location_ids.index(location_id) for location_id in location_ids}
+        all_locations = len(wanted) == len(self.location_ids)
+        orders = []
+        index = start
+        while index < end and len(orders) < limit:
+            if all_locations or self.order_location[index] in wanted:
+                orders.append(self.order(index))
+            index += 1
+
+        result = {"orders": orders} if orders else {}
+        if index < end:
+            result["cursor"] = str(index)
+        return result
+
+    # BatchRetrieveOrders, for orders that exist (at the given location, if there is one)
+    def batch_retrieve_orders(self, body):
+        order_ids = body.get("order_ids") or []
+        if not 1 <= len(order_ids) <= 100:
+            raise bad_request("Between 1 and 100 order_ids must be provided.")
+        orders = []
+        for order_id in order_ids:
+            if not order_id.startswith("FAKEORDER"):
+                continue
+            try:
+                index = int(order_id[len("FAKEORDER"):])
+            except ValueError:
+                continue
+            if index < len(self.closed_at):
+                order = self.order(index)
+                if body.get("location_id") in (None, order["location_id"]):
+                    orders.append(order)
+        return {"orders": orders} if orders else {}
+
+    # BatchRetrieveCatalogObjects, with the parent items of variations as related objects
+    def batch_retrieve_catalog_objects(self, body):
+        object_ids = body.get("object_ids") or []
+        if len(object_ids) > CATALOG_BATCH_LIMIT:
+            raise bad_request("At most %d object_ids may be provided." % CATALOG_BATCH_LIMIT)
+        objects = [self.objects[id] for id in object_ids if id in self.objects]
+        result = {"objects": objects} if objects else {}
+
+        if body.get("include_related_objects"):
+            related = {}
+            for catalog_object in objects:
+                if catalog_object["type"] == "ITEM_VARIATION":
+                    item_id = catalog_object["item_variation_data"]["item_id"]
+                    related[item_id] = self.objects[item_id]
+            if related:
+                result["related_objects"] = list(related.values())
+        return result
+
+    # SearchCatalogObjects, for item variations, optionally by SKU prefix.
+    # The synthetic catalog never changes after GENERATED_AT.
+    def search_catalog_objects(self, body):
+        object_types = body.get("object_types")
+        if object_types and "ITEM_VARIATION" not in object_types:
+            return {"latest_time": GENERATED_AT}
+        begin_time = body.get("begin_time")
+        if begin_time and parse_timestamp(begin_time) >= parse_timestamp(GENERATED_AT):
+            return {"latest_time": GENERATED_AT}
+
+        prefix = body.get("query", {}).get("prefix_query", {})
+        ids = [
+            id for id in self.variation_ids
+            if prefix.get("attribute_name") != "sku"
+            or self.objects[id]["item_variation_data"]["sku"].startswith(prefix.get("attribute_prefix", ""))
+        ]
+        start = int(body.get("cursor") or 0)
+        limit = min(body.get("limit", CATALOG_SEARCH_PAGE), CATALOG_BATCH_LIMIT)
+        result = {"objects": [self.objects[id] for id in ids[start:start + limit]], "latest_time": GENERATED_AT}
+        if start + limit < len(ids):
+            result["cursor"] = str(start + limit)
+        return result
+
+    # BatchRetrieveInventoryCounts, a page at a time
+    def batch_retrieve_inventory_counts(self, body):
+        object_ids = [id for id in body.get("catalog_object_ids") or self.variation_ids if id in self.objects]
+        location_ids = [id for id in body.get("location_ids") or self.location_ids if id in self.location_ids]
+        updated_after = body.get("updated_after")
+        if updated_after and parse_timestamp(updated_after) >= parse_timestamp(GENERATED_AT):
+            return {}
+
+        start = int(body.get("cursor") or 0)
+        limit = min(body.get("limit", INVENTORY_PAGE), INVENTORY_PAGE)
+        keys = [(object_id, location_id) for object_id in object_ids for location_id in location_ids]
+        counts = [self.inventory_count(*key) for key in keys[start:start + limit]]
+        result = {"counts": counts} if counts else {}
+        if start + limit < len(keys):
+            result["cursor"] = str(start + limit)
+        return result
+
+    def retrieve_location(self, location_id):
+        if location_id == "main":
+            return {"location": self.locations[0]}
+        for location in self.locations:
+            if location["id"] == location_id:
+                return {"location": location}
+        raise ApiError(404, "NOT_FOUND", "Location `%s` not found." % location_id, category="INVALID_REQUEST_ERROR")
+
+    def list_locations(self):
+        return {"locations": self.locations}
+
+
+# Allows `rate` requests a second on average, in bursts of up to `burst`
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class FakeSquareHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    POST_ROUTES = {
+        "/v2/orders/search": "search_orders",
+        "/v2/orders/batch-retrieve": "batch_retrieve_orders",
+        "/v2/catalog/batch-retrieve": "batch_retrieve_catalog_objects",
+        "/v2/catalog/search": "search_catalog_objects",
+        "/v2/inventory/counts/batch-retrieve": "batch_retrieve_inventory_counts",
+    }
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/v2/locations":
+            self.respond(lambda: self.server.data.list_locations())
+        elif path.startswith("/v2/locations/"):
+            self.respond(lambda: self.server.data.retrieve_location(path[len("/v2/locations/"):]))
+        else:
+            self.respond(lambda: self.not_found())
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = None
+        route = self.POST_ROUTES.get(self.path.split("?")[0])
+
+        def handle():
+            if route is None:
+                return self.not_found()
+            if not isinstance(body, dict):
+                raise bad_request("The request body is not valid JSON.", code="INVALID_REQUEST_ERROR")
+            return getattr(self.server.data, route)(body)
+
+        self.respond(handle)
+
+    def not_found(self):
+        raise ApiError(404, "NOT_FOUND", "Unknown endpoint `%s %s`." % (self.command, self.path))
+
+    def respond(self, handle):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+
+        if server.rate_limit is not None and not server.rate_limit.take():
+            status, body = 429, {"errors": [{
+                "category": "RATE_LIMIT_ERROR", "code": "RATE_LIMITED", "detail": "Too many requests.",
+            }]}
+        else:
+            try:
+                status, body = 200, handle()
+            except ApiError as e:
+                status, body = e.status, e.body
+            except (KeyError, TypeError, ValueError) as e:
+                status, body = 400, bad_request("Invalid request: %s" % e).body
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeSquareServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # latency: mean seconds added to each request; rate_limit: requests a second
+    def __init__(self, data, port=0, latency=0.0, rate_limit=None, burst=None, verbose=False):
+        super().__init__(("127.0.0.1", port), FakeSquareHandler)
+        self.data = data
+        self.latency = latency
+        self.rate_limit = TokenBucket(rate_limit, burst or rate_limit) if rate_limit else None
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+
+# Start a server on a background thread (shut it down with server.shutdown())
+def start_server(data, **options):
+    server = FakeSquareServer(data, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve synthetic Square API data locally, for the sample scripts",
+    )
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on, on 127.0.0.1 (default: 8080)")
+    parser.add_argument("--orders", type=int, default=10000, help="Number of completed orders (default: 10000)")
+    parser.add_argument(
+        "--max-line-items", type=int, default=3,
+        help="Each order has between 1 and this many line items (default: 3)"
+    )
+    parser.add_argument(
+        "--catalog-copies", type=int, default=1,
+        help="Repeat the seed catalog this many times, for a larger catalog (default: 1)"
+    )
+    parser.add_argument("--locations", type=int, default=1, help="Number of locations (default: 1)")
+    parser.add_argument("--start-date", default="2024-01-01", help="Orders close on or after this date (default: 2024-01-01)")
+    parser.add_argument("--end-date", default="2025-01-01", help="Orders close before this date (default: 2025-01-01)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the data (default: 0)")
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="Average seconds of simulated network latency for each request (default: 0)"
+    )
+    parser.add_argument(
+        "--rate-limit", type=float,
+        help="Requests a second allowed before responding with HTTP 429 (default: no limit)"
+    )
+    parser.add_argument("--burst", type=int, help="Requests allowed in a burst (default: the rate limit)")
+    parser.add_argument("--verbose", action="store_true", help="Log each request")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    data = FakeSquareData(
+        orders=args.orders, catalog_copies=args.catalog_copies, locations=args.locations,
+        start_date=args.start_date, end_date=args.end_date,
+        max_line_items=args.max_line_items, seed=args.seed,
+    )
+    server = FakeSquareServer(
+        data, port=args.port, latency=args.latency,
+        rate_limit=args.rate_limit, burst=args.burst, verbose=args.verbose,
+    )
+    print(
+        f"Serving {args.orders} orders, {len(data.variations)} variations and "
+        f"{len(data.locations)} locations at {server.url} "
+        f"(generated in {time.perf_counter() - started:.1f}s)"
+    )
+    print(f"Use SQUARE_ENVIRONMENT=custom SQUARE_BASE_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
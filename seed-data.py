@@ -11,13 +11,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import argparse, json, os, sys, uuid
+import argparse, asyncio, copy, json, os, sys, threading, time, uuid
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 from faker import Faker
 from square.client import Client
 from square.http.auth.o_auth_2 import BearerAuthCredentials
+from square_transport import AsyncSquareClient, RequestScheduler, SpanFileWriter
 
 
 # Faker generates some of the elements in the seed data
@@ -27,275 +29,454 @@ fake = Faker()
 SEED_DATA_REFERENCE_ID = "SEED_DATA"
 SKU_PREFIX = SEED_DATA_REFERENCE_ID + "_"
 
-
-# Upload sample catalog data
-def seed_catalog():
+# Page sizes and batch sizes for the requests that create, find and clear the
+# seed data (the most each endpoint allows)
+CATALOG_BATCH_OBJECTS = 1000
+CATALOG_REQUEST_OBJECTS = 10000
+BULK_CREATE_CUSTOMERS_LIMIT = 100
+INVENTORY_CHANGES_LIMIT = 100
+SEARCH_CUSTOMERS_LIMIT = 100
+SEARCH_CATALOG_LIMIT = 1000
+SEARCH_ORDERS_LIMIT = 1000
+BULK_DELETE_CUSTOMERS_LIMIT = 100
+BATCH_DELETE_CATALOG_LIMIT = 200
+# Orders are canceled one request at a time; each worker takes this many at once
+CANCEL_ORDERS_BATCH = 100
+
+
+# The seed catalog, with SEED_DATA_ SKUs, and its items repeated `copies` times
+# to make a catalog of production size.  Each copy of an item gets its own
+# temporary ids, a numbered name and a numbered SKU, the way
+# fake_square_server.py numbers them.  Categories and taxes aren't copied.
+def load_catalog(path, copies):
     # Read data from external file
-    with open("seed-data-catalog.json", "r") as test_data:
-        seed_data = json.load(test_data)
-
-    # Add tags to each item, to mark it as seed data
-    for x in range(0, len(seed_data["catalog"])):
-        if seed_data["catalog"][x]["type"] == "ITEM":
-            for y in range(0, len(seed_data["catalog"][x]["item_data"]["variations"])):
-                sku = (
-                    SKU_PREFIX
-                    + seed_data["catalog"][x]["item_data"]["variations"][y][
-                        "item_variation_data"
-                    ]["sku"]
-                )
-                seed_data["catalog"][x]["item_data"]["variations"][y][
-                    "item_variation_data"
-                ]["sku"] = sku
-
-    # Now upload the data
-    try:
-        result = client.catalog.batch_upsert_catalog_objects(
-            body={
-                "idempotency_key": str(uuid.uuid4()),
-                "batches": [{"objects": seed_data["catalog"]}],
-            }
-        )
-        print("Successfully created catalog")
-    except Exception:
+    with open(path, "r") as test_data:
+        seed_catalog = json.load(test_data)["catalog"]
+
+    shared = [seed_object for seed_object in seed_catalog if seed_object["type"] != "ITEM"]
+    items = []
+    for copy_number in range(copies):
+        suffix = "" if copy_number == 0 else "-%d" % copy_number
+        for seed_object in seed_catalog:
+            if seed_object["type"] != "ITEM":
+                continue
+            item = copy.deepcopy(seed_object)
+            item["id"] += suffix
+            if copy_number:
+                item["item_data"]["name"] += " %d" % (copy_number + 1)
+            # Add tags to each item, to mark it as seed data
+            for variation in item["item_data"]["variations"]:
+                variation["id"] += suffix
+                variation_data = variation["item_variation_data"]
+                variation_data["item_id"] = item["id"]
+                variation_data["sku"] = SKU_PREFIX + variation_data["sku"] + suffix
+            items.append(item)
+    return shared, items
+
+
+# Split items into BatchUpsertCatalogObjects request bodies, each of at most
+# CATALOG_BATCH_OBJECTS objects a batch and CATALOG_REQUEST_OBJECTS a request
+# (an item's variations count towards both)
+def catalog_upsert_bodies(items):
+    def size(item):
+        return 1 + len(item["item_data"]["variations"])
+
+    batches = []
+    for item in items:
+        if not batches or batches[-1][0] + size(item) > CATALOG_BATCH_OBJECTS:
+            batches.append([0, []])
+        batches[-1][0] += size(item)
+        batches[-1][1].append(item)
+
+    bodies = []
+    for batch_size, objects in batches:
+        if not bodies or bodies[-1][0] + batch_size > CATALOG_REQUEST_OBJECTS:
+            bodies.append([0, {"idempotency_key": str(uuid.uuid4()), "batches": []}])
+        bodies[-1][0] += batch_size
+        bodies[-1][1]["batches"].append({"objects": objects})
+    return [body for _, body in bodies]
+
+
+# Upload sample catalog data, and return the item variations created.
+#
+# The categories and taxes go first, so the items can refer to them by their
+# real ids; the items then go in as many requests as the API's limits need.
+# Square only takes one catalog update at a time for an account, so the
+# requests are made one after another.
+def seed_catalog(path, copies):
+    shared, items = load_catalog(path, copies)
+    print(f"Creating a catalog of {len(items)} items...")
+
+    result = scheduler.call(client.catalog.batch_upsert_catalog_objects,
+        body={
+            "idempotency_key": str(uuid.uuid4()),
+            "batches": [{"objects": shared}],
+        }
+    )
+    if result.is_error():
         handle_error("Seed catalog", result.errors)
-
-
-# Upload sample customer data
-def seed_customers():
+    object_ids = {
+        mapping["client_object_id"]: mapping["object_id"] for mapping in result.body.get("id_mappings", [])
+    }
+    for item in items:
+        item_data = item["item_data"]
+        if "category_id" in item_data:
+            item_data["category_id"] = object_ids.get(item_data["category_id"], item_data["category_id"])
+        if "tax_ids" in item_data:
+            item_data["tax_ids"] = [object_ids.get(tax_id, tax_id) for tax_id in item_data["tax_ids"]]
+
+    variations = []
+    progress = SeedProgress(len(items), "items created")
+    for body in catalog_upsert_bodies(items):
+        result = scheduler.call(client.catalog.batch_upsert_catalog_objects, body=body)
+        if result.is_error():
+            handle_error("Seed catalog", result.errors)
+        created = [item for item in result.body.get("objects", []) if item["type"] == "ITEM"]
+        for item in created:
+            variations.extend(item["item_data"]["variations"])
+        progress.add(len(created))
+    print("Successfully created catalog")
+    return variations
+
+
+# Upload sample customer data: the customers in seed-data-customers.json, or
+# `count` of them, repeated with made up names.  Customers are created
+# BULK_CREATE_CUSTOMERS_LIMIT a request, `concurrency` requests at a time.
+def seed_customers(count, concurrency):
     # Read data from external file
     with open("seed-data-customers.json", "r") as test_data:
         seed_data = json.load(test_data)
-    
-    customers = dict()
+    count = count or len(seed_data["customers"])
+
+    customers = []
     # Add tags to each item, to mark it as seed data
-    for customer in seed_data["customers"]:
+    for n in range(count):
+        customer = dict(seed_data["customers"][n % len(seed_data["customers"])])
+        if n >= len(seed_data["customers"]):
+            customer["given_name"] = fake.first_name()
+            customer["family_name"] = fake.last_name()
         customer["reference_id"] = SEED_DATA_REFERENCE_ID
         customer["email_address"] = fake.email()
-        customers['#' + fake.iana_id()] = customer
-        # Now upload the data
-    try:
-        result = client.customers.bulk_create_customers(
+        customers.append(("#customer%d" % n, customer))
+
+    def create(batch):
+        result = scheduler.call(client.customers.bulk_create_customers,
             body= {
-                "customers": customers
+                "customers": dict(batch)
             }
         )
-        print("Successfully created customers")
-    
-    # In case of errors with CreateCustomer...
-    except Exception:
-        handle_error("Seed customers", result.errors)
+        # In case of errors with BulkCreateCustomers...
+        if result.is_error():
+            handle_error("Seed customers", result.errors)
+        return len(batch)
 
+    progress = SeedProgress(count, "customers created")
+    run_batches(create, batches(customers, BULK_CREATE_CUSTOMERS_LIMIT), concurrency, progress)
+    print("Successfully created customers")
 
-# Generate sample inventory data, based on catalog objects
-def seed_inventory():
-    # Find all the catalog items that we've seeded previously
-    result = client.catalog.search_catalog_objects(
-        body={
-            "object_types": ["ITEM_VARIATION"],
-            "query": {
-                "prefix_query": {
-                    "attribute_name": "sku",
-                    "attribute_prefix": SKU_PREFIX,
-                }
-            },
-        }
-    )
 
+# Generate sample inventory data for the seeded item variations, with
+# INVENTORY_CHANGES_LIMIT changes a request, `concurrency` requests at a time
+def seed_inventory(variations, concurrency):
     # Generate a (fake) inventory count for each item
     changes = []
-    for x in result.body["objects"]:
+    for x in variations:
         changes.append ({
             "physical_count": {
                 "quantity": str(fake.random_int(min=50, max=100)),
                 "location_id": location_id,
                 "state": "IN_STOCK",
                 "catalog_object_id": x["id"],
-                "occurred_at": datetime.datetime.now(datetime.timezone.utc)
+                "occurred_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
             },
             "type": "PHYSICAL_COUNT",      
           }
         )
-        
-    try:
-        client.inventory.batch_change_inventory({
+
+    def change(batch):
+        result = scheduler.call(client.inventory.batch_change_inventory, body={
             "idempotency_key": str(uuid.uuid4()),
-            "changes": changes
+            "changes": batch
         })
-        print("Successfully adjusted inventory for item variations")
-
-    # In case of errors with BatchChangeInventory...
-    except Exception:
-        handle_error("Seed inventory", result.errors)
+        # In case of errors with BatchChangeInventory...
+        if result.is_error():
+            handle_error("Seed inventory", result.errors)
+        return len(batch)
+
+    progress = SeedProgress(len(changes), "inventory counts set")
+    run_batches(change, batches(changes, INVENTORY_CHANGES_LIMIT), concurrency, progress)
+    print("Successfully adjusted inventory for item variations")
+
+
+# Find all the item variations that we've seeded previously
+def seeded_variations():
+    body = {
+        "object_types": ["ITEM_VARIATION"],
+        "query": {
+            "prefix_query": {
+                "attribute_name": "sku",
+                "attribute_prefix": SKU_PREFIX,
+            }
+        },
+        "limit": SEARCH_CATALOG_LIMIT,
+    }
+    return [
+        variation
+        for page in search_pages(client.catalog.search_catalog_objects, body, "objects", "Search catalog")
+        for variation in page
+    ]
+
+
+# Yield each page of results from a search endpoint, following its cursor
+def search_pages(search, body, results_key, function):
+    cursor = None
+    while True:
+        result = scheduler.call(search, body=dict(body, cursor=cursor) if cursor else body)
+        if result.is_error():
+            handle_error(function, result.errors)
+        yield result.body.get(results_key, [])
+        cursor = result.body.get("cursor")
+        if not cursor:
+            return
+
+
+# Split `items` into lists of at most `size`
+def batches(items, size):
+    return [items[n:n + size] for n in range(0, len(items), size)]
+
+
+# Prints how many things have been done (orders created, customers deleted...),
+# every `every` of them
+class SeedProgress:
+    def __init__(self, total, description="orders created"):
+        self.total = total
+        self.description = description
+        self.every = max(1, min(1000, total // 10))
+        self.next_report = self.every
+        self.done = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, count=1):
+        with self.lock:
+            self.done += count
+            if self.done >= self.next_report or self.done == self.total:
+                while self.next_report <= self.done:
+                    self.next_report += self.every
+                rate = self.done / max(time.monotonic() - self.started, 1e-9)
+                print(f"  {self.done}/{self.total} {self.description} ({rate:.0f}/s)")
+
+
+# Generate sample order data, based on catalog objects (the seeded variations
+# by default).
+#
+# Order n is for variation n (round-robin), so by default there's one order for
+# every item variation.  Orders are created and paid for `concurrency` at a time,
+# each worker taking every `concurrency`th order.
+def seed_orders(count, concurrency, variations=None):
+    variations = variations or seeded_variations()
+    count = count or len(variations)
+    progress = SeedProgress(count)
+
+    def create_paid_orders(worker):
+        for n in range(worker, count, concurrency):
+            result = scheduler.call(
+                client.orders.create_order, body=build_order(variations[n % len(variations)])
+            )
+            if result.is_error():
+                handle_error("Seed orders", result.errors)
 
+            # A sale happens when a order is paid for, so generate a payment for each order
+            result = scheduler.call(client.payments.create_payment, body=build_payment(result.body["order"]))
+            if result.is_error():
+                handle_error("Seed orders", result.errors)
+            progress.add()
 
-# Generate sample order data, based on catalog objects
-def seed_orders():
-    # Find all the catalog items that we've seeded previously
-    result = client.catalog.search_catalog_objects(
-        body={
-            "object_types": ["ITEM_VARIATION"],
-            "query": {
-                "prefix_query": {
-                    "attribute_name": "sku",
-                    "attribute_prefix": SKU_PREFIX,
-                }
-            },
-        }
-    )
+    print("Creating " + str(count) + " orders and paying for them...")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(create_paid_orders, worker) for worker in range(concurrency)]:
+            future.result()
 
-    # Create an order for each item, varying the line item quantity for each
-    print("Creating " + str(len(result.body["objects"])) + " orders and paying for them...")
-    for x in result.body["objects"]:
-        # Increase the number of orders by changing the range value, currently we will create 1 order for every item variation
-        for _ in range(0, 1):
-            try:
-                result = client.orders.create_order(
-                    body={
-                        "order": {
-                            "location_id": location_id,
-                            "line_items": [
-                                {
-                                    "catalog_object_id": x["id"],
-                                    "quantity": str(fake.random_int(min=1, max=5)),
-                                    "base_price_money": {
-                                        "amount": x["item_variation_data"]["price_money"]["amount"],
-                                        "currency": "USD"
-                                    }
-                                }
-                            ],
-                            "source": {"name": SEED_DATA_REFERENCE_ID}
-                        }
-                    }
-                )
-
-                # A sale happens when a order is paid for, so generate a payment for each order
-                client.payments.create_payment(
-                    body={
-                        "order_id": result.body["order"]["id"],
-                        "idempotency_key": str(uuid.uuid4()),
-                        "source_id": "CASH",
-                        "amount_money": result.body["order"]["net_amount_due_money"],
-                        "cash_details": {
-                            "buyer_supplied_money": result.body["order"][
-                                "net_amount_due_money"
-                            ]
-                        },
-                    }
-                )
-
-            # In case of errors with CreateOrder...
-            except Exception:
-                handle_error("Seed orders", result.errors)
 
+# Generate sample order data with asyncio, creating and paying for up to
+# `concurrency` orders at a time over one pooled HTTP session
+async def seed_orders_async(count, concurrency, variations=None):
+    variations = variations or seeded_variations()
+    count = count or len(variations)
+    progress = SeedProgress(count)
 
-# Clear sample customer data (delete it)
-def clear_customers():
-    try:
-        # Find all of the seed data for customers
-        search_result = client.customers.search_customers(
-            body={
-                "query": {"filter": {"reference_id": {"exact": SEED_DATA_REFERENCE_ID}}}
-            }
-        )
-        if search_result.is_success():
-            if "customers" in search_result.body:
-                customer_ids = [obj['id'] for obj in search_result.body['customers']]
-                delete_result = client.customers.bulk_delete_customers(
-                    body={
-                        "customer_ids": customer_ids
-                    }
-                )
-                if delete_result.is_success():
-                    print("Successfully cleared customers")
-                else:
-                    handle_error("Bulk delete customers", delete_result.errors)
-            else:
-                print("No customers found")
-        else:
-            handle_error("Search customers", search_result.errors)
+    async_client = AsyncSquareClient(
+        os.environ["SQUARE_ACCESS_TOKEN"], os.environ["SQUARE_ENVIRONMENT"],
+        concurrency=concurrency, scheduler=scheduler,
+    )
 
-    except Exception as e:
-        handle_error("Clear customers", str(e))
+    async def create_paid_orders(worker):
+        for n in range(worker, count, concurrency):
+            order_result = await async_client.create_order(build_order(variations[n % len(variations)]))
+            if order_result.is_error():
+                handle_error("Seed orders", order_result.errors)
 
+            # A sale happens when a order is paid for, so generate a payment for each order
+            payment_result = await async_client.create_payment(build_payment(order_result.body["order"]))
+            if payment_result.is_error():
+                handle_error("Seed orders", payment_result.errors)
+            progress.add()
 
-# Clear sample catalog data (delete it)
-def clear_catalog():
+    print("Creating " + str(count) + " orders and paying for them...")
     try:
-        # Find all of the seed data for catalog objects
-        result = client.catalog.search_catalog_objects(body = {
-            "object_types": [
-                "ITEM_VARIATION"
-           ],
-            'query': {
-                'prefix_query': {
-                    'attribute_name': 'sku',
-                    'attribute_prefix': SKU_PREFIX
+        await asyncio.gather(*(create_paid_orders(worker) for worker in range(concurrency)))
+    finally:
+        await async_client.close()
+
+
+# The CreateOrder body for one seeded order of an item variation.
+#
+# The idempotency key is sent with every retry of the request, so a retried
+# request can't create a second order.  Square sets closed_at itself when the
+# order is paid, and it can't be set or backdated, so seeded orders always close
+# at the time they're seeded.
+def build_order(x):
+    order = {
+        "location_id": location_id,
+        "line_items": [
+            {
+                "catalog_object_id": x["id"],
+                "quantity": str(fake.random_int(min=1, max=5)),
+                "base_price_money": {
+                    "amount": x["item_variation_data"]["price_money"]["amount"],
+                    "currency": "USD"
                 }
             }
-        })
-        
-        # Delete each matching catalog object
-        if "objects" in result.body:
-            ids = []
-            item_ids = []
-
-            for x in result.body["objects"]:
-                ids.append(x["id"])
-                item_ids.append(x["item_variation_data"]["item_id"])
-
-            # delete the item variation data
-            client.catalog.batch_delete_catalog_objects(
-                body={"object_ids": ids}
-            )
-            # delete the item data
-            client.catalog.batch_delete_catalog_objects(
-                body={"object_ids": item_ids}
-            )
-
-            print("Successfully cleared catalog")
-        else:
-            print("No catalog items to delete")
-
-    # In case of errors with SearchCatalogObjects...
-    except Exception:
-        handle_error("Clear catalog", result.errors)
+        ],
+        "source": {"name": SEED_DATA_REFERENCE_ID}
+    }
+    return {"idempotency_key": str(uuid.uuid4()), "order": order}
+
+
+# The CreatePayment body that pays for an order in cash
+def build_payment(order):
+    return {
+        "order_id": order["id"],
+        "idempotency_key": str(uuid.uuid4()),
+        "source_id": "CASH",
+        "amount_money": order["net_amount_due_money"],
+        "cash_details": {
+            "buyer_supplied_money": order["net_amount_due_money"]
+        },
+    }
+
+
+# Run `action` on each batch, `concurrency` batches at a time, counting the
+# items done in `progress`.  `action` returns how many of the batch's items it
+# managed; any exception is raised here once the other batches have finished.
+def run_batches(action, batch_list, concurrency, progress):
+    def run(batch):
+        progress.add(action(batch))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run, batch) for batch in batch_list]:
+            future.result()
+
+
+# Clear sample customer data (delete it).  All of the seeded customers are found
+# first, then deleted in bulk, `concurrency` requests at a time.  (Deleting while
+# paging through the search would move the later pages under its cursor.)
+def clear_customers(concurrency):
+    body = {
+        "query": {"filter": {"reference_id": {"exact": SEED_DATA_REFERENCE_ID}}},
+        "limit": SEARCH_CUSTOMERS_LIMIT,
+    }
+    customer_ids = [
+        customer["id"]
+        for page in search_pages(client.customers.search_customers, body, "customers", "Search customers")
+        for customer in page
+    ]
+    if not customer_ids:
+        print("No customers found")
+        return
+
+    def delete(ids):
+        result = scheduler.call(client.customers.bulk_delete_customers, body={"customer_ids": ids})
+        if result.is_error():
+            handle_error("Bulk delete customers", result.errors)
+        return len(ids)
+
+    print(f"Deleting {len(customer_ids)} customers...")
+    progress = SeedProgress(len(customer_ids), "customers deleted")
+    run_batches(delete, batches(customer_ids, BULK_DELETE_CUSTOMERS_LIMIT), concurrency, progress)
+    print("Successfully cleared customers")
+
+
+# Clear sample catalog data (delete it).  Deleting an item also deletes its
+# variations, so only the seeded variations' items are deleted.  Square only
+# takes one catalog update at a time for an account, so the batches are deleted
+# one after another.
+def clear_catalog():
+    item_ids = list(dict.fromkeys(
+        variation["item_variation_data"]["item_id"] for variation in seeded_variations()
+    ))
+    if not item_ids:
+        print("No catalog items to delete")
+        return
+
+    def delete(ids):
+        result = scheduler.call(client.catalog.batch_delete_catalog_objects, body={"object_ids": ids})
+        if result.is_error():
+            handle_error("Batch delete catalog objects", result.errors)
+        return len(ids)
+
+    print(f"Deleting {len(item_ids)} catalog items and their variations...")
+    progress = SeedProgress(len(item_ids), "items deleted")
+    run_batches(delete, batches(item_ids, BATCH_DELETE_CATALOG_LIMIT), 1, progress)
+    print("Successfully cleared catalog")
+
+
+# Clear sample order data (orders can't be deleted, but they can be canceled).
+# There's no batch endpoint for updating orders, so they're canceled one at a
+# time, `concurrency` at once.
+def clear_orders(concurrency):
+    # Find all of the seeded orders that are still open (if any)
+    body = {
+        "location_ids": [location_id],
+        "query": {
+            "filter": {
+                "source_filter": {"source_names": [SEED_DATA_REFERENCE_ID]},
+                "state_filter": {"states": ["OPEN","DRAFT"]},
+            }
+        },
+        "limit": SEARCH_ORDERS_LIMIT,
+    }
+    orders = [
+        (order["id"], order["version"])
+        for page in search_pages(client.orders.search_orders, body, "orders", "Search orders")
+        for order in page
+    ]
+    if not orders:
+        print("No orders to cancel")
+        return
 
+    failed = []
 
-# Clear sample order data (orders can't be deleted, but they can be canceled)
-def clear_orders():
-    try:
-        # Find all of the seeded orders that are still open (if any)
-        result = client.orders.search_orders(
-            body={
-                "location_ids": [location_id],
-                "query": {
-                    "filter": {
-                        "source_filter": {"source_names": [SEED_DATA_REFERENCE_ID]},
-                        "state_filter": {"states": ["OPEN","DRAFT"]},
-                    }
-                },
-            }
-        )
-    # In case of errors with SearchOrders...
-    except Exception:
-        handle_error("Clear orders", result.errors)
-        
-    # Cancel them
-    if "orders" in result.body:
-        for x in result.body["orders"]:
-            result = client.orders.update_order(
-                order_id=x["id"],
-                body={"order": {"state": "CANCELED", "version": x["version"]}},
+    def cancel(batch):
+        canceled = 0
+        for order_id, version in batch:
+            result = scheduler.call(client.orders.update_order,
+                order_id=order_id,
+                body={"order": {"state": "CANCELED", "version": version}},
             )
             if result.is_success():
-                print("Order " + x["id"] + " canceled")
+                canceled += 1
             else:
-                print (result.errors[0]['detail'])
-                
-    else:
-        print("No orders to cancel")
+                failed.append((order_id, result.errors[0]['detail']))
+        return canceled
 
+    print(f"Canceling {len(orders)} orders...")
+    progress = SeedProgress(len(orders), "orders canceled")
+    batch_size = max(1, min(CANCEL_ORDERS_BATCH, -(-len(orders) // concurrency)))
+    run_batches(cancel, batches(orders, batch_size), concurrency, progress)
+    for order_id, detail in failed:
+        print("Order " + order_id + " couldn't be canceled: " + detail)
+    print(f"Canceled {len(orders) - len(failed)} orders")
 
 
 # Error handler
@@ -312,7 +493,8 @@ if __name__ == "__main__":
     load_dotenv()
 
     # We don't recommend running this script in a production environment
-    if os.environ['SQUARE_ENVIRONMENT'] != "sandbox":
+    # (The "custom" environment is for a local stub server, at SQUARE_BASE_URL)
+    if os.environ['SQUARE_ENVIRONMENT'] not in ("sandbox", "custom"):
         print("This script is intended for use with the Square Sandbox environment. Do not run this script in a production environment.")
         sys.exit(1)
 
@@ -321,13 +503,10 @@ if __name__ == "__main__":
         access_token=os.environ['SQUARE_ACCESS_TOKEN']
     ),
         environment=os.environ["SQUARE_ENVIRONMENT"],
+        custom_url=os.environ.get("SQUARE_BASE_URL", ""),
     )
 
 
-    # Use the main location of the account - retrieve_location('yourOtherLocationId') to use a different location
-    result = client.locations.retrieve_location('main')
-    location_id = result.body["location"]["id"]
-
     # Determine whether we're creating or clearing test data
     parser = argparse.ArgumentParser(
         description="Upload or remove test data",
@@ -335,21 +514,81 @@ if __name__ == "__main__":
     )
     parser.add_argument("--seed", action="store_true", help="Upload test data")
     parser.add_argument("--clear", action="store_true", help="Remove test data")
+    parser.add_argument(
+        "--catalog", default="seed-data-catalog.json",
+        help="Catalog file to seed from (default: seed-data-catalog.json)"
+    )
+    parser.add_argument(
+        "--catalog-copies", type=int, default=1,
+        help="Repeat the catalog's items this many times, for a catalog of production size (default: 1)"
+    )
+    parser.add_argument(
+        "--customers", type=int,
+        help="Number of customers to create (default: the ones in seed-data-customers.json)"
+    )
+    parser.add_argument(
+        "--orders", type=int,
+        help="Number of orders to create (default: one for each item variation)"
+    )
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true",
+        help="Create the seed orders with asyncio and aiohttp rather than threads"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8,
+        help="Number of requests to make at the same time when seeding or clearing data (default: 8)"
+    )
+    parser.add_argument(
+        "--stats", action="store_true",
+        help="Print API call counts, bytes, retries and latencies at the end"
+    )
+    parser.add_argument(
+        "--trace", help="Write a span for every API request to this file, as JSON lines"
+    )
 
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    # Rate limited requests are retried, and concurrency backs off while they are
+    scheduler = RequestScheduler(max_concurrency=args.concurrency)
+    trace = None
+    if args.trace:
+        trace = SpanFileWriter(args.trace)
+        scheduler.stats.subscribe(trace)
+
+    # Use the main location of the account - retrieve_location('yourOtherLocationId') to use a different location
+    result = scheduler.call(client.locations.retrieve_location, 'main')
+    location_id = result.body["location"]["id"]
 
     if args.seed and not args.clear:
-        seed_customers()
-        seed_catalog()
-        seed_inventory()
-        seed_orders()
+        # Customers don't depend on anything else, so they're created alongside
+        # the catalog.  Inventory counts and orders both need the catalog, and are
+        # created alongside each other once it's in.  All of the stages share the
+        # scheduler's --concurrency.
+        with ThreadPoolExecutor(max_workers=2) as stages:
+            customers = stages.submit(seed_customers, args.customers, args.concurrency)
+            variations = seed_catalog(args.catalog, args.catalog_copies)
+            inventory = stages.submit(seed_inventory, variations, args.concurrency)
+            if args.use_async:
+                asyncio.run(seed_orders_async(args.orders, args.concurrency, variations))
+            else:
+                seed_orders(args.orders, args.concurrency, variations)
+            customers.result()
+            inventory.result()
         print("Seed data upload complete.")
     elif args.clear and not args.seed:
         if (input("Are you sure? (y/N): ").lower()) == "y":
-            clear_customers()
+            clear_customers(args.concurrency)
             clear_catalog()
             # Note that inventory data persists and can't be deleted, or otherwise "cleared"
             # Note that completed orders can't be deleted - open or draft orders may be canceled
-            clear_orders()
+            clear_orders(args.concurrency)
     else:
         parser.print_usage()
+
+    if trace is not None:
+        trace.close()
+    if args.stats:
+        print("API calls:")
+        print(scheduler.stats.summary())
@@ -11,211 +11,2612 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import sys, os, argparse, datetime
+import sys, os, argparse, base64, contextlib, datetime, hashlib, hmac, io, itertools, json
+import threading, time, urllib.parse
+from array import array
+from collections import OrderedDict
 
-from square.client import Client
-from square.http.auth.o_auth_2 import BearerAuthCredentials
-from dotenv import load_dotenv
-from prettytable import PrettyTable
-from collections import defaultdict
-import csv
+# The Square SDK, NumPy, PrettyTable, pyarrow and square_transport (which loads
+# requests) are imported in the functions that use them, so --help and mistyped
+# arguments don't wait for them.  So are the standard modules that only some runs
+# need: asyncio, concurrent.futures, csv, decimal, http.server, multiprocessing,
+# sqlite3 and tempfile.
 
 SEED_DATA_REFERENCE_ID = "SEED_DATA"
 
-# Process all the orders between start_date and end_date
-def get_orders():
-    limit = 25  # max number of orders per page
+# Where the main location's id is kept after it's first looked up
+LOCATION_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "simple-sales-report", "locations.json")
 
+# Maximum number of orders SearchOrders will return per page
+ORDERS_PAGE_LIMIT = 1000
+# Maximum number of locations one SearchOrders request can cover
+SEARCH_LOCATIONS_LIMIT = 10
+
+
+# Where a run spends its time.  Each stage's time is added up over every thread
+# it runs on, and paging and enrichment overlap, so the stages can add up to more
+# than the run's elapsed time.  Also counts the orders and line items tallied,
+# and how many pages each search of the orders took.
+# With `stats` set (to the scheduler's CallStats), each stage is also passed to
+# its span hooks, and the API call statistics are included in the results.
+class RunTimings:
+    STAGES = ("paging", "aggregation", "enrichment", "report")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.orders = 0
+        self.line_items = 0
+        self.search_pages = []
+        self.stats = None
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.seconds[name] += elapsed
+            if self.stats is not None and self.stats.hooks:
+                from square_transport import Span
+                self.stats.emit(Span("stage", name, started_at, elapsed, None, 0, 0))
+
+    # One search of the orders finished, after `pages` pages
+    def searched(self, pages):
+        with self.lock:
+            self.search_pages.append(pages)
+
+    def count(self, orders):
+        line_items = sum(len(order.get("line_items", ())) for order in orders)
+        with self.lock:
+            self.orders += len(orders)
+            self.line_items += line_items
+
+    # The timings and API call statistics of a shard, to send back from a worker
+    # process or save in a shard file, and add to the run's with add_partial()
+    def partial(self):
+        with self.lock:
+            return {
+                "stage_seconds": dict(self.seconds),
+                "orders": self.orders,
+                "line_items": self.line_items,
+                "search_pages": list(self.search_pages),
+                "api": self.stats.to_dict() if self.stats is not None else {},
+            }
+
+    def add_partial(self, partial):
+        with self.lock:
+            for name, seconds in partial["stage_seconds"].items():
+                self.seconds[name] += seconds
+            self.orders += partial["orders"]
+            self.line_items += partial["line_items"]
+            self.search_pages.extend(partial["search_pages"])
+        if self.stats is not None:
+            self.stats.add(partial["api"])
+
+    # The run's timings, throughput and peak memory, as saved by --timings
+    def results(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "stage_seconds": {name: round(seconds, 3) for name, seconds in self.seconds.items()},
+            "orders": self.orders,
+            "line_items": self.line_items,
+            "line_items_per_second": round(self.line_items / elapsed, 1) if elapsed else None,
+            "peak_memory_bytes": peak_memory(),
+            "searches": len(self.search_pages),
+            "max_pages_per_search": max(self.search_pages, default=0),
+            "api": self.stats.to_dict() if self.stats is not None else None,
+        }
+
+    # The --stats summary: API calls, pagination and local processing time
+    def summary(self):
+        results = self.results()
+        lines = [
+            "API calls:",
+            self.stats.summary(),
+            "",
+            f"Order searches: {results['searches']} "
+            f"({sum(self.search_pages)} pages, at most {results['max_pages_per_search']} in one search)",
+            f"Orders: {self.orders}, line items: {self.line_items} "
+            f"({results['line_items_per_second']} line items/s)",
+            "Time by stage (added up over threads): " + ", ".join(
+                f"{name} {seconds}s" for name, seconds in results["stage_seconds"].items()
+            ),
+            f"Elapsed: {results['elapsed_seconds']}s",
+        ]
+        if results["peak_memory_bytes"] is not None:
+            lines.append(f"Peak memory: {results['peak_memory_bytes'] / 2**20:.1f} MB")
+        return "\n".join(lines)
+
+
+# The most memory the process has used so far, in bytes (None where unknown)
+def peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+timings = RunTimings()
+
+
+# Build the SearchOrders request body for some locations and one closed_at range.
+# The body is built once per range; only the cursor changes between pages.
+def build_search_body(locations, start_at, end_at):
+    return {
+        "location_ids": locations,
+        "limit": ORDERS_PAGE_LIMIT,
+        "query": {
+            "filter": {
+                "source_filter": {"source_names": [SEED_DATA_REFERENCE_ID]},
+                "state_filter": {"states": ["COMPLETED"]},
+                "date_time_filter": {
+                    "closed_at": {"start_at": start_at, "end_at": end_at}
+                },
+            },
+            "sort": {"sort_field": "CLOSED_AT"},
+        },
+    }
+
+
+# Parse an RFC 3339 timestamp; timestamps without an offset are treated as UTC
+def parse_timestamp(value):
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+# Split the report window into `shards` consecutive closed_at ranges.
+# The outer bounds keep the dates exactly as they were given on the command line.
+def split_date_range(start_at, end_at, shards):
+    start_dt = parse_timestamp(start_at)
+    end_dt = parse_timestamp(end_at)
+    step = (end_dt - start_dt) / shards
+    if shards <= 1 or step <= datetime.timedelta(0):
+        return [(start_at, end_at)]
+
+    boundaries = [(start_dt + step * i).isoformat() for i in range(1, shards)]
+    starts = [start_at] + boundaries
+    ends = boundaries + [end_at]
+    return list(zip(starts, ends))
+
+
+# Split the locations into groups that fit in one SearchOrders request, and the
+# date range into `shards` closed_at ranges.  Each (locations, start, end, last shard)
+# task is paged on its own; the tasks for each group of locations are in closed_at order.
+def shard_tasks(locations, start_at, end_at, shards):
+    ranges = split_date_range(start_at, end_at, shards)
+    last = len(ranges) - 1
+    return [
+        (locations[i:i + SEARCH_LOCATIONS_LIMIT], range_start, range_end, n == last)
+        for i in range(0, len(locations), SEARCH_LOCATIONS_LIMIT)
+        for n, (range_start, range_end) in enumerate(ranges)
+    ]
+
+
+# Running totals for one catalog item variation.
+# Slots keep each accumulator small, however many line items are folded into it.
+class ItemTotals:
+    __slots__ = (
+        "order_id", "name", "variation_name", "qty_sold", "sales_total",
+        "sku", "price_each", "qty_remaining",
+    )
+
+    def __init__(self, order_id):
+        self.order_id = order_id  # the first order this item was sold in
+        self.name = None
+        self.variation_name = None
+        self.qty_sold = 0
+        self.sales_total = 0  # in the smallest currency unit (cents)
+        self.sku = None
+        self.price_each = None
+        self.qty_remaining = None
+
+    def copy(self):
+        item = ItemTotals(self.order_id)
+        for slot in ItemTotals.__slots__:
+            setattr(item, slot, getattr(self, slot))
+        return item
+
+
+# Per-item sales totals, keyed by catalog_object_id.
+# Pages of orders are folded in as they arrive, so memory grows with the number
+# of distinct items rather than the number of line items.
+class ItemTally:
+    def __init__(self):
+        self.totals = {}
+
+    def __contains__(self, item_id):
+        return item_id in self.totals
+
+    def __getitem__(self, item_id):
+        return self.totals[item_id]
+
+    def __iter__(self):
+        return iter(self.totals)
+
+    def __len__(self):
+        return len(self.totals)
+
+    def values(self):
+        return self.totals.values()
+
+    # Add the line items from a page of orders.
+    # Returns the ids of items that weren't in the tally before.
+    def add_orders(self, orders):
+        totals = self.totals
+        new_ids = []
+        # Walk through each order on the current page
+        for order in orders:
+            # No items here.  Next...
+            if "line_items" not in order:
+                print("This order doesn't have any line items")
+                continue
+
+            for line_item in order["line_items"]:
+                item_id = line_item.get("catalog_object_id")
+                if item_id is None:
+                    # No catalog info available (an ad hoc item, perhaps?)
+                    print("This line item doesn't have a catalog_object_id")
+                    continue
+
+                item = totals.get(item_id)
+                if item is None:
+                    item = totals[item_id] = ItemTotals(order["id"])
+                    new_ids.append(item_id)
+                quantity = int(line_item["quantity"])
+                item.qty_sold += quantity
+                item.sales_total += int(line_item["base_price_money"]["amount"]) * quantity
+                # The report shows the names from the most recent line item
+                item.name = line_item["name"]
+                item.variation_name = line_item["variation_name"]
+
+        return new_ids
+
+    # The tally as JSON-friendly rows, in the order the items were first sold
+    def to_rows(self):
+        return [
+            [item_id, item.order_id, item.name, item.variation_name, item.qty_sold, item.sales_total]
+            for item_id, item in self.totals.items()
+        ]
+
+    @staticmethod
+    def from_rows(rows):
+        tally = ItemTally()
+        for item_id, order_id, name, variation_name, qty_sold, sales_total in rows:
+            item = tally.totals[item_id] = ItemTotals(order_id)
+            item.name = name
+            item.variation_name = variation_name
+            item.qty_sold = qty_sold
+            item.sales_total = sales_total
+        return tally
+
+    # Fold another tally into this one.  The other tally must cover later orders,
+    # so that the first order id and the latest names are kept.
+    # Pass copy=True if the other tally is still going to be used.
+    def merge(self, other, copy=False):
+        totals = self.totals
+        for item_id, theirs in other.totals.items():
+            item = totals.get(item_id)
+            if item is None:
+                totals[item_id] = theirs.copy() if copy else theirs
+            else:
+                item.qty_sold += theirs.qty_sold
+                item.sales_total += theirs.sales_total
+                item.name = theirs.name
+                item.variation_name = theirs.variation_name
+
+
+# The dimensions the report can be grouped by with --group-by
+GROUP_BY_DIMENSIONS = ("variation", "day", "hour", "category", "location")
+
+SECONDS_PER_DAY = 86400
+SECONDS_PER_HOUR = 3600
+
+
+# Line items decoded into columns, for the --group-by report.
+# Each line item is a row of five 64-bit integers - quantity, amount in cents,
+# variation index, closed_at (Unix seconds) and location index - so the columns
+# stay compact and can be grouped with NumPy without copying.
+# With a spill_threshold, the columns are written out to a temporary file
+# whenever they reach that many rows, so memory stays bounded however many line
+# items there are; they're read back a chunk at a time when grouped.
+class LineItemColumns:
+    COLUMNS = ("quantity", "amount", "variation", "closed_at", "location")
+
+    def __init__(self, spill_threshold=None):
+        self.lock = threading.Lock()
+        self.spill_threshold = spill_threshold
+        self.spill_file = None
+        self.spilled = []  # the number of rows in each spilled chunk
+        self.quantity = array("q")
+        self.amount = array("q")
+        self.variation = array("q")
+        self.closed_at = array("q")
+        self.location = array("q")
+
+        self.variation_ids = []
+        self.variation_index = {}
+        self.variation_names = []  # (name, variation_name), from the latest line item
+        self.variation_named_at = []  # (closed_at, order id) of that line item
+        self.location_ids = []
+        self.location_index = {}
+
+    def __len__(self):
+        return sum(self.spilled) + len(self.quantity)
+
+    def index_of(self, index, ids, key):
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(ids)
+            ids.append(key)
+            if ids is self.variation_ids:
+                self.variation_names.append(None)
+                self.variation_named_at.append(None)
+        return code
+
+    # Add the line items from a page of orders
+    def add_orders(self, orders):
+        rows = []
+        for order in orders:
+            if "line_items" not in order:
+                continue
+            closed_at = int(parse_timestamp(order["closed_at"]).timestamp())
+            named_at = (order["closed_at"], order["id"])
+            location = order.get("location_id")
+            for line_item in order["line_items"]:
+                if "catalog_object_id" not in line_item:
+                    continue
+                quantity = int(line_item["quantity"])
+                rows.append((
+                    line_item["catalog_object_id"],
+                    line_item["name"],
+                    line_item["variation_name"],
+                    quantity,
+                    int(line_item["base_price_money"]["amount"]) * quantity,
+                    closed_at,
+                    location,
+                    named_at,
+                ))
+
+        with self.lock:
+            for item_id, name, variation_name, quantity, amount, closed_at, location, named_at in rows:
+                variation = self.index_of(self.variation_index, self.variation_ids, item_id)
+                # Pages from different shards arrive in any order, so the names
+                # are kept from the line item that was closed last
+                if self.variation_named_at[variation] is None or named_at > self.variation_named_at[variation]:
+                    self.variation_names[variation] = (name, variation_name)
+                    self.variation_named_at[variation] = named_at
+                self.quantity.append(quantity)
+                self.amount.append(amount)
+                self.variation.append(variation)
+                self.closed_at.append(closed_at)
+                self.location.append(self.index_of(self.location_index, self.location_ids, location))
+            if self.spill_threshold and len(self.quantity) >= self.spill_threshold:
+                self.spill()
+
+    # Write the rows in memory to the spill file, and start again with empty columns
+    def spill(self):
+        if self.spill_file is None:
+            import tempfile
+            self.spill_file = tempfile.TemporaryFile()
+        self.spill_file.seek(0, os.SEEK_END)
+        self.spilled.append(len(self.quantity))
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            column.tofile(self.spill_file)
+            del column[:]
+
+    # The line items as (quantity, amount, variation, closed_at, location) NumPy
+    # arrays, a chunk at a time: each spilled chunk, then the rows still in memory
+    def chunks(self):
+        import numpy as np
+        if self.spill_file is not None:
+            self.spill_file.seek(0)
+            for rows in self.spilled:
+                yield tuple(np.fromfile(self.spill_file, dtype=np.int64, count=rows) for _ in self.COLUMNS)
+        if len(self.quantity):
+            yield tuple(np.frombuffer(getattr(self, name), dtype=np.int64) for name in self.COLUMNS)
+
+
+# Group the line items by the given dimensions, with vectorised NumPy operations.
+# `categories` maps variation ids to category names (needed for "category").
+# Returns the label columns for each dimension, and the quantity and sales
+# total (in cents) for each group, sorted by the group keys.  Variation and
+# location codes are handed out as line items arrive, which differs between
+# runs with --shards, so they're renumbered in id order to sort the groups the
+# same way every time.
+def group_line_items(columns, dimensions, categories=None):
+    import numpy as np
+    variation_ids = sorted(columns.variation_ids)
+    variation_rank = id_ranks(columns.variation_ids, variation_ids)
+    location_ids = sorted(columns.location_ids)
+    location_rank = id_ranks(columns.location_ids, location_ids)
+    if "category" in dimensions:
+        category_names = sorted(set(categories.values()))
+        category_codes = np.array([
+            category_names.index(categories[item_id]) for item_id in columns.variation_ids
+        ], dtype=np.int64)
+
+    # Group each chunk of line items, then group the chunks' groups together
+    chunk_keys, chunk_quantity, chunk_sales_total = [], [], []
+    for quantity, amount, variation, closed_at, location in columns.chunks():
+        codes = []
+        for dimension in dimensions:
+            if dimension == "variation":
+                codes.append(variation_rank[variation])
+            elif dimension == "day":
+                codes.append(closed_at // SECONDS_PER_DAY)
+            elif dimension == "hour":
+                codes.append(closed_at // SECONDS_PER_HOUR)
+            elif dimension == "category":
+                codes.append(category_codes[variation])
+            elif dimension == "location":
+                codes.append(location_rank[location])
+        keys, quantity, sales_total = sum_groups(np.stack(codes, axis=1), quantity, amount)
+        chunk_keys.append(keys)
+        chunk_quantity.append(quantity)
+        chunk_sales_total.append(sales_total)
+
+    if len(chunk_keys) == 1:
+        keys, quantity, sales_total = chunk_keys[0], chunk_quantity[0], chunk_sales_total[0]
+    else:
+        keys, quantity, sales_total = sum_groups(
+            np.concatenate(chunk_keys), np.concatenate(chunk_quantity), np.concatenate(chunk_sales_total)
+        )
+
+    labels = []
+    for position, dimension in enumerate(dimensions):
+        key = keys[:, position]
+        if dimension == "variation":
+            labels.append([
+                " - ".join(columns.variation_names[columns.variation_index[variation_ids[code]]]) for code in key
+            ])
+        elif dimension == "day":
+            labels.append([
+                datetime.datetime.fromtimestamp(code * SECONDS_PER_DAY, datetime.timezone.utc).strftime("%Y-%m-%d")
+                for code in key
+            ])
+        elif dimension == "hour":
+            labels.append([
+                datetime.datetime.fromtimestamp(code * SECONDS_PER_HOUR, datetime.timezone.utc).strftime("%Y-%m-%d %H:00")
+                for code in key
+            ])
+        elif dimension == "category":
+            labels.append([category_names[code] for code in key])
+        elif dimension == "location":
+            labels.append([location_ids[code] for code in key])
+    return labels, quantity, sales_total
+
+
+# For each of `ids`, its position in `sorted_ids`, as a NumPy array
+def id_ranks(ids, sorted_ids):
+    import numpy as np
+    position = {item_id: rank for rank, item_id in enumerate(sorted_ids)}
+    return np.array([position[item_id] for item_id in ids], dtype=np.int64)
+
+
+# The distinct rows of `keys`, sorted, with the quantity and amount of each summed
+def sum_groups(keys, quantity, amount):
+    import numpy as np
+    keys, groups = np.unique(keys, axis=0, return_inverse=True)
+    groups = groups.reshape(-1)
+    quantity_sums = np.zeros(len(keys), dtype=np.int64)
+    amount_sums = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(quantity_sums, groups, quantity)
+    np.add.at(amount_sums, groups, amount)
+    return keys, quantity_sums, amount_sums
+
+
+# Page through every order for some locations in one closed_at range, starting
+# from `cursor` if it's given.  Yields each page of orders along with the cursor
+# for the next page (None after the last page).
+def search_order_pages(locations, start_at, end_at, last_shard, cursor=None):
+    body = build_search_body(locations, start_at, end_at)
+    end_dt = parse_timestamp(end_at)
+    if cursor:
+        body["cursor"] = cursor
+
+    pages = 0
+    while True:
+        with timings.stage("paging"):
+            result = scheduler.call(
+                order_session.send, "POST", "/v2/orders/search", body,
+                decode=decode_order_page, endpoint="search_orders",
+            )
+        pages += 1
+        cursor = next_cursor(result)
+        yield page_orders(result, end_dt, last_shard), cursor
+
+        # If the previous call returned a cursor, then get the next page of orders
+        if cursor:
+            body["cursor"] = cursor
+        # If there isn't a cursor, then we're done getting orders
+        else:
+            break
+    timings.searched(pages)
+
+
+# The cursor for the page after this one, or None if this is the last page
+def next_cursor(result):
+    if "orders" in result.body and result.cursor:
+        return result.cursor
+    return None
+
+
+# The orders on one page of SearchOrders results
+def page_orders(result, end_dt, last_shard):
+    # In case of errors with SearchOrders...
+    if result.is_error():
+        handle_error(result.errors)
+
+    orders = result.body.get("orders", [])
+    # An order closed exactly on a shard boundary belongs to the next shard
+    if not last_shard:
+        orders = [
+            order for order in orders
+            if parse_timestamp(order["closed_at"]) < end_dt
+        ]
+    return orders
+
+
+# Split a page of orders up by location, keeping them in closed_at order
+def group_by_location(locations, orders):
+    if len(locations) == 1:
+        return {locations[0]: orders}
+    groups = {}
+    for order in orders:
+        groups.setdefault(order["location_id"], []).append(order)
+    return groups
+
+
+# Page through every order for some locations in one closed_at range, and tally
+# each location separately.  New item ids are handed to the enrichment as soon as
+# each page is tallied.  With a checkpoint, the shard's progress is saved as it
+# goes, and a shard that was already started picks up where it left off.
+def get_order_shard(index, locations, start_at, end_at, last_shard, enrichment, checkpoint=None):
+    tallies, cursor, done = restore_shard(index, enrichment, checkpoint)
+    if done:
+        return tallies
+
+    for orders, cursor in search_order_pages(locations, start_at, end_at, last_shard, cursor):
+        tally_page(locations, orders, tallies, enrichment)
+        if checkpoint is not None:
+            checkpoint.page_done(index, cursor, tallies)
+    return tallies
+
+
+# The tallies, cursor and whether it's finished, for a shard saved in the checkpoint
+def restore_shard(index, enrichment, checkpoint):
+    saved = checkpoint.restore(index) if checkpoint is not None else None
+    if saved is None:
+        return {}, None, False
+
+    tallies, cursor, done = saved
+    for tally in tallies.values():
+        enrichment.add(list(tally))
+    return tallies, cursor, done
+
+
+# Tally a page of orders into the tally for each order's location
+# (without an enrichment, the new item ids are left for whoever merges the tallies)
+def tally_page(locations, orders, tallies, enrichment):
+    with timings.stage("aggregation"):
+        timings.count(orders)
+        for location, location_orders in group_by_location(locations, orders).items():
+            tally = tallies.setdefault(location, ItemTally())
+            new_ids = tally.add_orders(location_orders)
+            if enrichment is not None:
+                enrichment.add(new_ids)
+        if line_item_columns is not None:
+            line_item_columns.add_orders(orders)
+
+
+# Page through every order in one closed_at range, storing each page in the cache
+# (keeping only what the report reads) as it arrives
+def sync_order_shard(cache, locations, start_at, end_at, last_shard):
+    for orders, _ in search_order_pages(locations, start_at, end_at, last_shard):
+        cache.store([compact_order(order) for order in orders])
+
+
+# Run `fetch` over each (locations, start, end, last shard) task, `workers` tasks
+# at a time.  The results come back in the same order as the tasks.
+def run_shards(fetch, tasks, workers):
+    if len(tasks) == 1:
+        return [fetch(*tasks[0])]
+
+    from concurrent.futures import ThreadPoolExecutor
+    print("Paging", len(tasks), "location and closed_at ranges with", workers, "workers...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda task: fetch(*task), tasks))
+
+
+# The order and line item fields the report uses
+ORDER_FIELDS = ("id", "location_id", "closed_at")
+LINE_ITEM_FIELDS = ("catalog_object_id", "quantity", "base_price_money", "name", "variation_name")
+
+
+# Strip an order down to the fields the report reads
+def compact_order(order):
+    compact = {key: order[key] for key in ORDER_FIELDS if key in order}
+    if "line_items" in order:
+        compact["line_items"] = [
+            {key: line_item[key] for key in LINE_ITEM_FIELDS if key in line_item}
+            for line_item in order["line_items"]
+        ]
+    return compact
+
+
+# Decode a page of SearchOrders results from the response bytes, keeping only
+# what the report reads.  Orders come with their taxes, discounts, fulfillments,
+# tenders and more, so the rest of each order is dropped as soon as the page is
+# parsed (with orjson, if it's installed), rather than being built into the
+# SDK's objects and held until the page has been tallied.
+def decode_order_page(data):
+    from square_transport import json_loads
+    page = json_loads(data)
+    if "orders" in page:
+        page["orders"] = [compact_order(order) for order in page["orders"]]
+    return page
+
+
+# Format a timestamp so that stored timestamps sort in time order
+def timestamp_key(dt):
+    return dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+# Recently closed orders may not be searchable yet, so the sync watermark
+# never moves closer to the present than this
+ORDER_SYNC_SETTLE_TIME = datetime.timedelta(minutes=5)
+
+
+# A local SQLite store of completed orders.
+# Completed orders don't change, so once a closed_at range has been synced for a
+# location it is answered locally, and only orders closed after the watermark
+# (or before the earliest synced date) are fetched again.
+class OrderCache:
+    def __init__(self, path):
+        import sqlite3
+        # Pages are stored from the worker threads as they arrive, one at a time
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS orders (
+                id TEXT PRIMARY KEY,
+                location_id TEXT NOT NULL,
+                closed_at TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS orders_by_location_closed_at
+                ON orders (location_id, closed_at);
+            CREATE TABLE IF NOT EXISTS order_sync (
+                location_id TEXT PRIMARY KEY,
+                synced_from TEXT NOT NULL,
+                synced_to TEXT NOT NULL
+            );
+            """
+        )
+
+    def sync_range(self, location_id):
+        return self.db.execute(
+            "SELECT synced_from, synced_to FROM order_sync WHERE location_id = ?",
+            (location_id,),
+        ).fetchone()
+
+    # The closed_at ranges that have to be fetched before start_at..end_at can be
+    # answered locally.  The synced range is kept contiguous.
+    def missing_ranges(self, location_id, start_at, end_at):
+        synced = self.sync_range(location_id)
+        if synced is None:
+            return [(start_at, end_at)]
+
+        start_key = timestamp_key(parse_timestamp(start_at))
+        end_key = timestamp_key(parse_timestamp(end_at))
+        synced_from, synced_to = synced
+        ranges = []
+        if start_key < synced_from:
+            ranges.append((start_at, synced_from))
+        if end_key > synced_to:
+            ranges.append((synced_to, end_at))
+        return ranges
+
+    def store(self, orders):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO orders (id, location_id, closed_at, data) VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        order["id"],
+                        order["location_id"],
+                        timestamp_key(parse_timestamp(order["closed_at"])),
+                        json.dumps(order),
+                    )
+                    for order in orders
+                ),
+            )
+
+    # Record that every order closed between start_at and end_at is stored
+    def mark_synced(self, location_id, start_at, end_at):
+        watermark = datetime.datetime.now(datetime.timezone.utc) - ORDER_SYNC_SETTLE_TIME
+        start_key = timestamp_key(parse_timestamp(start_at))
+        end_key = timestamp_key(min(parse_timestamp(end_at), watermark))
+
+        synced = self.sync_range(location_id)
+        if synced is not None:
+            start_key = min(start_key, synced[0])
+            end_key = max(end_key, synced[1])
+        end_key = max(start_key, end_key)
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO order_sync (location_id, synced_from, synced_to) VALUES (?, ?, ?)",
+            (location_id, start_key, end_key),
+        )
+        self.db.commit()
+
+    # Read the stored orders closed between start_at and end_at, a page at a time
+    def order_pages(self, location_id, start_at, end_at):
+        cursor = self.db.execute(
+            "SELECT data FROM orders WHERE location_id = ? AND closed_at >= ? AND closed_at <= ? "
+            "ORDER BY closed_at, id",
+            (
+                location_id,
+                timestamp_key(parse_timestamp(start_at)),
+                timestamp_key(parse_timestamp(end_at)),
+            ),
+        )
+        while True:
+            rows = cursor.fetchmany(ORDERS_PAGE_LIMIT)
+            if not rows:
+                break
+            yield [json.loads(row[0]) for row in rows]
+
+
+# The tasks that fetch the orders the cache is missing for the report window
+def cache_sync_tasks(cache, shards):
+    # Locations that are missing the same closed_at range are fetched together
+    missing = {}
+    for location in location_ids:
+        for missing_range in cache.missing_ranges(location, start_date, end_date):
+            missing.setdefault(missing_range, []).append(location)
+
+    tasks = []
+    for (start_at, end_at), locations in missing.items():
+        print("Syncing orders closed from", start_at, "to", end_at, "for", len(locations), "location(s)...")
+        tasks.extend(shard_tasks(locations, start_at, end_at, shards))
+    return tasks
+
+
+# Tally the whole report window from the cache, once the missing orders are stored
+def tally_cached_orders(cache, enrichment):
+    for location in location_ids:
+        cache.mark_synced(location, start_date, end_date)
+
+    for location in location_ids:
+        for orders in cache.order_pages(location, start_date, end_date):
+            with timings.stage("aggregation"):
+                timings.count(orders)
+                enrichment.add(location_tallies[location].add_orders(orders))
+                if line_item_columns is not None:
+                    line_item_columns.add_orders(orders)
+
+
+# Fetch the orders the cache is missing for the report window, then tally the
+# whole window from the cache
+def get_cached_orders(cache, shards, workers, enrichment):
+    tasks = cache_sync_tasks(cache, shards)
+    if tasks:
+        run_shards(lambda *task: sync_order_shard(cache, *task), tasks, workers)
+    tally_cached_orders(cache, enrichment)
+
+
+# How often each shard's progress is saved to the checkpoint file, in seconds
+CHECKPOINT_INTERVAL = 10
+
+
+# Saves the progress of a report run to a JSON file, so that a run that dies part
+# way through can be picked up again with --resume.  For each shard it keeps the
+# cursor for the next page and the tallies so far.  A checkpoint is only used for
+# a run with the same dates, locations and number of shards.
+class Checkpoint:
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.lock = threading.Lock()
+        self.shards = {}  # shard index -> saved progress
+        self.saved_at = {}  # shard index -> when it was last saved
+        self.started_at = time.time()
+
+    # Load the checkpoint file left by an earlier run, if it's for this report
+    def load(self):
+        if not os.path.exists(self.path):
+            print("No checkpoint found at", self.path, "- starting from the beginning")
+            return
+        with open(self.path) as file:
+            saved = json.load(file)
+        if saved["params"] != self.params:
+            print("The checkpoint at", self.path, "is for a different report - starting from the beginning")
+            return
+        self.shards = {int(index): shard for index, shard in saved["shards"].items()}
+        done = sum(1 for shard in self.shards.values() if shard["done"])
+        print("Resuming from", self.path, "-", done, "shard(s) done,", len(self.shards) - done, "part way through")
+
+    def restore(self, index):
+        shard = self.shards.get(index)
+        if shard is None:
+            return None
+        tallies = {
+            location: ItemTally.from_rows(rows) for location, rows in shard["tallies"].items()
+        }
+        return tallies, shard["cursor"], shard["done"]
+
+    # Record that a page has been tallied.  The shard's progress is saved every
+    # CHECKPOINT_INTERVAL seconds, and when the shard is finished (cursor is None).
+    def page_done(self, index, cursor, tallies):
+        now = time.time()
+        if cursor is not None and now - self.saved_at.get(index, self.started_at) < CHECKPOINT_INTERVAL:
+            return
+        shard = {
+            "cursor": cursor,
+            "done": cursor is None,
+            "tallies": {location: tally.to_rows() for location, tally in tallies.items()},
+        }
+        with self.lock:
+            self.shards[index] = shard
+            self.saved_at[index] = now
+            self.save()
+
+    def save(self):
+        # Write to a temporary file first, so a crash can't leave a half-written checkpoint
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"params": self.params, "shards": self.shards}, file)
+        os.replace(temp_path, self.path)
+
+    # The run finished, so there's nothing to resume
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Merge the tallies from each shard into the location tallies.
+# The shards come back in closed_at order, whichever finished first,
+# so merging them gives the same tallies as paging serially.
+def merge_shards(results):
+    with timings.stage("aggregation"):
+        for tallies in results:
+            for location, tally in tallies.items():
+                location_tallies[location].merge(tally)
+
+
+# Process-pool shards (--processes) and shard files (--part and --merge).
+#
+# Decoding and tallying orders is limited to one core by the GIL, however many
+# threads page them.  With --processes, each (locations, closed_at range) task is
+# paged and tallied in a worker process, which sends back a partial aggregate:
+# the task's tallies for each location as rows (as a checkpoint keeps them), and
+# its timings and API call statistics.  The parent merges the partials in task
+# order, which gives the same tallies as paging serially, and enriches the items
+# once.  A run with --part K/N tallies only the Kth of N blocks of the tasks and
+# saves its partial in a shard file, so the parts can run on different machines;
+# --merge then adds up the shard files of every part and writes the report.
+
+# Set up a worker process.  A spawned process starts without the session and
+# scheduler the main block sets up, so each gets its own.
+def init_shard_process(max_retries):
+    from square_transport import RequestScheduler, SquareSession
+    global order_session, scheduler, line_item_columns
+    order_session = SquareSession(
+        os.environ["SQUARE_ACCESS_TOKEN"], os.environ["SQUARE_ENVIRONMENT"], pool_size=1
+    )
+    scheduler = RequestScheduler(max_concurrency=1, max_retries=max_retries)
+    line_item_columns = None
+
+
+# The partial aggregate of some shards: the tallies of each location as rows,
+# and the timings and API call statistics of the work that went into them
+def shard_partial(tallies):
+    return {
+        "tallies": {location: tally.to_rows() for location, tally in tallies.items()},
+        "timings": timings.partial(),
+    }
+
+
+# Page and tally one (locations, start, end, last shard) task in a worker process
+def tally_shard_process(locations, start_at, end_at, last_shard):
+    from square_transport import RequestScheduler
+    global timings, scheduler
+    # Fresh timings and statistics for each task, so each is only counted once
+    timings = RunTimings()
+    scheduler = RequestScheduler(max_concurrency=1, max_retries=scheduler.max_retries)
+    timings.stats = scheduler.stats
+    tallies = {}
+    for orders, _ in search_order_pages(locations, start_at, end_at, last_shard):
+        tally_page(locations, orders, tallies, None)
+    return shard_partial(tallies)
+
+
+# Run the tasks in `processes` worker processes, yielding their partials in task order
+def run_shard_processes(tasks, processes):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    print("Paging", len(tasks), "location and closed_at ranges with", processes, "processes...")
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_shard_process, initargs=(scheduler.max_retries,),
+    ) as executor:
+        yield from executor.map(tally_shard_process, *zip(*tasks))
+
+
+# Merge partials, in closed_at order, into the location tallies, handing their
+# items to the enrichment (if there is one) as each is merged
+def merge_partials(partials, enrichment=None):
+    for partial in partials:
+        timings.add_partial(partial["timings"])
+        tallies = {location: ItemTally.from_rows(rows) for location, rows in partial["tallies"].items()}
+        if enrichment is not None:
+            for tally in tallies.values():
+                enrichment.add(list(tally))
+        merge_shards([tallies])
+
+
+# The tasks in part `part` (counting from 1) of `parts`.  The date range is split
+# into at least `parts` closed_at ranges, and each part is a block of the tasks.
+def part_tasks(part, parts, shards):
+    tasks = shard_tasks(location_ids, start_date, end_date, max(shards, parts))
+    return tasks[len(tasks) * (part - 1) // parts:len(tasks) * part // parts]
+
+
+# What a shard file's report covers; every part of a report must match
+def shard_file_params(parts, shards):
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "locations": location_ids,
+        "shards": max(shards, parts),
+        "parts": parts,
+    }
+
+
+# Page and tally one part of the report (--part), on threads or in worker
+# processes, and save its partial aggregate in a shard file, without enriching it
+def write_shard_file(path, part, parts, shards=1, workers=1, processes=0):
+    print("Retrieving part", part, "of", parts, "of the orders from", start_date, "to", end_date, "...")
+    tasks = part_tasks(part, parts, shards)
+    if processes:
+        merge_partials(run_shard_processes(tasks, processes))
+    else:
+        merge_shards(run_shards(lambda *task: get_order_shard(None, *task, None), tasks, workers))
+
+    shard = dict(shard_file_params(parts, shards), part=part, **shard_partial(location_tallies))
+    # Write to a temporary file first, so a crash can't leave a half-written shard file
+    with open(path + ".tmp", "w") as file:
+        json.dump(shard, file)
+    os.replace(path + ".tmp", path)
+    print(f"Part {part} of {parts} has been written to {path}")
+
+
+# Read the shard files of a report (--merge), and check there's one of each of
+# its parts.  Returns the report's params and the shard files in part order.
+def read_shard_files(paths):
+    shards = []
+    for path in paths:
+        with open(path) as file:
+            shards.append(json.load(file))
+    params = {key: shards[0][key] for key in ("start_date", "end_date", "locations", "shards", "parts")}
+    for path, shard in zip(paths, shards):
+        if any(shard[key] != value for key, value in params.items()):
+            print(path, ": The shard file is for a different report than", paths[0],
+                  "- every part must have the same dates, locations, --shards and number of parts")
+            sys.exit(1)
+    parts = sorted(shard["part"] for shard in shards)
+    if parts != list(range(1, params["parts"] + 1)):
+        print("The shard files have parts", parts, "but the report has", params["parts"], "parts")
+        sys.exit(1)
+    return params, sorted(shards, key=lambda shard: shard["part"])
+
+
+# Roll every location up into the item_tally
+def roll_up_locations():
+    with timings.stage("aggregation"):
+        for tally in location_tallies.values():
+            item_tally.merge(tally, copy=len(location_tallies) > 1)
+
+
+# Process all the orders between start_date and end_date.
+# With more than one shard, each closed_at range is paged concurrently, and with
+# `processes`, in that many worker processes (with at least one shard each).
+# Catalog and inventory details are retrieved while the orders are still being paged.
+def get_orders(shards=1, workers=1, cache=None, catalog_cache=None, checkpoint=None, inventory_snapshot=None,
+               processes=0):
     print("start date: " + start_date + ", end date: " + end_date)
 
-    print("Retrieving orders from ", start_date, " to ", end_date, "...")
+    print("Retrieving orders from ", start_date, " to ", end_date, "...")
+
+    if catalog_cache is not None:
+        catalog_cache.refresh()
+    if inventory_snapshot is not None:
+        inventory_snapshot.refresh()
+    enrichment = Enrichment(workers, catalog_cache, inventory_snapshot=inventory_snapshot)
+    if cache is not None:
+        get_cached_orders(cache, shards, workers, enrichment)
+    elif processes:
+        tasks = shard_tasks(location_ids, start_date, end_date, max(shards, processes))
+        merge_partials(run_shard_processes(tasks, processes), enrichment)
+    else:
+        tasks = shard_tasks(location_ids, start_date, end_date, shards)
+        fetch = lambda index: get_order_shard(index, *tasks[index], enrichment, checkpoint)
+        merge_shards(run_shards(fetch, [(index,) for index in range(len(tasks))], workers))
+
+    roll_up_locations()
+    enrichment.finish()
+
+
+# Maximum number of object ids BatchRetrieveCatalogObjects accepts per request
+CATALOG_BATCH_SIZE = 1000
+# Maximum number of catalog object ids we send per BatchRetrieveInventoryCounts request
+INVENTORY_BATCH_SIZE = 1000
+# While orders are paged, ids waiting for a lookup are sent as a partial chunk once
+# this many seconds have passed since the last partial chunk, so the lookups overlap
+# the paging even when fewer than a chunk's worth of items are sold
+ENRICHMENT_FLUSH_INTERVAL = 0.5
+
+
+# Define a function to get catalog item details in bulk.
+# Returns (item id, sku, price) for each item found.
+def get_catalog_info_bulk(item_ids):
+    try:
+        with timings.stage("enrichment"):
+            result = scheduler.call(
+                client.catalog.batch_retrieve_catalog_objects, body={"object_ids": item_ids}
+            )
+        return catalog_details(result)
+
+    except Exception as e:
+        handle_error([{"code": "API_ERROR", "detail": str(e)}])
+
+
+# The (item id, sku, price) details in a BatchRetrieveCatalogObjects result
+def catalog_details(result):
+    if result.is_error():
+        handle_error(result.errors)
+    details = []
+    for catalog_object in result.body.get("objects", []):
+        item_variation_data = catalog_object.get("item_variation_data", {})
+        sku = item_variation_data.get("sku", "N/A")
+        priceEach = item_variation_data.get("price_money")
+        details.append((catalog_object["id"], sku, priceEach))
+    return details
+
+# Retrieve quantity info for items at the report's locations, following the
+# cursor through every page.  Returns (item id, location id, quantity) for each
+# count, in the order Square returned them.
+# (Note that Square only keeps track of quantities if track_inventory
+# (in the CatalogItemVariation object) is set to true.
+def get_inventory_counts_bulk(item_ids):
+    counts = []
+    body = {"catalog_object_ids": item_ids, "location_ids": location_ids}
+    try:
+        while True:
+            with timings.stage("enrichment"):
+                result = scheduler.call(client.inventory.batch_retrieve_inventory_counts, body=body)
+            counts.extend(inventory_counts(result))
+
+            if result.cursor:
+                body["cursor"] = result.cursor
+            else:
+                break
+
+    except Exception as e:
+        handle_error([{"code": "API_ERROR", "detail": str(e)}])
+    return counts
+
+
+# The (item id, location id, quantity) counts on a page of BatchRetrieveInventoryCounts results
+def inventory_counts(result):
+    if result.is_error():
+        handle_error(result.errors)
+    return [
+        (
+            inventory_count["catalog_object_id"],
+            inventory_count["location_id"],
+            inventory_count["quantity"],
+        )
+        for inventory_count in result.body.get("counts", [])
+    ]
+
+
+# A local cache of catalog variation details (SKU and price), kept in the same
+# SQLite file as the order cache.  Entries expire after `ttl` and at most
+# `max_entries` are kept, dropping the least recently used.  Each run first pulls
+# only the catalog objects changed since the last refresh.
+class CatalogCache:
+    def __init__(self, path, ttl, max_entries):
+        import sqlite3
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS catalog_cache (
+                id TEXT PRIMARY KEY,
+                sku TEXT,
+                price TEXT,
+                fetched_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS catalog_sync (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                refreshed_at TEXT NOT NULL
+            );
+            """
+        )
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # item id -> (sku, price, fetched_at), least recently used first
+        self.entries = OrderedDict()
+        for item_id, sku, price, fetched_at in self.db.execute(
+            "SELECT id, sku, price, fetched_at FROM catalog_cache ORDER BY used_at"
+        ):
+            self.entries[item_id] = (sku, json.loads(price), fetched_at)
+
+    # Pull the item variations that changed (or were deleted) since the last refresh
+    def refresh(self):
+        row = self.db.execute("SELECT refreshed_at FROM catalog_sync").fetchone()
+        refreshed_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        if row is not None and self.entries:
+            body = {
+                "object_types": ["ITEM_VARIATION"],
+                "begin_time": row[0],
+                "include_deleted_objects": True,
+            }
+            changed = 0
+            while True:
+                result = scheduler.call(client.catalog.search_catalog_objects, body=body)
+                if result.is_error():
+                    handle_error(result.errors)
+                refreshed_at = result.body.get("latest_time", refreshed_at)
+
+                for catalog_object in result.body.get("objects", []):
+                    item_id = catalog_object["id"]
+                    if item_id not in self.entries:
+                        continue
+                    changed += 1
+                    if catalog_object.get("is_deleted"):
+                        del self.entries[item_id]
+                    else:
+                        item_variation_data = catalog_object.get("item_variation_data", {})
+                        self.entries[item_id] = (
+                            item_variation_data.get("sku", "N/A"),
+                            item_variation_data.get("price_money"),
+                            time.time(),
+                        )
+
+                if result.cursor:
+                    body["cursor"] = result.cursor
+                else:
+                    break
+            print("Refreshed", changed, "cached catalog variations")
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO catalog_sync (id, refreshed_at) VALUES (0, ?)",
+            (refreshed_at,),
+        )
+        self.db.commit()
+
+    # Returns (sku, price) for an item, or None if it isn't cached or has expired
+    def get(self, item_id):
+        with self.lock:
+            entry = self.entries.get(item_id)
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl:
+                del self.entries[item_id]
+                return None
+            self.entries.move_to_end(item_id)
+            return entry[0], entry[1]
+
+    def put(self, details):
+        with self.lock:
+            now = time.time()
+            for item_id, sku, priceEach in details:
+                self.entries[item_id] = (sku, priceEach, now)
+                self.entries.move_to_end(item_id)
+
+    # Write the cache back to disk, dropping the least recently used entries
+    def save(self):
+        with self.lock:
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            rows = [
+                (item_id, sku, json.dumps(priceEach), fetched_at, used_at)
+                for used_at, (item_id, (sku, priceEach, fetched_at)) in enumerate(self.entries.items())
+            ]
+        self.db.execute("DELETE FROM catalog_cache")
+        self.db.executemany(
+            "INSERT INTO catalog_cache (id, sku, price, fetched_at, used_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        self.db.commit()
+
+
+# How far before the last sync each inventory snapshot refresh starts, so counts
+# Square was still calculating at the time aren't missed
+INVENTORY_SYNC_OVERLAP = datetime.timedelta(minutes=5)
+
+
+# A local snapshot of the inventory counts of the items sold at each location,
+# kept in the same SQLite file as the order cache.  Each run first pulls only the
+# counts updated since the last sync (BatchRetrieveInventoryCounts with
+# updated_after), so only items the snapshot hasn't seen at every one of the
+# report's locations are looked up in full.
+class InventorySnapshot:
+    def __init__(self, path, locations):
+        import sqlite3
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS inventory_snapshot (
+                item_id TEXT NOT NULL,
+                location_id TEXT NOT NULL,
+                quantity TEXT,
+                PRIMARY KEY (item_id, location_id)
+            );
+            CREATE TABLE IF NOT EXISTS inventory_sync (
+                location_id TEXT PRIMARY KEY,
+                synced_at TEXT NOT NULL
+            );
+            """
+        )
+        self.locations = locations
+        self.lock = threading.Lock()
+        # (item id, location id) -> quantity, or None if the item has no count there
+        self.counts = {
+            (item_id, location): quantity
+            for item_id, location, quantity in self.db.execute(
+                "SELECT item_id, location_id, quantity FROM inventory_snapshot"
+            )
+        }
+        self.synced_at = dict(self.db.execute("SELECT location_id, synced_at FROM inventory_sync"))
+
+    # Pull the counts updated at the report's locations since they were last synced
+    def refresh(self):
+        synced_at = (datetime.datetime.now(datetime.timezone.utc) - INVENTORY_SYNC_OVERLAP).isoformat()
+        synced = [location for location in self.locations if location in self.synced_at]
+        if synced:
+            body = {
+                "location_ids": synced,
+                "updated_after": min(self.synced_at[location] for location in synced),
+            }
+            changed = 0
+            while True:
+                result = scheduler.call(client.inventory.batch_retrieve_inventory_counts, body=body)
+                for item_id, location, quantity in inventory_counts(result):
+                    # Items the snapshot doesn't have are looked up in full if they're sold
+                    if (item_id, location) in self.counts:
+                        self.counts[(item_id, location)] = quantity
+                        changed += 1
+
+                if result.cursor:
+                    body["cursor"] = result.cursor
+                else:
+                    break
+            print("Refreshed", changed, "inventory counts updated since", body["updated_after"])
+
+        # Saved with the snapshot, once the run's counts are in it
+        for location in self.locations:
+            self.synced_at[location] = synced_at
+
+    # Whether the snapshot has the item's count at every one of the report's locations
+    def has(self, item_id):
+        return all((item_id, location) in self.counts for location in self.locations)
+
+    # The (item id, location id, quantity) counts of items in the snapshot
+    def get(self, item_ids):
+        with self.lock:
+            return [
+                (item_id, location, self.counts[(item_id, location)])
+                for item_id in item_ids
+                for location in self.locations
+                if self.counts[(item_id, location)] is not None
+            ]
+
+    # Save the counts retrieved for `item_ids`, including where they have none
+    def put(self, item_ids, counts):
+        with self.lock:
+            for item_id in item_ids:
+                for location in self.locations:
+                    self.counts[(item_id, location)] = None
+            for item_id, location, quantity in counts:
+                self.counts[(item_id, location)] = quantity
+
+    def save(self):
+        with self.lock:
+            rows = [(item_id, location, quantity) for (item_id, location), quantity in self.counts.items()]
+            synced = list(self.synced_at.items())
+        self.db.execute("DELETE FROM inventory_snapshot")
+        self.db.executemany(
+            "INSERT INTO inventory_snapshot (item_id, location_id, quantity) VALUES (?, ?, ?)", rows
+        )
+        self.db.executemany(
+            "INSERT OR REPLACE INTO inventory_sync (location_id, synced_at) VALUES (?, ?)", synced
+        )
+        self.db.commit()
+
+
+# Retrieves catalog and inventory details for the items in the report.
+# Item ids are added as orders are tallied; each id is looked up once, in
+# API-sized chunks that run on a thread pool alongside the order paging.  Ids that
+# don't fill a chunk are sent at most every ENRICHMENT_FLUSH_INTERVAL seconds.
+# Catalog details already in the catalog cache, and counts already in the
+# inventory snapshot, aren't requested again.
+class Enrichment:
+    def __init__(self, workers, catalog_cache=None, use_async=False, inventory_snapshot=None):
+        from concurrent.futures import ThreadPoolExecutor
+        # With use_async the chunks run as tasks on the running event loop instead
+        self.executor = None if use_async else ThreadPoolExecutor(max_workers=max(2, workers))
+        self.lock = threading.Lock()
+        self.catalog_cache = catalog_cache
+        self.cached_details = []
+        self.inventory_snapshot = inventory_snapshot
+        self.snapshot_items = []
+        self.seen = set()
+        self.pending_catalog = []
+        self.pending_inventory = []
+        self.catalog_futures = []
+        self.inventory_futures = []
+        self.inventory_chunks = []
+        self.flush_at = 0  # when waiting ids can next be sent as a partial chunk
+
+    # Queue up item ids, and send off any chunks that are full, or any waiting ids
+    # if it's time for a partial chunk
+    def add(self, item_ids):
+        with self.lock:
+            for item_id in item_ids:
+                if item_id not in self.seen:
+                    self.seen.add(item_id)
+                    if self.inventory_snapshot is not None and self.inventory_snapshot.has(item_id):
+                        self.snapshot_items.append(item_id)
+                    else:
+                        self.pending_inventory.append(item_id)
+                    cached = self.catalog_cache.get(item_id) if self.catalog_cache else None
+                    if cached is None:
+                        self.pending_catalog.append(item_id)
+                    else:
+                        self.cached_details.append((item_id,) + cached)
+            now = time.monotonic()
+            flush = bool(self.pending_catalog or self.pending_inventory) and now >= self.flush_at
+            self.submit(flush)
+            if flush:
+                self.flush_at = now + ENRICHMENT_FLUSH_INTERVAL
+
+    def submit(self, flush):
+        while len(self.pending_catalog) >= CATALOG_BATCH_SIZE or (flush and self.pending_catalog):
+            chunk = self.pending_catalog[:CATALOG_BATCH_SIZE]
+            del self.pending_catalog[:CATALOG_BATCH_SIZE]
+            self.catalog_futures.append(
+                self.start(get_catalog_info_bulk, get_catalog_info_bulk_async, chunk)
+            )
+        while len(self.pending_inventory) >= INVENTORY_BATCH_SIZE or (flush and self.pending_inventory):
+            chunk = self.pending_inventory[:INVENTORY_BATCH_SIZE]
+            del self.pending_inventory[:INVENTORY_BATCH_SIZE]
+            self.inventory_chunks.append(chunk)
+            self.inventory_futures.append(
+                self.start(get_inventory_counts_bulk, get_inventory_counts_bulk_async, chunk)
+            )
+
+    def start(self, fetch, fetch_async, chunk):
+        if self.executor is None:
+            import asyncio
+            return asyncio.ensure_future(fetch_async(chunk))
+        return self.executor.submit(fetch, chunk)
+
+    # With use_async, send the remaining ids and wait for every chunk to finish
+    async def wait(self):
+        import asyncio
+        with self.lock:
+            self.submit(True)
+        await asyncio.gather(*self.catalog_futures, *self.inventory_futures)
+
+    # `reports` are the (rollup, location tallies) pairs to save the details in
+    # (by default the item_tally and the location tallies)
+    def finish(self, reports=None):
+        with timings.stage("enrichment"):
+            self.apply(reports or [(item_tally, location_tallies)])
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    # Send the remaining ids, wait for every chunk, and save the details in each
+    # report's rollup and location tallies
+    def apply(self, reports):
+        with self.lock:
+            self.submit(True)
+
+        details = [future.result() for future in self.catalog_futures]
+        if self.catalog_cache is not None:
+            for fetched in details:
+                self.catalog_cache.put(fetched)
+            self.catalog_cache.save()
+        counts = [future.result() for future in self.inventory_futures]
+        if self.inventory_snapshot is not None:
+            for chunk, fetched in zip(self.inventory_chunks, counts):
+                self.inventory_snapshot.put(chunk, fetched)
+            self.inventory_snapshot.save()
+            counts.append(self.inventory_snapshot.get(self.snapshot_items))
+
+        for rollup, tallies_by_location in reports:
+            tallies = [rollup] + list(tallies_by_location.values())
+            for item_id, sku, priceEach in itertools.chain(self.cached_details, *details):
+                for tally in tallies:
+                    if item_id in tally:
+                        tally[item_id].sku = sku
+                        tally[item_id].price_each = priceEach
+
+            for item_id, location, quantity in itertools.chain(*counts):
+                tally = tallies_by_location.get(location)
+                if tally is not None and item_id in tally:
+                    tally[item_id].qty_remaining = quantity
+            # With more than one location, the rollup shows the stock across all of them
+            if len(tallies_by_location) > 1:
+                for item_id in rollup:
+                    quantities = [
+                        tally[item_id].qty_remaining for tally in tallies_by_location.values()
+                        if item_id in tally and tally[item_id].qty_remaining is not None
+                    ]
+                    if quantities:
+                        from decimal import Decimal
+                        rollup[item_id].qty_remaining = str(sum(Decimal(q) for q in quantities))
+
+
+# The asyncio versions of the order and enrichment functions, used with --async.
+# Every request goes through the one AsyncSquareClient (async_client), so the
+# order pages, catalog chunks and inventory chunks all share its pooled aiohttp
+# session and its limit on concurrent requests.
+
+async def search_order_pages_async(locations, start_at, end_at, last_shard, cursor=None):
+    body = build_search_body(locations, start_at, end_at)
+    end_dt = parse_timestamp(end_at)
+    if cursor:
+        body["cursor"] = cursor
+
+    pages = 0
+    while True:
+        with timings.stage("paging"):
+            result = await async_client.search_orders(body, decode=decode_order_page)
+        pages += 1
+        cursor = next_cursor(result)
+        yield page_orders(result, end_dt, last_shard), cursor
+
+        if cursor:
+            body["cursor"] = cursor
+        else:
+            break
+    timings.searched(pages)
+
+
+async def get_order_shard_async(index, locations, start_at, end_at, last_shard, enrichment, checkpoint=None):
+    tallies, cursor, done = restore_shard(index, enrichment, checkpoint)
+    if done:
+        return tallies
+
+    async for orders, cursor in search_order_pages_async(locations, start_at, end_at, last_shard, cursor):
+        tally_page(locations, orders, tallies, enrichment)
+        if checkpoint is not None:
+            checkpoint.page_done(index, cursor, tallies)
+    return tallies
+
+
+async def sync_order_shard_async(cache, locations, start_at, end_at, last_shard):
+    async for orders, _ in search_order_pages_async(locations, start_at, end_at, last_shard):
+        cache.store([compact_order(order) for order in orders])
+
+
+async def get_catalog_info_bulk_async(item_ids):
+    try:
+        with timings.stage("enrichment"):
+            result = await async_client.batch_retrieve_catalog_objects({"object_ids": item_ids})
+        return catalog_details(result)
+
+    except Exception as e:
+        handle_error([{"code": "API_ERROR", "detail": str(e)}])
+
+
+async def get_inventory_counts_bulk_async(item_ids):
+    counts = []
+    body = {"catalog_object_ids": item_ids, "location_ids": location_ids}
+    try:
+        while True:
+            with timings.stage("enrichment"):
+                result = await async_client.batch_retrieve_inventory_counts(body)
+            counts.extend(inventory_counts(result))
+
+            if result.cursor:
+                body["cursor"] = result.cursor
+            else:
+                break
+
+    except Exception as e:
+        handle_error([{"code": "API_ERROR", "detail": str(e)}])
+    return counts
+
+
+async def get_orders_async(shards=1, workers=1, cache=None, catalog_cache=None, checkpoint=None,
+                           inventory_snapshot=None):
+    import asyncio
+    from square_transport import AsyncSquareClient
+    global async_client
+    async_client = AsyncSquareClient(
+        os.environ["SQUARE_ACCESS_TOKEN"], os.environ["SQUARE_ENVIRONMENT"],
+        concurrency=workers, scheduler=scheduler,
+    )
+    print("start date: " + start_date + ", end date: " + end_date)
+
+    print("Retrieving orders from ", start_date, " to ", end_date, "...")
+
+    try:
+        if catalog_cache is not None:
+            catalog_cache.refresh()
+        if inventory_snapshot is not None:
+            inventory_snapshot.refresh()
+        enrichment = Enrichment(workers, catalog_cache, use_async=True, inventory_snapshot=inventory_snapshot)
+        if cache is not None:
+            tasks = cache_sync_tasks(cache, shards)
+            await asyncio.gather(*(sync_order_shard_async(cache, *task) for task in tasks))
+            tally_cached_orders(cache, enrichment)
+        else:
+            tasks = shard_tasks(location_ids, start_date, end_date, shards)
+            merge_shards(await asyncio.gather(
+                *(get_order_shard_async(index, *task, enrichment, checkpoint) for index, task in enumerate(tasks))
+            ))
+
+        roll_up_locations()
+        await enrichment.wait()
+        enrichment.finish()
+    finally:
+        await async_client.close()
+
+
+# The report's columns, as (header, field name, kind).  The console table uses the
+# headers and shows money as dollars.  The files keep money as integer cents, so they
+# load straight into a warehouse: CSV under the headers (marked "(cents)"), and JSONL
+# and Parquet under the field names.
+# Units sold a day and days of cover forecast when each item will sell out.
+REPORT_COLUMNS = [
+    ("Order ID", "order_id", "text"),
+    ("Name", "name", "text"),
+    ("Variation Name", "variation_name", "text"),
+    ("Qty Sold", "qty_sold", "int"),
+    ("Order Sales Total", "sales_total_cents", "cents"),
+    ("Currency", "currency", "text"),
+    ("Qty Remaining", "qty_remaining", "text"),
+    ("Units Sold / Day", "units_per_day", "float"),
+    ("Days of Cover", "days_of_cover", "float"),
+]
+LOCATION_COLUMN = ("Location", "location", "text")
+
+REPORT_FORMATS = ("csv", "jsonl", "parquet")
+
+
+# A row as people read it: money in dollars, and N/A for anything missing
+def display_row(columns, row):
+    return [
+        "N/A" if value is None
+        else "${:,.2f}".format(value / 100) if kind == "cents"
+        else "{:+.1f}%".format(value) if kind == "percent"
+        else value
+        for (_, _, kind), value in zip(columns, row)
+    ]
+
+
+# CSV headers, with money columns marked as cents
+def csv_headers(columns):
+    return [header + " (cents)" if kind == "cents" else header for header, _, kind in columns]
+
 
-    # Get the first page of orders
-    result = client.orders.search_orders(
-        body={
-            "location_ids": [location_id],
-            "limit": limit,
-            "query": {
-                "filter": {
-                    "source_filter": {"source_names": [SEED_DATA_REFERENCE_ID]},
-                    "state_filter": {"states": ["COMPLETED"]},
-                    "date_time_filter": {
-                        "closed_at": {"start_at": start_date, "end_at": end_date}
-                    },
-                },
-                "sort": {"sort_field": "CLOSED_AT"},
-            },
-        }
-    )
+# A row for a CSV file: plain numbers, with money in cents and an empty cell for
+# anything missing, so every column loads as its type
+def csv_row(row):
+    return ["" if value is None else value for value in row]
 
-    if result.is_success():
-        while (result.body != {}) and ("orders" in result.body.keys()):
-            # Walk through each order on the current page
-            for order in result.body["orders"]:               
-
-                # Get basic for this order's items, and save it to the item_tally
-                if "line_items" in order:
-                    for line_item in order["line_items"]:
-                        # Get basic info about a particular item, and save it to the item_tally
-                        if "catalog_object_id" in line_item:
-                            item_id = line_item["catalog_object_id"]
-                            item_ids.append(item_id)
-                            # Check if this itemId is already in the item_tally, if not, add it
-                            if not item_id in item_tally:
-                                item_tally.update(
-                                    {
-                                        item_id: {
-                                            "orderId": order["id"],
-                                            "qtySold": int(line_item["quantity"]),
-                                             "orderSalesTotal": int(line_item["base_price_money"]["amount"]) * int(line_item["quantity"])
-                                            }
-                                        }
-                                )
-                            else:
-                                # update the existing item_id
-                                item_tally.update(
-                                    {
-                                        item_id: {
-                                            # Add the quantity sold to the existing quantity
-                                            "qtySold": int(
-                                                item_tally[item_id].get("qtySold")
-                                            )
-                                            + int(line_item["quantity"]),
-                                            # Add the total sales to the existing total sales 
-                                            "orderSalesTotal": int(
-                                                item_tally[item_id].get("orderSalesTotal")) 
-                                                + int(line_item["base_price_money"]["amount"]) * int(line_item["quantity"])
-
-                                        }
-                                    }
-                                )
-                            # set the name, and variation_name for this item_id
-                            item_tally[item_id]["name"] = line_item["name"]
-                            item_tally[item_id]["variation_name"] = line_item[
-                                "variation_name"
-                            ]
-
-                        else:
-                            # No catalog info available (an ad hoc item, perhaps?)
-                            print("This line item doesn't have a catalog_object_id")
-
-                # No items here.  Next...
-                else:
-                    print("This order doesn't have any line items")
 
-            # If the previous call returned a cursor, then get the next page of orders
-            if result.cursor:
-                result = client.orders.search_orders(
-                    body={
-                        "location_ids": [location_id],
-                        "limit": limit,
-                        "query": {
-                            "filter": {
-                                "source_filter": {"source_names": [SEED_DATA_REFERENCE_ID]},
-                                "state_filter": {"states": ["COMPLETED"]},
-                                "date_time_filter": {
-                                    "closed_at": {
-                                        "start_at": start_date,
-                                        "end_at": end_date,
-                                    }
-                                },
-                            },
-                            "sort": {"sort_field": "CLOSED_AT"},
-                        },
-                        "cursor": result.cursor,
-                    }
-                )
+# Report writers take rows one at a time, so a report is never held in memory
+class CsvReportWriter:
+    def __init__(self, path, columns):
+        import csv
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(csv_headers(columns))
 
-            # If there isn't a cursor, then we're done getting orders
-            else:
-                break
-        if item_ids:
-            get_catalog_info_bulk(item_ids)
-            get_inventory_counts_bulk(item_ids)
+    def write_row(self, row):
+        self.writer.writerow(csv_row(row))
 
-    # In case of errors with SearchOrders...
-    elif result.is_error():
-        handle_error(result.errors)
+    def close(self):
+        self.file.close()
 
 
-# Define a function to get catalog item details in bulk
-def get_catalog_info_bulk(item_ids):
-    try:
-        result = client.catalog.batch_retrieve_catalog_objects(body={"object_ids": item_ids})
-        if result.is_success():
-            if result.body:
-                for catalog_object in result.body["objects"]:
-                    item_id = catalog_object["id"]
-                    item_variation_data = catalog_object.get("item_variation_data", {})
-                    sku = item_variation_data.get("sku", "N/A")
-                    priceEach = item_variation_data.get("price_money")
+class JsonlReportWriter:
+    def __init__(self, path, columns):
+        self.names = [name for _, name, _ in columns]
+        self.file = open(path, 'w')
 
-                    item_tally[item_id]["sku"] = sku
-                    item_tally[item_id]["priceEach"] = priceEach
+    def write_row(self, row):
+        self.file.write(json.dumps(dict(zip(self.names, row))) + "\n")
 
-    except Exception as e:
-        handle_error([{"code": "API_ERROR", "detail": str(e)}])
+    def close(self):
+        self.file.close()
 
-# Retrieve quantity info for an item, and save it in the item_tally.
-# (Note that Square only keeps track of quantities if track_inventory
-# (in the CatalogItemVariation object) is set to true.
-def get_inventory_counts_bulk(item_ids):
-    try:
-        result = client.inventory.batch_retrieve_inventory_counts(
-            body={"catalog_object_ids": item_ids}
+
+# Writes a Parquet file a row group at a time.  Needs pyarrow (pip install pyarrow).
+class ParquetReportWriter:
+    ROW_GROUP_SIZE = 100000
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow, pyarrow.parquet
+        except ImportError:
+            print("Parquet output needs pyarrow - install it with: pip install pyarrow")
+            sys.exit(1)
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            (name, pyarrow.string() if kind == "text" else pyarrow.float64() if kind in ("float", "percent") else pyarrow.int64())
+            for _, name, kind in columns
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(
+                [dict(zip(self.schema.names, row)) for row in self.rows], schema=self.schema
+            ))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+REPORT_WRITERS = {
+    "csv": CsvReportWriter,
+    "jsonl": JsonlReportWriter,
+    "parquet": ParquetReportWriter,
+}
+
+
+# The number of days of the window from start_at to end_at that have gone by,
+# which sales are averaged over (None if it hasn't started)
+def selling_days(start_at, end_at):
+    end_dt = min(parse_timestamp(end_at), datetime.datetime.now(datetime.timezone.utc))
+    days = (end_dt - parse_timestamp(start_at)).total_seconds() / SECONDS_PER_DAY
+    return days if days > 0 else None
+
+
+# The item's sell-through velocity (units sold a day, over `days`) and days of
+# cover (how long the remaining stock lasts at that rate)
+def sell_through(item, days):
+    if not days:
+        return None, None
+    velocity = item.qty_sold / days
+    if item.qty_remaining is None or velocity <= 0:
+        return round(velocity, 2), None
+    return round(velocity, 2), round(max(float(item.qty_remaining), 0) / velocity, 1)
+
+
+# Build a report row for an item, with the values as they're stored.
+# `days` is the number of days the item's sales are averaged over.
+def report_row(item, days=None):
+    return [
+        item.order_id,
+        item.name,
+        item.variation_name,
+        item.qty_sold,
+        item.sales_total,
+        item.price_each["currency"] if item.price_each else None,
+        item.qty_remaining,
+        *sell_through(item, days),
+    ]
+
+
+# The report sections, as (location label, tally) pairs.  With more than one
+# location, each location gets its own rows, followed by the rollup.
+# (The location tallies and rollup default to location_tallies and item_tally.)
+def report_sections(tallies=None, rollup=None):
+    if tallies is None:
+        tallies, rollup = location_tallies, item_tally
+    if len(tallies) <= 1:
+        return [(None, rollup)]
+    return list(tallies.items()) + [("All locations", rollup)]
+
+
+# Look up the category name for each item variation.
+# Variations don't name their category, so the parent items are fetched along
+# with them (as related objects), and then the items' categories.
+def get_variation_categories(variation_ids):
+    item_of_variation = {}
+    category_of_item = {}
+    for i in range(0, len(variation_ids), CATALOG_BATCH_SIZE):
+        result = scheduler.call(
+            client.catalog.batch_retrieve_catalog_objects,
+            body={"object_ids": variation_ids[i:i + CATALOG_BATCH_SIZE], "include_related_objects": True},
         )
+        if result.is_error():
+            handle_error(result.errors)
+        for catalog_object in result.body.get("objects", []) + result.body.get("related_objects", []):
+            if catalog_object["type"] == "ITEM_VARIATION":
+                item_of_variation[catalog_object["id"]] = catalog_object["item_variation_data"].get("item_id")
+            elif catalog_object["type"] == "ITEM":
+                item_data = catalog_object.get("item_data", {})
+                category_id = item_data.get("category_id") or (item_data.get("reporting_category") or {}).get("id")
+                category_of_item[catalog_object["id"]] = category_id
 
-        if result.is_success():
-            if result.body:
-                for inventory_count in result.body["counts"]:
-                    item_id = inventory_count["catalog_object_id"]
-                    quantity = inventory_count["quantity"]
-                    item_tally[item_id]["qtyRemaining"] = quantity
+    category_ids = sorted({category_id for category_id in category_of_item.values() if category_id})
+    category_names = {}
+    for i in range(0, len(category_ids), CATALOG_BATCH_SIZE):
+        result = scheduler.call(
+            client.catalog.batch_retrieve_catalog_objects,
+            body={"object_ids": category_ids[i:i + CATALOG_BATCH_SIZE]},
+        )
+        if result.is_error():
+            handle_error(result.errors)
+        for catalog_object in result.body.get("objects", []):
+            category_names[catalog_object["id"]] = catalog_object.get("category_data", {}).get("name", "N/A")
 
-    except Exception as e:
-        handle_error([{"code": "API_ERROR", "detail": str(e)}])
+    return {
+        variation_id: category_names.get(category_of_item.get(item_of_variation.get(variation_id)), "Uncategorized")
+        for variation_id in variation_ids
+    }
+
+
+# Generate the grouped sales report - Output to the console and a file
+# (sales_report_by_<dimensions> in the report's format)
+def generate_grouped_report(dimensions, output_format="csv", show_table=True):
+    categories = None
+    if "category" in dimensions:
+        categories = get_variation_categories(line_item_columns.variation_ids)
+
+    columns = [(dimension.capitalize(), dimension, "text") for dimension in dimensions] + [
+        ("Qty Sold", "qty_sold", "int"),
+        ("Order Sales Total", "sales_total_cents", "cents"),
+    ]
+    table = None
+    if show_table:
+        from prettytable import PrettyTable
+        table = PrettyTable()
+        table.field_names = [header for header, _, _ in columns]
+    report_file = 'sales_report_by_' + '_'.join(dimensions) + '.' + output_format
+
+    if len(line_item_columns) == 0:
+        labels, quantity, sales_total = [[] for _ in dimensions], [], []
+    else:
+        labels, quantity, sales_total = group_line_items(line_item_columns, dimensions, categories)
+
+    writer = REPORT_WRITERS[output_format](report_file, columns)
+    for group in range(len(quantity)):
+        row = [label[group] for label in labels] + [int(quantity[group]), int(sales_total[group])]
+        writer.write_row(row)
+        if table is not None:
+            table.add_row(display_row(columns, row))
+    writer.close()
+
+    if table is not None:
+        print(table)
+    print(f"Total Sales: ${int(sum(sales_total)) / 100}")
+    print(f'Grouped Sales Report has been written to {report_file}')
+
+
+# Generate the sales report - Output to the console and a file.
+# Rows are written as they're produced; with show_table=False only the
+# summary is printed, and the rows are never all held at once.
+# `sections` defaults to report_sections(), with sales averaged over the part of
+# start_date to end_date that has gone by; other sections give their own `days`.
+def generate_sales_report(output_format="csv", report_file="sales_report.csv", show_table=True, sections=None,
+                          days=None):
+    if sections is None:
+        sections = report_sections()
+        days = selling_days(start_date, end_date)
+    by_location = sections[0][0] is not None
+
+    # Used for both the table and the report file
+    columns = [LOCATION_COLUMN] + REPORT_COLUMNS if by_location else REPORT_COLUMNS
 
-# Generate the sales report - Output to the console and a csv file
-def generate_sales_report():
-    # Used for both the table and the csv file
-    header = ["Order ID", "Name", "Variation Name", "Qty Sold", "Order Sales Total", "Currency", "Qty Remaining"]
-    
     # table setup
-    table = PrettyTable() # create a table
-    table.field_names = header # set the header row
-    total_sales_sum = 0 # keep track of the total sales
-
-    # csv setup
-    csv_file = 'sales_report.csv'
-
-    # Open the csv file so we can write to it
-    with open(csv_file, 'w', newline='') as file:
-        writer = csv.writer(file)
-
-        # Write header row to the csv file
-        writer.writerow(header)
-        # Add data rows
-        for key, value in item_tally.items():
-            row = [
-                value["orderId"],
-                value["name"],
-                value["variation_name"],
-                value["qtySold"],
-                "${:,.2f}".format(value["orderSalesTotal"] / 100),
-                value["priceEach"]["currency"] if "priceEach" in value else 'N/A',
-                value["qtyRemaining"] if "qtyRemaining" in value else "N/A"
-            ]
-            # write the row to the csv file
-            writer.writerow(row)
+    table = None
+    if show_table:
+        from prettytable import PrettyTable
+        table = PrettyTable() # create a table
+        table.field_names = [header for header, _, _ in columns] # set the header row
+
+    writer = REPORT_WRITERS[output_format](report_file, columns)
+    # Add data rows
+    for location, tally in sections:
+        for item in tally.values():
+            row = report_row(item, days)
+            if by_location:
+                row = [location] + row
+            # write the row to the report file
+            writer.write_row(row)
             # add the row to the table
-            table.add_row(row)
-            # add the total sales to the total sales sum
-            total_sales_sum += value["orderSalesTotal"]
+            if table is not None:
+                table.add_row(display_row(columns, row))
+    writer.close()
+
+    # add up the total sales (the rollup, last, covers every location)
+    total_sales_sum = sum(item.sales_total for item in sections[-1][1].values())
 
     # Print the table
-    print(table)
+    if table is not None:
+        print(table)
     print(f"Total Sales: ${total_sales_sum / 100}")
-    print(f'Sales Report has been written to {csv_file}')
+    print(f'Sales Report has been written to {report_file}')
+
+
+# Multi-window reports (--windows).
+#
+# Several named date windows - today, month to date, the same month last year
+# and so on - are reported on from one fetch.  The windows' closed_at ranges are
+# joined where they overlap and each range is paged once, folding every order
+# into each window it falls in.  Every window gets its own report file, and
+# pairs of windows are compared period over period.
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# The preset windows: for today's date, each gives the window's first day and
+# the day after its last.  A preset name with -ly is the same period last year.
+WINDOW_PRESETS = {
+    "today": lambda today: (today, today + ONE_DAY),
+    "yesterday": lambda today: (today - ONE_DAY, today),
+    "wtd": lambda today: (today - datetime.timedelta(days=today.weekday()), today + ONE_DAY),
+    "mtd": lambda today: (today.replace(day=1), today + ONE_DAY),
+    "qtd": lambda today: (today.replace(month=(today.month - 1) // 3 * 3 + 1, day=1), today + ONE_DAY),
+    "ytd": lambda today: (today.replace(month=1, day=1), today + ONE_DAY),
+}
+# Last year for these is 52 weeks back, so the days of the week line up;
+# for the others it's the same dates a year back
+WEEK_ALIGNED_PRESETS = ("today", "yesterday", "wtd")
+LAST_YEAR_SUFFIX = "-ly"
+
+
+# A named report window, from start_at to end_at (RFC 3339).  Its tallies are
+# filled in by get_window_orders.
+class ReportWindow:
+    def __init__(self, name, start_at, end_at):
+        self.name = name
+        self.start_at = start_at
+        self.end_at = end_at
+        self.start_dt = parse_timestamp(start_at)
+        self.end_dt = parse_timestamp(end_at)
+        self.location_tallies = {}
+        self.item_tally = ItemTally()
+
+    def sections(self):
+        return report_sections(self.location_tallies, self.item_tally)
+
+
+# The same day last year
+def last_year(day, week_aligned):
+    if week_aligned:
+        return day - datetime.timedelta(weeks=52)
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, day=28)  # 29 February
+
+
+# Parse --windows: comma-separated presets, or NAME=START/END windows.
+# Raises ValueError for a window that can't be used.
+def parse_windows(spec, today):
+    windows = []
+    for part in (part.strip() for part in spec.split(",")):
+        if not part:
+            continue
+        if "=" in part:
+            name, _, dates = part.partition("=")
+            start_at, _, end_at = dates.partition("/")
+            try:
+                window = ReportWindow(name.strip(), start_at.strip(), end_at.strip())
+            except ValueError:
+                raise ValueError(f"{part!r} should be NAME=START/END, with RFC 3339 dates")
+        else:
+            preset = part[:-len(LAST_YEAR_SUFFIX)] if part.endswith(LAST_YEAR_SUFFIX) else part
+            if preset not in WINDOW_PRESETS:
+                raise ValueError(
+                    f"unknown window {part!r} - use NAME=START/END or one of " + ", ".join(WINDOW_PRESETS)
+                    + f" (with {LAST_YEAR_SUFFIX} for last year)"
+                )
+            start_day, end_day = WINDOW_PRESETS[preset](today)
+            if preset != part:
+                week_aligned = preset in WEEK_ALIGNED_PRESETS
+                start_day, end_day = last_year(start_day, week_aligned), last_year(end_day, week_aligned)
+            window = ReportWindow(part, start_day.isoformat(), end_day.isoformat())
+
+        # The name is used in file names
+        if not window.name or not all(c.isalnum() or c in "-_" for c in window.name):
+            raise ValueError(f"window names can only have letters, digits, - and _ ({window.name!r})")
+        if any(other.name == window.name for other in windows):
+            raise ValueError(f"there's more than one window called {window.name!r}")
+        if window.end_dt <= window.start_dt:
+            raise ValueError(f"window {window.name!r} ends before it starts")
+        windows.append(window)
+    if not windows:
+        raise ValueError("--windows needs at least one window")
+    return windows
+
+
+# The (window, prior window) pairs to compare: the NAME:PRIOR pairs in `spec`,
+# or by default each window with its -ly window, if that's asked for too
+def window_comparisons(windows, spec=None):
+    by_name = {window.name: window for window in windows}
+    if not spec:
+        return [
+            (window, by_name[window.name + LAST_YEAR_SUFFIX])
+            for window in windows if window.name + LAST_YEAR_SUFFIX in by_name
+        ]
+
+    comparisons = []
+    for pair in (pair.strip() for pair in spec.split(",")):
+        if not pair:
+            continue
+        name, _, prior = pair.partition(":")
+        if name not in by_name or prior not in by_name:
+            raise ValueError(f"{pair!r} should be NAME:PRIOR, naming two of the windows")
+        comparisons.append((by_name[name], by_name[prior]))
+    return comparisons
+
+
+# The closed_at ranges to page for the windows, with overlapping ones joined
+def window_fetch_ranges(windows):
+    ranges = []
+    for window in sorted(windows, key=lambda window: window.start_dt):
+        if ranges and window.start_dt <= ranges[-1][3]:
+            if window.end_dt > ranges[-1][3]:
+                ranges[-1][1], ranges[-1][3] = window.end_at, window.end_dt
+        else:
+            ranges.append([window.start_at, window.end_at, window.start_dt, window.end_dt])
+    return [(start_at, end_at) for start_at, end_at, _, _ in ranges]
+
+
+# Page one closed_at range of orders, folding each order into every window it
+# falls in.  Returns the tallies by (window name, location).
+def get_window_shard(locations, start_at, end_at, last_shard, windows, enrichment):
+    tallies = {}
+    for orders, _ in search_order_pages(locations, start_at, end_at, last_shard):
+        with timings.stage("aggregation"):
+            timings.count(orders)
+            by_window = {}
+            for order in orders:
+                closed_at = parse_timestamp(order["closed_at"])
+                for window in windows:
+                    # Like a report for the window's dates, this includes its end
+                    if window.start_dt <= closed_at <= window.end_dt:
+                        by_window.setdefault((window.name, order["location_id"]), []).append(order)
+            for key, window_orders in by_window.items():
+                enrichment.add(tallies.setdefault(key, ItemTally()).add_orders(window_orders))
+    return tallies
+
+
+# Fetch the orders for every window in one pass, and tally each window.
+# Catalog and inventory details are retrieved once for all of them.
+def get_window_orders(windows, shards=1, workers=1):
+    ranges = window_fetch_ranges(windows)
+    for start_at, end_at in ranges:
+        print("Retrieving orders from ", start_at, " to ", end_at, "...")
+
+    enrichment = Enrichment(workers)
+    tasks = [
+        task for start_at, end_at in ranges
+        for task in shard_tasks(location_ids, start_at, end_at, shards)
+    ]
+    results = run_shards(lambda *task: get_window_shard(*task, windows, enrichment), tasks, workers)
+
+    # The shards come back in closed_at order for each group of locations, as
+    # with merge_shards
+    with timings.stage("aggregation"):
+        by_name = {window.name: window for window in windows}
+        for window in windows:
+            window.location_tallies = {location: ItemTally() for location in location_ids}
+        for tallies in results:
+            for (name, location), tally in tallies.items():
+                by_name[name].location_tallies[location].merge(tally)
+        for window in windows:
+            for tally in window.location_tallies.values():
+                window.item_tally.merge(tally, copy=len(window.location_tallies) > 1)
+
+    enrichment.finish([(window.item_tally, window.location_tallies) for window in windows])
+
+
+# The columns of a period-over-period report
+WINDOW_DELTA_COLUMNS = [
+    ("Name", "name", "text"),
+    ("Variation Name", "variation_name", "text"),
+    ("Qty Sold", "qty_sold", "int"),
+    ("Prior Qty Sold", "prior_qty_sold", "int"),
+    ("Qty Change", "qty_change", "int"),
+    ("Order Sales Total", "sales_total_cents", "cents"),
+    ("Prior Sales Total", "prior_sales_total_cents", "cents"),
+    ("Sales Change", "sales_change_cents", "cents"),
+    ("Sales Change %", "sales_change_percent", "percent"),
+]
+
+# The columns of the summary of every window
+WINDOW_SUMMARY_COLUMNS = [
+    ("Window", "window", "text"),
+    ("Start", "start_at", "text"),
+    ("End", "end_at", "text"),
+    ("Qty Sold", "qty_sold", "int"),
+    ("Order Sales Total", "sales_total_cents", "cents"),
+    ("Compared With", "compared_with", "text"),
+    ("Prior Sales Total", "prior_sales_total_cents", "cents"),
+    ("Sales Change", "sales_change_cents", "cents"),
+    ("Sales Change %", "sales_change_percent", "percent"),
+]
+
+
+# The change from `prior` to `current` in percent, or None with nothing before
+def percent_change(current, prior):
+    if not prior:
+        return None
+    return round((current / prior - 1) * 100, 1)
+
+
+# A period-over-period row for one item, from its totals in the window and in
+# the prior window (either can be None)
+def delta_row(current, prior):
+    named = current or prior
+    qty_sold = current.qty_sold if current else 0
+    prior_qty_sold = prior.qty_sold if prior else 0
+    sales_total = current.sales_total if current else 0
+    prior_sales_total = prior.sales_total if prior else 0
+    return [
+        named.name,
+        named.variation_name,
+        qty_sold,
+        prior_qty_sold,
+        qty_sold - prior_qty_sold,
+        sales_total,
+        prior_sales_total,
+        sales_total - prior_sales_total,
+        percent_change(sales_total, prior_sales_total),
+    ]
+
+
+# Write a report file (and optionally print a table) of `rows` with `columns`
+def write_rows(columns, rows, output_format, report_file, show_table):
+    table = None
+    if show_table:
+        from prettytable import PrettyTable
+        table = PrettyTable()
+        table.field_names = [header for header, _, _ in columns]
+
+    writer = REPORT_WRITERS[output_format](report_file, columns)
+    for row in rows:
+        writer.write_row(row)
+        if table is not None:
+            table.add_row(display_row(columns, row))
+    writer.close()
+    if table is not None:
+        print(table)
+
+
+# Generate the period-over-period report for a window and its prior window:
+# every item sold in either, with the change in quantity and sales
+def generate_delta_report(window, prior, output_format, report_file, show_table):
+    sections = window.sections()
+    prior_sections = dict(prior.sections())
+    by_location = sections[0][0] is not None
+    columns = ([LOCATION_COLUMN] if by_location else []) + WINDOW_DELTA_COLUMNS
+
+    def rows():
+        for location, tally in sections:
+            prior_tally = prior_sections[location]
+            item_ids = itertools.chain(tally, (item_id for item_id in prior_tally if item_id not in tally))
+            for item_id in item_ids:
+                row = delta_row(tally.totals.get(item_id), prior_tally.totals.get(item_id))
+                yield [location] + row if by_location else row
+
+    print(f"\n{window.name} compared with {prior.name}:")
+    write_rows(columns, rows(), output_format, report_file, show_table)
+    print(f"Period over period report has been written to {report_file}")
+
+
+# Generate a report for each window, a period-over-period report for each
+# comparison, and a summary of every window (always printed).  The files are
+# named after `output` (sales_report.<format> by default), with the window names.
+def generate_window_reports(windows, comparisons, output_format, output=None, show_table=True):
+    stem = os.path.splitext(output)[0] if output else "sales_report"
+    for window in windows:
+        print(f"\n{window.name}: {window.start_at} to {window.end_at}")
+        generate_sales_report(
+            output_format, f"{stem}_{window.name}.{output_format}", show_table, sections=window.sections(),
+            days=selling_days(window.start_at, window.end_at),
+        )
+    for window, prior in comparisons:
+        generate_delta_report(
+            window, prior, output_format, f"{stem}_{window.name}_vs_{prior.name}.{output_format}", show_table
+        )
+
+    prior_of = {window.name: prior for window, prior in comparisons}
+    rows = []
+    for window in windows:
+        qty_sold = sum(item.qty_sold for item in window.item_tally.values())
+        sales_total = sum(item.sales_total for item in window.item_tally.values())
+        prior = prior_of.get(window.name)
+        prior_sales_total = sum(item.sales_total for item in prior.item_tally.values()) if prior else None
+        rows.append([
+            window.name, window.start_at, window.end_at, qty_sold, sales_total,
+            prior.name if prior else None,
+            prior_sales_total,
+            sales_total - prior_sales_total if prior else None,
+            percent_change(sales_total, prior_sales_total) if prior else None,
+        ])
+    summary_file = f"{stem}_windows.{output_format}"
+    print()
+    write_rows(WINDOW_SUMMARY_COLUMNS, rows, output_format, summary_file, True)
+    print(f"Window summary has been written to {summary_file}")
+
+
+# Service mode (--serve).
+#
+# A long-running process that keeps the client, the location list and the catalog
+# details warm, and keeps per-item sales totals for each location and day.  It
+# backfills the last `days` days when it starts, then every `refresh_interval`
+# seconds folds in the orders closed since the last refresh, drops the days that
+# have moved out of the last `days` days, and refreshes the inventory counts.
+# Report requests for whole days are added up from the daily totals, without
+# calling Square.
+#
+# Square webhook events keep the totals up to date between refreshes: an
+# order.updated event for a newly completed order adds it to its day's totals
+# straight away, and inventory.count.updated events update the stock counts.
+# Each order is only counted once, whether it arrives by event or by refresh.
+# An order is claimed while it's tallied, and counted once its tally is merged
+# into the daily totals; if the refresh or event fails, the claim is dropped, so
+# the next refresh pages the order again.
+class ReportService:
+    def __init__(self, days, refresh_interval, shards, workers, catalog_ttl):
+        self.days = days
+        self.refresh_interval = refresh_interval
+        self.shards = shards
+        self.workers = workers
+        self.catalog_ttl = catalog_ttl
+        self.lock = threading.Lock()
+
+        self.counted = {}  # order id -> the day it closed, for the orders in the daily totals
+        self.claimed = set()  # the ids of the orders being tallied, not merged yet
+        self.events = {}  # event id -> the date each webhook event was handled
+        self.counted_lock = threading.Lock()
+
+        self.daily = {}  # (location id, date) -> ItemTally of the orders closed that day
+        self.catalog = {}  # item id -> (sku, price)
+        self.catalog_fetched_at = time.time()
+        self.inventory = {}  # (item id, location id) -> quantity
+        self.first_day = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=days)
+        self.watermark = datetime.datetime.combine(self.first_day, datetime.time(), datetime.timezone.utc)
+        self.refreshed_at = None
+
+    # Fold the orders closed since the last refresh into the daily totals, then
+    # bring the catalog details and inventory counts up to date
+    def refresh(self):
+        self.drop_old_days()
+        end = datetime.datetime.now(datetime.timezone.utc) - ORDER_SYNC_SETTLE_TIME
+        if end > self.watermark:
+            # Only the backfill is split into shards; later refreshes are short
+            shards = self.shards if self.refreshed_at is None else 1
+            claimed = []
+            tasks = [
+                # An order closed exactly at `end` is left for the next refresh
+                (locations, start_at, end_at, False, claimed)
+                for locations, start_at, end_at, _ in shard_tasks(
+                    location_ids, self.watermark.isoformat(), end.isoformat(), shards
+                )
+            ]
+            try:
+                results = run_shards(self.tally_days, tasks, self.workers)
+            except BaseException:
+                self.release(claimed)
+                raise
+            with self.lock:
+                for days in results:
+                    self.merge(days)
+                self.count(claimed)
+                self.watermark = end
+
+        # Webhook events merge into the daily totals under the lock too
+        with self.lock:
+            item_ids = sorted({item_id for tally in self.daily.values() for item_id in tally})
+        if time.time() - self.catalog_fetched_at > self.catalog_ttl:
+            self.catalog = {}
+            self.catalog_fetched_at = time.time()
+        self.fetch_catalog(item_ids)
+
+        inventory = {}
+        for i in range(0, len(item_ids), INVENTORY_BATCH_SIZE):
+            for item_id, location, quantity in get_inventory_counts_bulk(item_ids[i:i + INVENTORY_BATCH_SIZE]):
+                inventory[(item_id, location)] = quantity
+        self.inventory = inventory
+        self.refreshed_at = datetime.datetime.now(datetime.timezone.utc)
+
+    # Move the first day on to `days` days ago, and drop the totals, order ids and
+    # event ids from before it
+    def drop_old_days(self):
+        first_day = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=self.days)
+        if first_day <= self.first_day:
+            return
+        with self.lock:
+            self.first_day = first_day
+            self.daily = {key: tally for key, tally in self.daily.items() if key[1] >= first_day}
+            # (A service that couldn't refresh for a while doesn't page the dropped days again)
+            self.watermark = max(
+                self.watermark, datetime.datetime.combine(first_day, datetime.time(), datetime.timezone.utc)
+            )
+            with self.counted_lock:
+                self.counted = {order_id: day for order_id, day in self.counted.items() if day >= first_day}
+                self.events = {event_id: day for event_id, day in self.events.items() if day >= first_day}
+
+    # Fetch the catalog details of any of the items that aren't known yet
+    def fetch_catalog(self, item_ids):
+        missing = [item_id for item_id in item_ids if item_id not in self.catalog]
+        for i in range(0, len(missing), CATALOG_BATCH_SIZE):
+            for item_id, sku, priceEach in get_catalog_info_bulk(missing[i:i + CATALOG_BATCH_SIZE]):
+                self.catalog[item_id] = (sku, priceEach)
+
+    # Tally one closed_at range of orders by location and day
+    def tally_days(self, locations, start_at, end_at, last_shard, claimed):
+        days = {}
+        for orders, _ in search_order_pages(locations, start_at, end_at, last_shard):
+            self.tally_orders(orders, days, claimed)
+        return days
+
+    # Tally the orders that haven't been counted or claimed yet into `days`, by
+    # location and day, and add their (id, date) to `claimed`
+    def tally_orders(self, orders, days, claimed):
+        by_day = {}
+        with self.counted_lock:
+            for order in orders:
+                if order["id"] not in self.counted and order["id"] not in self.claimed:
+                    day = parse_timestamp(order["closed_at"]).astimezone(datetime.timezone.utc).date()
+                    self.claimed.add(order["id"])
+                    claimed.append((order["id"], day))
+                    by_day.setdefault((order["location_id"], day), []).append(order)
+        with timings.stage("aggregation"):
+            for key, day_orders in by_day.items():
+                days.setdefault(key, ItemTally()).add_orders(day_orders)
+
+    # Add tallies by location and day to the daily totals; called with the lock held
+    def merge(self, days):
+        for key, tally in days.items():
+            self.daily.setdefault(key, ItemTally()).merge(tally)
+
+    # Count the claimed orders, once their tallies are in the daily totals; called
+    # with the lock held
+    def count(self, claimed):
+        with self.counted_lock:
+            self.counted.update(claimed)
+            self.claimed.difference_update(order_id for order_id, _ in claimed)
+
+    # Drop the claims on orders whose tallies weren't merged
+    def release(self, claimed):
+        with self.counted_lock:
+            self.claimed.difference_update(order_id for order_id, _ in claimed)
+
+    # Handle a Square webhook event.  Returns what was done with it.
+    #
+    # An event is only recorded as handled once it has been, so that Square's
+    # redelivery of an event that failed is handled again.  (Handling an event
+    # twice at the same time is harmless: each order is only counted once.)
+    def handle_event(self, event):
+        event_id = event.get("event_id") or json.dumps(event, sort_keys=True)
+        with self.counted_lock:
+            if event_id in self.events:
+                return "duplicate"
+        result = self.apply_event(event)
+        with self.counted_lock:
+            self.events[event_id] = datetime.datetime.now(datetime.timezone.utc).date()
+        return result
+
+    # Apply a webhook event to the daily totals or the inventory counts
+    def apply_event(self, event):
+        event_type = event.get("type")
+        data = event.get("data", {}).get("object", {})
+
+        if event_type == "order.updated":
+            # The event only has the order's state, so a completed order is retrieved
+            update = data.get("order_updated", {})
+            if update.get("state") != "COMPLETED" or update.get("location_id") not in location_ids:
+                return "ignored"
+            result = scheduler.call(
+                client.orders.batch_retrieve_orders,
+                body={"location_id": update["location_id"], "order_ids": [update["order_id"]]},
+            )
+            if result.is_error():
+                handle_error(result.errors)
+            orders = [
+                order for order in result.body.get("orders", [])
+                if order.get("state") == "COMPLETED" and "closed_at" in order
+                and order.get("source", {}).get("name") == SEED_DATA_REFERENCE_ID
+                and parse_timestamp(order["closed_at"]).astimezone(datetime.timezone.utc).date() >= self.first_day
+            ]
+            days, claimed = {}, []
+            try:
+                self.tally_orders(orders, days, claimed)
+            except BaseException:
+                self.release(claimed)
+                raise
+            if not days:
+                return "ignored"
+            with self.lock:
+                self.merge(days)
+                self.count(claimed)
+            self.fetch_catalog(sorted({item_id for tally in days.values() for item_id in tally}))
+            return "counted"
+
+        if event_type == "inventory.count.updated":
+            updated = 0
+            for count in data.get("inventory_counts", []):
+                if count.get("state") == "IN_STOCK" and count.get("location_id") in location_ids:
+                    self.inventory[(count["catalog_object_id"], count["location_id"])] = count["quantity"]
+                    updated += 1
+            return "updated" if updated else "ignored"
+
+        return "ignored"
+
+    # Refresh every refresh_interval seconds, until the process is stopped
+    def run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except (Exception, SystemExit) as e:
+                # handle_error has already printed the details
+                print("Refresh failed, trying again in", self.refresh_interval, "seconds", e)
+
+    # The report sections, as in report_sections(), for the days from start_day
+    # up to (but not including) end_day
+    def sections(self, start_day, end_day):
+        days = [start_day + datetime.timedelta(days=n) for n in range((end_day - start_day).days)]
+        tallies = {}
+        with self.lock:
+            for location in location_ids:
+                tally = tallies[location] = ItemTally()
+                for day in days:
+                    daily = self.daily.get((location, day))
+                    if daily is not None:
+                        tally.merge(daily, copy=True)
+        rollup = ItemTally()
+        for tally in tallies.values():
+            rollup.merge(tally, copy=len(tallies) > 1)
+
+        for location, tally in tallies.items():
+            for item_id, item in tally.totals.items():
+                item.sku, item.price_each = self.catalog.get(item_id, (None, None))
+                item.qty_remaining = self.inventory.get((item_id, location))
+        if len(tallies) > 1:
+            for item_id, item in rollup.totals.items():
+                item.sku, item.price_each = self.catalog.get(item_id, (None, None))
+                quantities = [
+                    self.inventory[(item_id, location)] for location in tallies
+                    if (item_id, location) in self.inventory and item_id in tallies[location]
+                ]
+                if quantities:
+                    from decimal import Decimal
+                    item.qty_remaining = str(sum(Decimal(q) for q in quantities))
+                else:
+                    item.qty_remaining = None
+            return list(tallies.items()) + [("All locations", rollup)]
+        return [(None, rollup)]
+
+
+# The request handler for the service, which answers
+# GET /report?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD[&format=csv]
+# (end_date is exclusive), GET /health and POST /webhooks.
+def report_request_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class ReportRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            service = self.server.service
+            if url.path == "/health":
+                with service.lock:
+                    days = len({day for _, day in service.daily})
+                return self.send_json(200, {
+                    "watermark": service.watermark.isoformat(),
+                    "refreshed_at": service.refreshed_at.isoformat() if service.refreshed_at else None,
+                    "first_day": service.first_day.isoformat(),
+                    "days": days,
+                    "items": len(service.catalog),
+                })
+            if url.path != "/report":
+                return self.send_json(404, {"error": "Unknown path " + url.path})
+
+            started = time.perf_counter()
+            try:
+                start_day = datetime.date.fromisoformat(query["start_date"])
+                end_day = datetime.date.fromisoformat(query["end_date"])
+            except (KeyError, ValueError):
+                return self.send_json(400, {"error": "start_date and end_date are required, as YYYY-MM-DD"})
+            if end_day <= start_day:
+                return self.send_json(400, {"error": "end_date must be after start_date"})
+            # (Webhook events can add orders closed after the watermark, up to today)
+            today = datetime.datetime.now(datetime.timezone.utc).date()
+            if start_day < service.first_day or end_day > today + datetime.timedelta(days=1):
+                return self.send_json(400, {
+                    "error": "The service has sales from %s up to today" % service.first_day
+                })
+
+            sections = service.sections(start_day, end_day)
+            by_location = sections[0][0] is not None
+            columns = [LOCATION_COLUMN] + REPORT_COLUMNS if by_location else REPORT_COLUMNS
+            days = selling_days(start_day.isoformat(), end_day.isoformat())
+            rows = [
+                ([location] if by_location else []) + report_row(item, days)
+                for location, tally in sections
+                for item in tally.values()
+            ]
+
+            if query.get("format") == "csv":
+                import csv
+                text = io.StringIO()
+                writer = csv.writer(text)
+                writer.writerow(csv_headers(columns))
+                writer.writerows(csv_row(row) for row in rows)
+                return self.send_body(200, "text/csv", text.getvalue().encode())
+
+            names = [name for _, name, _ in columns]
+            self.send_json(200, {
+                "start_date": start_day.isoformat(),
+                "end_date": end_day.isoformat(),
+                "rows": [dict(zip(names, row)) for row in rows],
+                "total_sales_cents": sum(item.sales_total for item in sections[-1][1].values()),
+                "milliseconds": round((time.perf_counter() - started) * 1000, 2),
+            })
+
+        # Square webhook events are POSTed to /webhooks
+        def do_POST(self):
+            if urllib.parse.urlsplit(self.path).path != "/webhooks":
+                return self.send_json(404, {"error": "Unknown path " + self.path})
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            signature_key = self.server.webhook_signature_key
+            if signature_key:
+                # Square signs the notification URL followed by the body
+                expected = base64.b64encode(hmac.new(
+                    signature_key.encode(), self.server.webhook_url.encode() + body, hashlib.sha256
+                ).digest()).decode()
+                if not hmac.compare_digest(expected, self.headers.get("x-square-hmacsha256-signature", "")):
+                    return self.send_json(403, {"error": "Invalid signature"})
+
+            try:
+                event = json.loads(body)
+            except ValueError:
+                return self.send_json(400, {"error": "The body isn't JSON"})
+            try:
+                result = self.server.service.handle_event(event)
+            except (Exception, SystemExit) as e:
+                return self.send_json(500, {"error": "Couldn't handle the event: %s" % e})
+            self.send_json(200, {"result": result})
+
+        def send_json(self, status, body):
+            self.send_body(status, "application/json", json.dumps(body).encode())
+
+        def send_body(self, status, content_type, data):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReportRequestHandler
+
+
+# Backfill the service, then answer report requests until the process is stopped.
+# `replay_events` is a file of webhook events, one JSON object a line, to handle
+# after the backfill (for trying out webhooks without Square sending them).
+def serve_reports(host, port, days, refresh_interval, shards, workers, catalog_ttl,
+                  replay_events=None, webhook_signature_key=None, webhook_url=None):
+    service = ReportService(days, refresh_interval, shards, workers, catalog_ttl)
+    print("Backfilling", days, "days of sales...")
+    service.refresh()
+    if replay_events:
+        replay_event_file(service, replay_events)
+    threading.Thread(target=service.run, daemon=True).start()
+
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host, port), report_request_handler())
+    server.daemon_threads = True
+    server.service = service
+    server.webhook_signature_key = webhook_signature_key
+    server.webhook_url = webhook_url or f"http://{host}:{server.server_address[1]}/webhooks"
+    print(f"Serving reports at http://{host}:{server.server_address[1]}/report?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD")
+    print(f"Send Square webhook events to {server.webhook_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+# Handle the webhook events in a JSON lines file, in order
+def replay_event_file(service, path):
+    results = {}
+    with open(path) as events:
+        for line in events:
+            if line.strip():
+                result = service.handle_event(json.loads(line))
+                results[result] = results.get(result, 0) + 1
+    print("Replayed events from", path + ":", ", ".join(f"{count} {result}" for result, count in sorted(results.items())))
+
+
+# Work out which locations to report on
+def get_location_ids(locations, location_cache=None):
+    # Use the main location of the account by default
+    if not locations:
+        return [get_main_location_id(location_cache)]
+
+    if locations == "all":
+        result = scheduler.call(client.locations.list_locations)
+        if result.is_error():
+            handle_error(result.errors)
+        return [
+            location["id"] for location in result.body.get("locations", [])
+            if location.get("status") == "ACTIVE"
+        ]
+
+    return [location.strip() for location in locations.split(",") if location.strip()]
+
+
+# The account's main location id.  It rarely changes, so with `location_cache`
+# (a JSON file) it's only looked up the first time for each account, saving a
+# round trip on every later run.  Accounts are told apart by their environment,
+# base URL and a hash of their access token.
+def get_main_location_id(location_cache=None):
+    account = "|".join([
+        os.environ["SQUARE_ENVIRONMENT"],
+        os.environ.get("SQUARE_BASE_URL", ""),
+        hashlib.sha256(os.environ["SQUARE_ACCESS_TOKEN"].encode()).hexdigest()[:16],
+    ])
+    cached = {}
+    if location_cache:
+        try:
+            with open(location_cache) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        if account in cached:
+            return cached[account]
+
+    result = scheduler.call(client.locations.retrieve_location, 'main')
+    if result.is_error():
+        handle_error(result.errors)
+    location_id = result.body["location"]["id"]
+
+    if location_cache:
+        cached[account] = location_id
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(location_cache)), exist_ok=True)
+            with open(location_cache, "w") as f:
+                json.dump(cached, f, indent=2)
+        except OSError as e:
+            print("Couldn't save the main location to", location_cache + ":", e)
+    return location_id
+
 
 # Ensure dates adhere to RFC 3339 format
 def check_date_format(dt):
@@ -239,19 +2640,6 @@ def handle_error(errors):
 
 
 if __name__ == "__main__":
-    # We don't recommend running this script in a production environment
-    load_dotenv()
-    client = Client(
-       bearer_auth_credentials=BearerAuthCredentials(
-        access_token=os.environ['SQUARE_ACCESS_TOKEN']
-    ),
-        environment=os.environ["SQUARE_ENVIRONMENT"],
-    )
-    # Use the main location of the account - retrieve_location('yourOtherLocationId') to use a different location
-    result = client.locations.retrieve_location('main')
-    location_id = result.body["location"]["id"]
-
-
     # Get start and end dates for the sales report
     parser = argparse.ArgumentParser(
         description="Generate a sales report for a time period"
@@ -262,8 +2650,222 @@ if __name__ == "__main__":
     parser.add_argument(
         "--end-date", required=False, help="End date for the report, in RFC 3339 format"
     )
+    parser.add_argument(
+        "--shards", type=int, default=1,
+        help="Split the date range into this many closed_at ranges and page them concurrently"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4,
+        help="Number of closed_at ranges to page at the same time (with --shards)"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=0,
+        help="Page and tally the closed_at ranges in this many worker processes, "
+        "using more than one core (with at least one range each)"
+    )
+    parser.add_argument(
+        "--part",
+        help="Only page and tally part K of N of the report, given as K/N, and save it in a shard file "
+        "for --merge (default file: sales_report.part-K-of-N.json, or --output)"
+    )
+    parser.add_argument(
+        "--merge", nargs="+", metavar="SHARD_FILE",
+        help="Write the report from the shard files saved by every --part of it"
+    )
+    parser.add_argument(
+        "--cache", nargs="?", const="sales_report_cache.db",
+        help="Keep completed orders in a local SQLite file (default: sales_report_cache.db), "
+        "so later runs only fetch orders closed since the last run"
+    )
+    parser.add_argument(
+        "--catalog-ttl", type=float, default=24,
+        help="With --cache, hours before a cached SKU and price is fetched again (default: 24)"
+    )
+    parser.add_argument(
+        "--catalog-cache-size", type=int, default=10000,
+        help="With --cache, the most catalog variations to keep cached (default: 10000)"
+    )
+    parser.add_argument(
+        "--locations",
+        help="Comma-separated location ids to report on, or 'all' for every active location "
+        "(default: the main location)"
+    )
+    parser.add_argument(
+        "--location-cache", default=LOCATION_CACHE,
+        help="JSON file the main location's id is kept in after it's first looked up "
+        f"(default: {LOCATION_CACHE}; '' to look it up every run)"
+    )
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true",
+        help="Make the order, catalog and inventory requests with asyncio and aiohttp, "
+        "at most --workers at a time over one pooled HTTP session"
+    )
+    parser.add_argument(
+        "--max-retries", type=int, default=6,
+        help="Times to retry a rate limited or failed request before giving up (default: 6)"
+    )
+    parser.add_argument(
+        "--group-by",
+        help="Also report sales grouped by these comma-separated dimensions: "
+        + ", ".join(GROUP_BY_DIMENSIONS) + " (for example day,category)"
+    )
+    parser.add_argument(
+        "--windows",
+        help="Report on several named date windows from one fetch of their orders: comma-separated "
+        "presets (" + ", ".join(WINDOW_PRESETS) + f", each also with {LAST_YEAR_SUFFIX} for the same "
+        "period last year) or NAME=START/END windows, for example today,mtd,mtd-ly,q1=2024-01-01/2024-04-01"
+    )
+    parser.add_argument(
+        "--compare",
+        help="With --windows, comma-separated NAME:PRIOR pairs of windows to compare period over period "
+        f"(default: each window with its {LAST_YEAR_SUFFIX} window)"
+    )
+    parser.add_argument(
+        "--format", dest="output_format", choices=REPORT_FORMATS,
+        help="Report file format: csv (the default), jsonl or parquet.  Amounts are written in cents "
+        "(the console table shows dollars).  Parquet needs pyarrow"
+    )
+    parser.add_argument(
+        "--output", help="Report file name (default: sales_report.<format>)"
+    )
+    parser.add_argument(
+        "--no-table", action="store_true",
+        help="Only print the summary, not the whole report table"
+    )
+    parser.add_argument(
+        "--timings",
+        help="Save the run's per-stage timings, throughput and peak memory to this JSON file"
+    )
+    parser.add_argument(
+        "--low-memory", action="store_true",
+        help="Keep memory bounded: with --group-by, line items past --spill-threshold are "
+        "kept in a temporary file rather than in memory.  Prints the peak memory at the end"
+    )
+    parser.add_argument(
+        "--spill-threshold", type=int, default=1000000,
+        help="With --low-memory, the most line items to keep in memory (default: 1000000)"
+    )
+    parser.add_argument(
+        "--serve", action="store_true",
+        help="Run as a service: keep daily sales totals up to date and answer "
+        "report requests over HTTP (see --port, --days and --refresh-interval)"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="With --serve, the address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="With --serve, the port to listen on (default: 8000)")
+    parser.add_argument(
+        "--days", type=int, default=90,
+        help="With --serve, the number of days of sales to keep (default: 90)"
+    )
+    parser.add_argument(
+        "--refresh-interval", type=float, default=300,
+        help="With --serve, seconds between fetches of newly closed orders (default: 300)"
+    )
+    parser.add_argument(
+        "--replay-events",
+        help="With --serve, handle the Square webhook events in this file (one JSON event a line) after the backfill"
+    )
+    parser.add_argument(
+        "--webhook-signature-key",
+        help="With --serve, check webhook events are signed with this key "
+        "(default: SQUARE_WEBHOOK_SIGNATURE_KEY, if it's set)"
+    )
+    parser.add_argument(
+        "--webhook-url",
+        help="With --serve, the notification URL the webhook subscription uses, which is part of the signature "
+        "(default: the service's /webhooks address)"
+    )
+    parser.add_argument(
+        "--stats", action="store_true",
+        help="Print API call counts, bytes, retries and latencies, and time by stage, at the end"
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write a span for every API request and report stage to this file, as JSON lines"
+    )
+    parser.add_argument(
+        "--checkpoint", default="sales_report.checkpoint.json",
+        help="File the run's progress is saved to, so it can be resumed "
+        "(default: sales_report.checkpoint.json)"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Pick up a run that didn't finish from its checkpoint file"
+    )
     args = parser.parse_args()
 
+    for option, value, least in (
+        ("--shards", args.shards, 1), ("--workers", args.workers, 1), ("--processes", args.processes, 0),
+        ("--max-retries", args.max_retries, 0),
+    ):
+        if value < least:
+            parser.error(f"{option} must be at least {least}")
+
+    group_by = None
+    if args.group_by:
+        group_by = [dimension.strip() for dimension in args.group_by.split(",") if dimension.strip()]
+        for dimension in group_by:
+            if dimension not in GROUP_BY_DIMENSIONS:
+                parser.error(f"can't group by {dimension!r} - choose from " + ", ".join(GROUP_BY_DIMENSIONS))
+
+    windows = None
+    if args.windows:
+        # Windows are always paged straight from Square, in one pass
+        for option, used in (
+            ("--start-date", args.start_date), ("--end-date", args.end_date), ("--cache", args.cache),
+            ("--async", args.use_async), ("--group-by", group_by), ("--resume", args.resume),
+            ("--serve", args.serve),
+        ):
+            if used:
+                parser.error(f"--windows can't be used with {option}")
+        try:
+            windows = parse_windows(args.windows, datetime.datetime.now().date())
+            comparisons = window_comparisons(windows, args.compare)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.compare:
+        parser.error("--compare needs --windows")
+
+    # The service keeps its own totals, paged straight from Square, for the last
+    # --days days, and answers report requests over HTTP rather than writing a file
+    if args.serve:
+        for option, used in (
+            ("--start-date", args.start_date), ("--end-date", args.end_date), ("--cache", args.cache),
+            ("--async", args.use_async), ("--group-by", group_by), ("--resume", args.resume),
+            ("--format", args.output_format), ("--output", args.output),
+        ):
+            if used:
+                parser.error(f"--serve can't be used with {option}")
+    if args.output_format is None:
+        args.output_format = "csv"
+
+    # Worker processes and shard files only page orders straight from Square
+    part = None
+    for option, used in (("--processes", args.processes), ("--part", args.part), ("--merge", args.merge)):
+        if not used:
+            continue
+        for other, other_used in (
+            ("--cache", args.cache), ("--async", args.use_async), ("--group-by", group_by),
+            ("--resume", args.resume), ("--windows", args.windows), ("--serve", args.serve),
+        ):
+            if other_used:
+                parser.error(f"{option} can't be used with {other}")
+    if args.part:
+        if args.merge:
+            parser.error("--part can't be used with --merge")
+        try:
+            part, parts = (int(number) for number in args.part.split("/"))
+        except ValueError:
+            parser.error("--part must be given as K/N, for example 1/4")
+        if not 1 <= part <= parts:
+            parser.error("--part K/N needs K from 1 to N")
+    if args.merge:
+        for option, used in (
+            ("--start-date", args.start_date), ("--end-date", args.end_date), ("--locations", args.locations),
+            ("--processes", args.processes),
+        ):
+            if used:
+                parser.error(f"--merge can't be used with {option} (the shard files give the report's dates and locations)")
+
     # If no dates are provided, default to today
     if (not args.start_date or not args.end_date):
         current_date = datetime.datetime.now()
@@ -275,7 +2877,128 @@ if __name__ == "__main__":
         if end_date < start_date:
             print("End date cannot be earlier than start date")
 
-    item_tally = defaultdict(lambda: {"qtySold": 0, "orderSalesTotal": 0})
-    item_ids = []  # Keep track of item ids for bulk retrieval
-    get_orders()
-    generate_sales_report()
+    # Now the arguments are good, import what the run needs
+    from dotenv import load_dotenv
+    from square.client import Client
+    from square.http.auth.o_auth_2 import BearerAuthCredentials
+    from square_transport import RequestScheduler, SpanFileWriter, SquareSession
+
+    # We don't recommend running this script in a production environment
+    load_dotenv()
+    client = Client(
+       bearer_auth_credentials=BearerAuthCredentials(
+        access_token=os.environ['SQUARE_ACCESS_TOKEN']
+    ),
+        environment=os.environ["SQUARE_ENVIRONMENT"],
+        custom_url=os.environ.get("SQUARE_BASE_URL", ""),
+    )
+    # Pages of orders are fetched without the SDK, and decoded by decode_order_page
+    order_session = SquareSession(
+        os.environ['SQUARE_ACCESS_TOKEN'], os.environ["SQUARE_ENVIRONMENT"], pool_size=max(1, args.workers)
+    )
+
+    # Every request goes through the scheduler, which retries rate limited and
+    # failed requests and backs off the concurrency while we're rate limited
+    scheduler = RequestScheduler(max_concurrency=args.workers, max_retries=args.max_retries)
+    timings.stats = scheduler.stats
+    trace = None
+    if args.trace:
+        trace = SpanFileWriter(args.trace)
+        scheduler.stats.subscribe(trace)
+    if args.merge:
+        shard_params, shard_files = read_shard_files(args.merge)
+        start_date, end_date = shard_params["start_date"], shard_params["end_date"]
+        location_ids = shard_params["locations"]
+    else:
+        location_ids = get_location_ids(args.locations, args.location_cache)
+
+    if args.serve:
+        serve_reports(
+            args.host, args.port, args.days, args.refresh_interval,
+            args.shards, args.workers, args.catalog_ttl * 3600,
+            replay_events=args.replay_events,
+            webhook_signature_key=args.webhook_signature_key or os.environ.get("SQUARE_WEBHOOK_SIGNATURE_KEY"),
+            webhook_url=args.webhook_url,
+        )
+        sys.exit(0)
+
+    if windows:
+        get_window_orders(windows, shards=args.shards, workers=args.workers)
+        with timings.stage("report"):
+            generate_window_reports(
+                windows, comparisons, args.output_format, args.output, show_table=not args.no_table
+            )
+    elif part:
+        location_tallies = {location: ItemTally() for location in location_ids}
+        line_item_columns = None
+        write_shard_file(
+            args.output or f"sales_report.part-{part}-of-{parts}.json", part, parts,
+            shards=args.shards, workers=args.workers, processes=args.processes,
+        )
+    else:
+        item_tally = ItemTally()  # every location rolled up
+        location_tallies = {location: ItemTally() for location in location_ids}
+        # With --group-by, every line item is also kept in columns
+        line_item_columns = LineItemColumns(
+            spill_threshold=args.spill_threshold if args.low_memory else None
+        ) if group_by else None
+        cache = OrderCache(args.cache) if args.cache else None
+        catalog_cache = CatalogCache(
+            args.cache, args.catalog_ttl * 3600, args.catalog_cache_size
+        ) if args.cache else None
+        inventory_snapshot = InventorySnapshot(args.cache, location_ids) if args.cache else None
+        # Runs that page orders straight from Square save their progress as they go.
+        # (With --cache, orders are saved in the cache instead.  Runs with worker
+        # processes, and merges of shard files, don't keep a checkpoint.)
+        checkpoint = None
+        if cache is None and not (args.processes or args.merge):
+            checkpoint = Checkpoint(args.checkpoint, {
+                "start_date": start_date,
+                "end_date": end_date,
+                "locations": location_ids,
+                "shards": args.shards,
+            })
+            if args.resume and group_by:
+                print("--resume can't be used with --group-by (the line item columns aren't checkpointed) - starting from the beginning")
+            elif args.resume:
+                checkpoint.load()
+
+        if args.merge:
+            print("Merging", len(shard_files), "shard files of the orders from", start_date, "to", end_date, "...")
+            enrichment = Enrichment(args.workers)
+            merge_partials(shard_files, enrichment)
+            roll_up_locations()
+            enrichment.finish()
+        elif args.use_async:
+            import asyncio
+            asyncio.run(get_orders_async(
+                shards=args.shards, workers=args.workers, cache=cache, catalog_cache=catalog_cache,
+                checkpoint=checkpoint, inventory_snapshot=inventory_snapshot,
+            ))
+        else:
+            get_orders(
+                shards=args.shards, workers=args.workers, cache=cache, catalog_cache=catalog_cache,
+                checkpoint=checkpoint, inventory_snapshot=inventory_snapshot, processes=args.processes,
+            )
+        if checkpoint is not None:
+            checkpoint.remove()
+        with timings.stage("report"):
+            generate_sales_report(
+                output_format=args.output_format,
+                report_file=args.output or "sales_report." + args.output_format,
+                show_table=not args.no_table,
+            )
+            if group_by:
+                generate_grouped_report(group_by, output_format=args.output_format, show_table=not args.no_table)
+
+    if args.timings:
+        with open(args.timings, "w") as timings_file:
+            json.dump(timings.results(), timings_file, indent=2)
+        print(f"Timings have been written to {args.timings}")
+    if trace is not None:
+        trace.close()
+        print(f"Spans have been written to {args.trace}")
+    if args.stats:
+        print(timings.summary())
+    elif args.low_memory and peak_memory() is not None:
+        print(f"Peak memory: {peak_memory() / 2**20:.1f} MB")
@@ -0,0 +1,521 @@
+# Copyright 2024 Square Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Transports for the Square API calls made by the sample scripts: a pooled
+# requests session for threads, and an aiohttp session for asyncio.
+#
+# Requests go through one pooled HTTP session, and at most `concurrency` of them
+# are in flight at once, so that the scripts can overlap their network waits.
+# A RequestScheduler retries rate limited and failed requests, and backs the
+# concurrency off while Square is rate limiting.
+# Results look like the Square SDK's ApiResponse (body, errors, cursor,
+# is_success() and is_error()), so the same code can handle both.
+#
+# Responses are parsed with orjson when it's installed (pip install orjson),
+# which is several times faster than the json module on large pages.  A caller
+# can also pass its own `decode` for the response bytes of a call, to keep only
+# the parts of a large response it reads.
+#
+# The scheduler also keeps statistics for each endpoint (calls, retries, errors,
+# bytes received and a latency histogram), and passes a span for every request
+# to any hooks subscribed to its CallStats, for exporting to a tracing system.
+#
+# asyncio and aiohttp are only imported for the asyncio transport.
+
+import bisect, datetime, json, os, random, sys, threading, time
+from collections import deque, namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BASE_URLS = {
+    "production": "https://connect.squareup.com",
+    "sandbox": "https://connect.squareupsandbox.com",
+}
+
+# The API version the scripts were written against (the SDK's default)
+SQUARE_VERSION = "2024-03-20"
+
+
+# The base URL for an environment.  The "custom" environment uses SQUARE_BASE_URL,
+# for example a local stub server.
+def base_url_for(environment):
+    if environment == "custom":
+        return os.environ["SQUARE_BASE_URL"]
+    return BASE_URLS[environment]
+
+
+# The headers sent with every request
+def request_headers(access_token):
+    return {
+        "Authorization": "Bearer " + access_token,
+        "Square-Version": SQUARE_VERSION,
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    }
+
+
+# Parse a JSON response body (bytes)
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Decode a response body.  `decode` is only used for a successful response: an
+# error from Square is plain JSON, and one from a gateway or proxy (a 502 page,
+# say) may not be JSON at all, so it's kept as the text of an error.  Either way
+# the status gets back to the scheduler, which retries temporary errors.
+def decode_body(status_code, content, decode=None):
+    if not content:
+        return {}
+    if 200 <= status_code < 300:
+        return (decode or json_loads)(content)
+    try:
+        return json_loads(content)
+    except ValueError:
+        return {"errors": [{
+            "category": "API_ERROR",
+            "code": f"HTTP_{status_code}",
+            "detail": content.decode("utf-8", "replace")[:500],
+        }]}
+
+
+# Timestamps in request bodies are sent in RFC 3339 format
+def encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Can't encode {type(value).__name__} as JSON")
+
+
+# The result of one API call, shaped like the SDK's ApiResponse
+class ApiResult:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.errors = body.get("errors") if isinstance(body, dict) else None
+        self.cursor = body.get("cursor") if isinstance(body, dict) else None
+
+    def is_success(self):
+        return 200 <= self.status_code < 300
+
+    def is_error(self):
+        return not self.is_success()
+
+
+# Responses worth retrying: rate limited, or a temporary server problem
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Upper bounds of the latency histogram buckets, in seconds (the last bucket
+# counts everything slower)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+# One timed piece of work, as passed to span hooks.  kind is "request" for an
+# HTTP request (one attempt of an API call) or "stage" for a stage of a script's
+# work.  status is the HTTP status (None if the request failed to connect), and
+# attempt counts from 0 for the first try.
+Span = namedtuple("Span", "kind name started_at seconds status attempt bytes")
+
+
+# The size of a response body in bytes, from an ApiResult or SDK ApiResponse
+def response_size(result):
+    length = result.headers.get("Content-Length") or result.headers.get("content-length")
+    if length is not None:
+        return int(length)
+    text = getattr(result, "text", None)
+    return len(text.encode()) if isinstance(text, str) else 0
+
+
+class EndpointStats:
+    __slots__ = ("calls", "retries", "errors", "bytes", "seconds", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    # The latency that `fraction` of calls were at least as fast as, to the
+    # nearest bucket bound (None if it's in the last, open-ended bucket)
+    def percentile(self, fraction):
+        wanted = fraction * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= wanted and count:
+                return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else None
+        return None
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "latency_histogram": dict(zip(
+                ["<=%gs" % bound for bound in LATENCY_BUCKETS] + [">%gs" % LATENCY_BUCKETS[-1]],
+                self.histogram,
+            )),
+        }
+
+
+# Statistics for every API call made through a RequestScheduler, by endpoint.
+# Hooks subscribed with subscribe() are called with a Span for every request,
+# and for any stages a script times with span().
+class CallStats:
+    def __init__(self):
+        self.endpoints = {}
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, hook):
+        self.hooks.append(hook)
+
+    def emit(self, span):
+        for hook in self.hooks:
+            hook(span)
+
+    def record(self, endpoint, started_at, seconds, status, attempt, size):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.calls += 1
+            stats.retries += attempt > 0
+            stats.errors += status is None or status >= 400
+            stats.bytes += size
+            stats.seconds += seconds
+            stats.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if self.hooks:
+            self.emit(Span("request", endpoint, started_at, seconds, status, attempt, size))
+
+    def to_dict(self):
+        with self.lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in sorted(self.endpoints.items())}
+
+    # Add in the statistics from another CallStats' to_dict(), such as one kept
+    # in a worker process or saved in a file
+    def add(self, endpoints):
+        with self.lock:
+            for endpoint, counts in endpoints.items():
+                stats = self.endpoints.get(endpoint)
+                if stats is None:
+                    stats = self.endpoints[endpoint] = EndpointStats()
+                stats.calls += counts["calls"]
+                stats.retries += counts["retries"]
+                stats.errors += counts["errors"]
+                stats.bytes += counts["bytes"]
+                stats.seconds += counts["seconds"]
+                for bucket, count in enumerate(counts["latency_histogram"].values()):
+                    stats.histogram[bucket] += count
+
+    # A table of the calls to each endpoint, for printing at the end of a run
+    def summary(self):
+        lines = ["%-34s %7s %7s %6s %10s %9s %9s %9s" % (
+            "Endpoint", "Calls", "Retries", "Errors", "KB", "Total (s)", "p50", "p95",
+        )]
+        with self.lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                p50, p95 = stats.percentile(0.5), stats.percentile(0.95)
+                lines.append("%-34s %7d %7d %6d %10.1f %9.2f %9s %9s" % (
+                    endpoint, stats.calls, stats.retries, stats.errors, stats.bytes / 1024, stats.seconds,
+                    "<=%gs" % p50 if p50 is not None else "slow",
+                    "<=%gs" % p95 if p95 is not None else "slow",
+                ))
+        return "\n".join(lines)
+
+
+# A span hook that writes each span to a file as a line of JSON
+class SpanFileWriter:
+    def __init__(self, path):
+        self.file = open(path, "w")
+        self.lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span._asdict()) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        self.file.close()
+
+
+# Every API request made by a script goes through one RequestScheduler.
+#
+# Failed requests are retried with exponential backoff and jitter (waiting at
+# least as long as any Retry-After header asks), so a rate limit or a brief
+# outage part way through a run doesn't lose the pages already fetched: the
+# failed request, with the same cursor, is simply sent again.
+#
+# The scheduler also limits how many requests are in flight.  The limit is
+# halved whenever Square rate limits a request, and grows back by one after a
+# run of successful requests, up to max_concurrency.
+#
+# call() is for threads and call_async() for coroutines.  Both count against
+# the same limit, so threads and an event loop can share one scheduler.
+class RequestScheduler:
+    def __init__(self, max_concurrency=8, max_retries=6, base_delay=0.5, max_delay=30):
+        self.stats = CallStats()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.lock = threading.Lock()
+        # A threading.Event for each thread, or an (event loop, future) for each coroutine,
+        # waiting for a slot.  Freed slots are handed to them in the order they asked, so a
+        # caller that has just released a slot can't take it straight back.
+        self.waiters = deque()
+
+    def acquire(self):
+        with self.lock:
+            if self.in_flight < self.limit and not self.waiters:
+                self.in_flight += 1
+                return
+            granted = threading.Event()
+            self.waiters.append(granted)
+        granted.wait()
+
+    async def acquire_async(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.in_flight < self.limit and not self.waiters:
+                self.in_flight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self.waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                else:
+                    # The slot was handed over as the coroutine was cancelled
+                    self.in_flight -= 1
+                    self.hand_off()
+            raise
+
+    def release(self, throttled):
+        with self.lock:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self.hand_off()
+
+    # Give free slots to the callers that have waited longest; called with the lock held
+    def hand_off(self):
+        while self.waiters and self.in_flight < self.limit:
+            self.in_flight += 1
+            waiter = self.waiters.popleft()
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(wake, future)
+
+    # How long to wait before sending a request again
+    def retry_delay(self, attempt, result):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = result.headers.get("Retry-After") if result is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    # Call send(*args, **kwargs), which makes one request and returns an
+    # ApiResult or SDK ApiResponse, retrying until it succeeds or the retries
+    # run out.  The last response (or connection error) is returned (or raised).
+    # Each attempt is recorded in the stats under `endpoint` (by default, the
+    # name of the send function, such as search_orders for an SDK method).
+    def call(self, send, *args, endpoint=None, **kwargs):
+        endpoint = endpoint or send.__name__
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            result = None
+            started_at = time.time()
+            started = time.perf_counter()
+            try:
+                result = send(*args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                self.finish(endpoint, started_at, started, result, attempt)
+
+            if self.is_final(result, attempt):
+                return result
+            time.sleep(self.retry_delay_for(attempt, result))
+
+    # The same as call(), for an async `send`, which raises ConnectionError if
+    # the request fails to connect
+    async def call_async(self, send, *args, endpoint=None, **kwargs):
+        import asyncio
+        endpoint = endpoint or send.__name__
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async()
+            result = None
+            started_at = time.time()
+            started = time.perf_counter()
+            try:
+                result = await send(*args, **kwargs)
+            except ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                self.finish(endpoint, started_at, started, result, attempt)
+
+            if self.is_final(result, attempt):
+                return result
+            await asyncio.sleep(self.retry_delay_for(attempt, result))
+
+    # Free the request's slot and record the attempt in the stats
+    def finish(self, endpoint, started_at, started, result, attempt):
+        self.release(result is not None and result.status_code == 429)
+        self.stats.record(
+            endpoint, started_at, time.perf_counter() - started,
+            result.status_code if result is not None else None, attempt,
+            response_size(result) if result is not None else 0,
+        )
+
+    # Whether an attempt's result is the one to return, rather than retry
+    def is_final(self, result, attempt):
+        return result is not None and (result.status_code not in RETRY_STATUSES or attempt == self.max_retries)
+
+    # The delay before retrying a failed attempt, which is printed
+    def retry_delay_for(self, attempt, result):
+        delay = self.retry_delay(attempt, result)
+        reason = f"HTTP {result.status_code}" if result is not None else "connection error"
+        print(f"Request failed ({reason}), retrying in {delay:.1f}s...")
+        return delay
+
+
+# Let a coroutine waiting in RequestScheduler.acquire_async() know it has a slot
+def wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# A pooled HTTP session that calls the Square API directly, rather than through
+# the SDK, for the calls whose responses are worth decoding with care.  send()
+# makes one request; use it with RequestScheduler.call for retries.
+class SquareSession:
+    def __init__(self, access_token, environment, pool_size=8, timeout=60):
+        self.base_url = base_url_for(environment).rstrip("/")
+        self.timeout = timeout
+
+        # One keep-alive connection per concurrent request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(request_headers(access_token))
+
+    # Make one request.  A successful response's body is decoded from bytes with
+    # `decode` (json_loads by default).
+    def send(self, method, path, body, decode=None):
+        data = json.dumps(body, default=encode_value) if body is not None else None
+        response = self.session.request(
+            method, self.base_url + path, data=data, timeout=self.timeout
+        )
+        return ApiResult(
+            response.status_code, response.headers, decode_body(response.status_code, response.content, decode)
+        )
+
+    def close(self):
+        self.session.close()
+
+
+# The Square API calls the scripts make, for asyncio.  Requests are sent with
+# aiohttp (pip install aiohttp) over one pooled session, so a request in flight
+# only holds a coroutine, not a thread.  Create the client in a coroutine, and
+# close it with `await client.close()`.
+class AsyncSquareClient:
+    def __init__(self, access_token, environment, concurrency=8, timeout=60, scheduler=None):
+        try:
+            import aiohttp
+        except ImportError:
+            print("--async needs aiohttp - install it with: pip install aiohttp")
+            sys.exit(1)
+        self.aiohttp = aiohttp
+        self.base_url = base_url_for(environment).rstrip("/")
+        self.scheduler = scheduler or RequestScheduler(max_concurrency=concurrency)
+
+        # One keep-alive connection per concurrent request
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency),
+            headers=request_headers(access_token),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        )
+
+    # Make one request, as SquareSession.send() does
+    async def send(self, method, path, body, decode=None):
+        import asyncio
+        data = json.dumps(body, default=encode_value) if body is not None else None
+        try:
+            async with self.session.request(method, self.base_url + path, data=data) as response:
+                content = await response.read()
+        except (self.aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"{method} {path} failed: {e!r}") from e
+        return ApiResult(response.status, response.headers, decode_body(response.status, content, decode))
+
+    async def call(self, endpoint, method, path, body=None, decode=None):
+        return await self.scheduler.call_async(self.send, method, path, body, decode=decode, endpoint=endpoint)
+
+    async def close(self):
+        await self.session.close()
+
+    # Orders API.  `decode` decodes a page of results from its bytes.
+    async def search_orders(self, body, decode=None):
+        return await self.call("search_orders", "POST", "/v2/orders/search", body, decode=decode)
+
+    async def create_order(self, body):
+        return await self.call("create_order", "POST", "/v2/orders", body)
+
+    async def update_order(self, order_id, body):
+        return await self.call("update_order", "PUT", f"/v2/orders/{order_id}", body)
+
+    # Payments API
+    async def create_payment(self, body):
+        return await self.call("create_payment", "POST", "/v2/payments", body)
+
+    # Catalog API
+    async def batch_retrieve_catalog_objects(self, body):
+        return await self.call("batch_retrieve_catalog_objects", "POST", "/v2/catalog/batch-retrieve", body)
+
+    async def search_catalog_objects(self, body):
+        return await self.call("search_catalog_objects", "POST", "/v2/catalog/search", body)
+
+    # Inventory API
+    async def batch_retrieve_inventory_counts(self, body):
+        return await self.call("batch_retrieve_inventory_counts", "POST", "/v2/inventory/counts/batch-retrieve", body)
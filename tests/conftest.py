@@ -0,0 +1,88 @@
+# Fixtures shared by the tests.  The scripts are run against fake_square_server.py,
+# which is started once for the test session on a free port.
+
+import importlib.util, os, socket, subprocess, sys, time, urllib.request
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+LOCATIONS = "FAKELOCATION01,FAKELOCATION02"
+
+
+# Import one of the scripts, which have hyphens in their names, as a module
+def load_script(file_name):
+    spec = importlib.util.spec_from_file_location(file_name[:-3].replace("-", "_"), os.path.join(REPO, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def fake_server():
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO, "fake_square_server.py"), "--port", str(port),
+         "--orders", "5000", "--locations", "2"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while True:
+        try:
+            urllib.request.urlopen(url + "/v2/locations", timeout=5).close()
+            break
+        except OSError:
+            if time.time() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError("The fake Square server didn't start")
+            time.sleep(0.1)
+    yield url
+    process.terminate()
+    process.wait()
+
+
+# The environment that points the scripts at the fake server
+@pytest.fixture(scope="session")
+def square_env(fake_server):
+    return dict(
+        os.environ, SQUARE_ENVIRONMENT="custom", SQUARE_BASE_URL=fake_server, SQUARE_ACCESS_TOKEN="test",
+    )
+
+
+# Run simple-sales-report.py in `directory` for all of 2024 (unless `dates` is
+# False, for --merge), and return what it printed
+def run_report(directory, env, *args, dates=True):
+    report_range = ["--start-date", "2024-01-01", "--end-date", "2025-01-01", "--locations", LOCATIONS] if dates else []
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, "simple-sales-report.py"), *report_range,
+         "--no-table", "--location-cache", "", *args],
+        cwd=directory, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+@pytest.fixture(scope="session")
+def report():
+    return load_script("simple-sales-report.py")
+
+
+def read(path):
+    with open(path) as file:
+        return file.read()
+
+
+# The report paged serially, which every other way of running it should match
+@pytest.fixture(scope="session")
+def serial_report(tmp_path_factory, square_env):
+    directory = tmp_path_factory.mktemp("serial")
+    run_report(directory, square_env)
+    return read(directory / "sales_report.csv")
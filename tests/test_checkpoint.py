@@ -0,0 +1,60 @@
+import os
+
+from conftest import LOCATIONS, read, run_report
+
+
+def sample_tally(report):
+    tally = report.ItemTally()
+    tally.add_orders([{
+        "id": "ORDER1",
+        "line_items": [{
+            "catalog_object_id": "ITEM1", "quantity": "2", "name": "Tea", "variation_name": "Green",
+            "base_price_money": {"amount": 350, "currency": "USD"},
+        }],
+    }])
+    return tally
+
+
+def test_checkpoint_restore(report, tmp_path):
+    path = str(tmp_path / "run.checkpoint.json")
+    params = {"start_date": "2024-01-01T00:00:00", "end_date": "2025-01-01T00:00:00", "locations": ["L1"], "shards": 2}
+    checkpoint = report.Checkpoint(path, params)
+    checkpoint.page_done(0, None, {"L1": sample_tally(report)})
+
+    restored = report.Checkpoint(path, params)
+    restored.load()
+    tallies, cursor, done = restored.restore(0)
+    assert (cursor, done) == (None, True)
+    assert tallies["L1"].to_rows() == [["ITEM1", "ORDER1", "Tea", "Green", 2, 700]]
+    assert restored.restore(1) is None
+
+    # A checkpoint for a different report isn't used
+    other = report.Checkpoint(path, dict(params, shards=3))
+    other.load()
+    assert other.restore(0) is None
+
+
+# A run resumed with one shard already done in its checkpoint only pages the
+# other shard, and gives the same report as a run from the start
+def test_resumed_report_matches(report, tmp_path, square_env, monkeypatch):
+    from square_transport import RequestScheduler, SquareSession
+    for name, value in square_env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(report, "scheduler", RequestScheduler(), raising=False)
+    monkeypatch.setattr(report, "order_session", SquareSession("test", "custom"), raising=False)
+    monkeypatch.setattr(report, "line_item_columns", None, raising=False)
+
+    start, end, locations = "2024-01-01T00:00:00", "2025-01-01T00:00:00", LOCATIONS.split(",")
+    tasks = report.shard_tasks(locations, start, end, 2)
+    checkpoint = report.Checkpoint(str(tmp_path / "run.checkpoint.json"), {
+        "start_date": start, "end_date": end, "locations": locations, "shards": 2,
+    })
+    checkpoint.page_done(0, None, report.get_order_shard(0, *tasks[0], None))
+
+    output = run_report(tmp_path, square_env, "--shards", "2", "--checkpoint", "run.checkpoint.json", "--resume")
+    assert "1 shard(s) done, 0 part way through" in output
+    assert not os.path.exists(tmp_path / "run.checkpoint.json")
+    resumed = read(tmp_path / "sales_report.csv")
+
+    run_report(tmp_path, square_env, "--shards", "2", "--checkpoint", "run.checkpoint.json")
+    assert resumed == read(tmp_path / "sales_report.csv")
@@ -0,0 +1,40 @@
+import pytest
+
+
+@pytest.fixture
+def lookups(report, monkeypatch):
+    sent = {"catalog": [], "inventory": []}
+    monkeypatch.setattr(report, "get_catalog_info_bulk", lambda ids: sent["catalog"].append(ids) or [])
+    monkeypatch.setattr(report, "get_inventory_counts_bulk", lambda ids: sent["inventory"].append(ids) or [])
+    monkeypatch.setattr(report, "ENRICHMENT_FLUSH_INTERVAL", 60)
+    return sent
+
+
+# Ids that don't fill a chunk are looked up while orders are still paged, not
+# only once paging is done
+def test_partial_chunks_are_sent_while_paging(report, lookups):
+    enrichment = report.Enrichment(2)
+    enrichment.add(["ITEM1", "ITEM2"])
+    enrichment.add(["ITEM3"])
+    enrichment.add(["ITEM1"])
+    enrichment.executor.shutdown()
+    assert lookups["catalog"] == lookups["inventory"] == [["ITEM1", "ITEM2"]]
+
+    # Once the flush interval has passed, the waiting ids go too
+    enrichment = report.Enrichment(2)
+    enrichment.add(["ITEM1", "ITEM2"])
+    enrichment.add(["ITEM3"])
+    enrichment.flush_at = 0
+    enrichment.add(["ITEM4"])
+    enrichment.executor.shutdown()
+    assert lookups["catalog"][1:] == [["ITEM1", "ITEM2"], ["ITEM3", "ITEM4"]]
+
+
+def test_full_chunks_are_sent_at_once(report, lookups, monkeypatch):
+    monkeypatch.setattr(report, "CATALOG_BATCH_SIZE", 2)
+    enrichment = report.Enrichment(2)
+    enrichment.add(["ITEM1"])
+    enrichment.add(["ITEM2", "ITEM3", "ITEM4"])
+    enrichment.executor.shutdown()
+    assert lookups["catalog"] == [["ITEM1"], ["ITEM2", "ITEM3"]]
+    assert enrichment.pending_catalog == ["ITEM4"]
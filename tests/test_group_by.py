@@ -0,0 +1,11 @@
+from conftest import read, run_report
+
+
+def test_grouped_report_is_the_same_when_sharded(tmp_path, square_env):
+    serial, sharded = tmp_path / "serial", tmp_path / "sharded"
+    serial.mkdir()
+    sharded.mkdir()
+    run_report(serial, square_env, "--group-by", "variation,location,day")
+    run_report(sharded, square_env, "--group-by", "variation,location,day", "--shards", "6", "--workers", "6")
+    name = "sales_report_by_variation_location_day.csv"
+    assert read(sharded / name) == read(serial / name)
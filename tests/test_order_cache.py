@@ -0,0 +1,35 @@
+from conftest import read, run_report
+
+
+# A report from the cache is the same as one paged straight from Square, both
+# when the cache is filled and when it's read back
+def test_cached_report_matches_serial(tmp_path, square_env, serial_report):
+    run_report(tmp_path, square_env, "--cache", "orders.db", "--shards", "3", "--workers", "3")
+    assert read(tmp_path / "sales_report.csv") == serial_report
+    run_report(tmp_path, square_env, "--cache", "orders.db")
+    assert read(tmp_path / "sales_report.csv") == serial_report
+
+
+def test_missing_ranges(report, tmp_path):
+    cache = report.OrderCache(str(tmp_path / "orders.db"))
+    location = "FAKELOCATION01"
+    assert cache.missing_ranges(location, "2024-03-01T00:00:00Z", "2024-04-01T00:00:00Z") == [
+        ("2024-03-01T00:00:00Z", "2024-04-01T00:00:00Z")
+    ]
+
+    cache.mark_synced(location, "2024-03-01T00:00:00Z", "2024-04-01T00:00:00Z")
+    synced_from, synced_to = "2024-03-01T00:00:00.000000Z", "2024-04-01T00:00:00.000000Z"
+    assert cache.missing_ranges(location, "2024-03-10T00:00:00Z", "2024-03-20T00:00:00Z") == []
+    assert cache.missing_ranges(location, "2024-02-01T00:00:00Z", "2024-05-01T00:00:00Z") == [
+        ("2024-02-01T00:00:00Z", synced_from), (synced_to, "2024-05-01T00:00:00Z")
+    ]
+    assert cache.missing_ranges(location, "2024-03-15T00:00:00Z", "2024-06-01T00:00:00Z") == [
+        (synced_to, "2024-06-01T00:00:00Z")
+    ]
+    assert cache.missing_ranges("FAKELOCATION02", "2024-03-10T00:00:00Z", "2024-03-20T00:00:00Z") == [
+        ("2024-03-10T00:00:00Z", "2024-03-20T00:00:00Z")
+    ]
+
+    # The synced range grows to cover a later sync
+    cache.mark_synced(location, "2024-04-01T00:00:00Z", "2024-05-01T00:00:00Z")
+    assert cache.missing_ranges(location, "2024-03-01T00:00:00Z", "2024-05-01T00:00:00Z") == []
@@ -0,0 +1,102 @@
+import asyncio, json, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from square_transport import RequestScheduler, SquareSession
+
+PAGE = {"orders": [{
+    "id": "ORDER1", "location_id": "L1", "closed_at": "2024-05-01T12:00:00Z", "state": "COMPLETED",
+    "taxes": [{"name": "VAT"}], "tenders": [{"type": "CASH"}],
+    "line_items": [{
+        "catalog_object_id": "ITEM1", "quantity": "2", "name": "Tea", "variation_name": "Green",
+        "base_price_money": {"amount": 350, "currency": "USD"}, "note": "extra hot",
+    }],
+}]}
+
+
+# Answers each POST with the next of `responses` (status, content type, body),
+# then with the last one
+class ScriptedServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, responses):
+        super().__init__(("127.0.0.1", 0), ScriptedHandler)
+        self.responses = list(responses)
+        self.requests = 0
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        server = self.server
+        status, content_type, body = server.responses[min(server.requests, len(server.responses) - 1)]
+        server.requests += 1
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def gateway_error_once(monkeypatch):
+    server = ScriptedServer([
+        (502, "text/html", b"<html><body><h1>502 Bad Gateway</h1></body></html>"),
+        (200, "application/json", json.dumps(PAGE).encode()),
+    ])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("SQUARE_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_decode_order_page_keeps_report_fields(report):
+    page = report.decode_order_page(json.dumps(PAGE).encode())
+    assert page["orders"] == [report.compact_order(PAGE["orders"][0])]
+    order = page["orders"][0]
+    assert "taxes" not in order and "tenders" not in order
+    assert order["line_items"][0]["base_price_money"]["amount"] == 350
+
+
+# A gateway error page isn't JSON, but is retried like any other 502
+def test_gateway_error_is_retried(report, gateway_error_once):
+    session = SquareSession("test", "custom")
+    scheduler = RequestScheduler(base_delay=0.01)
+    result = scheduler.call(
+        session.send, "POST", "/v2/orders/search", {}, decode=report.decode_order_page, endpoint="search_orders",
+    )
+    session.close()
+    assert result.status_code == 200
+    assert result.body["orders"][0]["id"] == "ORDER1"
+    assert gateway_error_once.requests == 2
+    assert scheduler.stats.to_dict()["search_orders"]["retries"] == 1
+
+
+def test_async_gateway_error_is_retried(report, gateway_error_once):
+    pytest.importorskip("aiohttp")
+    from square_transport import AsyncSquareClient
+
+    async def search():
+        client = AsyncSquareClient("test", "custom", scheduler=RequestScheduler(base_delay=0.01))
+        try:
+            return await client.search_orders({}, decode=report.decode_order_page)
+        finally:
+            await client.close()
+
+    result = asyncio.run(search())
+    assert result.status_code == 200
+    assert gateway_error_once.requests == 2
+
+
+def test_error_without_json_body(gateway_error_once):
+    gateway_error_once.responses = [(503, "text/plain", b"upstream unavailable")]
+    session = SquareSession("test", "custom")
+    result = RequestScheduler(max_retries=1, base_delay=0.01).call(session.send, "POST", "/v2/orders/search", {})
+    session.close()
+    assert result.status_code == 503
+    assert result.errors == [{"category": "API_ERROR", "code": "HTTP_503", "detail": "upstream unavailable"}]
@@ -0,0 +1,16 @@
+from conftest import read, run_report
+
+
+# Paging in worker processes gives the same report as paging serially
+def test_process_report_matches_serial(tmp_path, square_env, serial_report):
+    run_report(tmp_path, square_env, "--processes", "2")
+    assert read(tmp_path / "sales_report.csv") == serial_report
+
+
+def test_merged_parts_match_serial(tmp_path, square_env, serial_report):
+    run_report(tmp_path, square_env, "--part", "1/2", "--shards", "2")
+    run_report(tmp_path, square_env, "--part", "2/2", "--shards", "2")
+    run_report(
+        tmp_path, square_env, "--merge", "sales_report.part-1-of-2.json", "sales_report.part-2-of-2.json", dates=False,
+    )
+    assert read(tmp_path / "sales_report.csv") == serial_report
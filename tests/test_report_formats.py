@@ -0,0 +1,18 @@
+import json
+
+from conftest import read, run_report
+
+
+def test_report_csv_has_amounts_in_cents(serial_report):
+    header, first = serial_report.splitlines()[:2]
+    assert "Order Sales Total (cents)" in header.split(",")
+    assert int(first.split(",")[header.split(",").index("Order Sales Total (cents)")]) > 0
+
+
+# The JSON lines report has the same rows as the CSV report
+def test_jsonl_report_matches_csv(tmp_path, square_env, serial_report):
+    run_report(tmp_path, square_env, "--format", "jsonl")
+    rows = [json.loads(line) for line in read(tmp_path / "sales_report.jsonl").splitlines()]
+    header, *csv_rows = serial_report.splitlines()
+    total = header.split(",").index("Order Sales Total (cents)")
+    assert [row["sales_total_cents"] for row in rows] == [int(row.split(",")[total]) for row in csv_rows]
@@ -0,0 +1,49 @@
+import datetime, os, subprocess, sys
+
+import pytest
+
+from conftest import REPO
+
+
+# Days that move out of the last --days days are dropped, with their orders' ids,
+# and aren't paged again
+def test_service_keeps_the_last_days(report, monkeypatch):
+    service = report.ReportService(2, 60, 1, 1, 60)
+    first_day = service.first_day
+    old_day, kept_day = first_day - datetime.timedelta(days=3), first_day + datetime.timedelta(days=1)
+    service.first_day = old_day
+    service.watermark = datetime.datetime.combine(old_day, datetime.time(), datetime.timezone.utc)
+    service.daily = {("L1", old_day): report.ItemTally(), ("L1", kept_day): report.ItemTally()}
+    service.counted = {"ORDER1": old_day, "ORDER2": kept_day}
+    service.events = {"event-1": old_day, "event-2": kept_day}
+
+    searches = []
+
+    def search_order_pages(locations, start_at, end_at, last_shard):
+        searches.append(start_at)
+        return iter(())
+
+    monkeypatch.setattr(report, "location_ids", ["L1"], raising=False)
+    monkeypatch.setattr(report, "search_order_pages", search_order_pages)
+    monkeypatch.setattr(report, "get_catalog_info_bulk", lambda item_ids: [])
+    monkeypatch.setattr(report, "get_inventory_counts_bulk", lambda item_ids: [])
+    service.refresh()
+
+    assert service.first_day == first_day
+    assert list(service.daily) == [("L1", kept_day)]
+    assert service.counted == {"ORDER2": kept_day}
+    assert service.events == {"event-2": kept_day}
+    assert searches == [datetime.datetime.combine(first_day, datetime.time(), datetime.timezone.utc).isoformat()]
+
+
+@pytest.mark.parametrize("options", [
+    ["--cache"], ["--async"], ["--group-by", "day"], ["--resume"], ["--format", "jsonl"], ["--output", "report.csv"],
+    ["--start-date", "2024-01-01"],
+])
+def test_serve_rejects_report_options(tmp_path, options):
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, "simple-sales-report.py"), "--serve", *options],
+        cwd=tmp_path, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 2
+    assert f"--serve can't be used with {options[0]}" in result.stderr
@@ -0,0 +1,14 @@
+import pytest
+
+from conftest import read, run_report
+
+
+# Paging in shards, however many workers page them, gives the same report as
+# paging serially
+@pytest.mark.parametrize("options", [
+    ["--shards", "4"],
+    ["--shards", "5", "--workers", "3"],
+])
+def test_sharded_report_matches_serial(tmp_path, square_env, serial_report, options):
+    run_report(tmp_path, square_env, *options)
+    assert read(tmp_path / "sales_report.csv") == serial_report
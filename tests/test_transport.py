@@ -0,0 +1,162 @@
+import asyncio, threading, time
+
+import pytest
+
+from conftest import read, run_report
+from square_transport import ApiResult, AsyncSquareClient, RequestScheduler, SquareSession
+
+pytest.importorskip("aiohttp")
+
+SEARCH_BODY = {
+    "location_ids": ["FAKELOCATION01"],
+    "query": {"filter": {"state_filter": {"states": ["COMPLETED"]}}},
+    "limit": 100,
+}
+
+
+# A report made with --async is the same as one paged serially
+def test_async_report_matches_serial(tmp_path, square_env, serial_report):
+    run_report(tmp_path, square_env, "--async", "--shards", "4", "--workers", "4")
+    assert read(tmp_path / "sales_report.csv") == serial_report
+
+
+# The async client gets the same pages as the requests session
+def test_async_client_matches_session(square_env, monkeypatch):
+    for name, value in square_env.items():
+        monkeypatch.setenv(name, value)
+    session = SquareSession("test", "custom")
+    expected = session.send("POST", "/v2/orders/search", SEARCH_BODY)
+    session.close()
+
+    async def search():
+        client = AsyncSquareClient("test", "custom", concurrency=4)
+        try:
+            return await client.search_orders(SEARCH_BODY)
+        finally:
+            await client.close()
+
+    result = asyncio.run(search())
+    assert result.is_success()
+    assert result.body == expected.body
+    assert result.cursor == expected.cursor
+
+
+def test_async_client_connection_error(monkeypatch):
+    monkeypatch.setenv("SQUARE_BASE_URL", "http://127.0.0.1:9")
+
+    async def search():
+        client = AsyncSquareClient("test", "custom", scheduler=RequestScheduler(max_retries=1, base_delay=0.01))
+        try:
+            return await client.search_orders(SEARCH_BODY)
+        finally:
+            await client.close()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(search())
+
+
+class SlowSend:
+    def __init__(self, scheduler, statuses=()):
+        self.scheduler = scheduler
+        self.statuses = list(statuses)
+        self.peak = 0
+        self.calls = 0
+
+    def result(self):
+        self.calls += 1
+        self.peak = max(self.peak, self.scheduler.in_flight)
+        return ApiResult(self.statuses.pop(0) if self.statuses else 200, {}, {})
+
+    def __call__(self):
+        time.sleep(0.02)
+        return self.result()
+
+    async def send_async(self):
+        await asyncio.sleep(0.02)
+        return self.result()
+
+
+# Coroutines and threads sharing a scheduler stay within its limit between them
+def test_scheduler_limit_is_shared():
+    scheduler = RequestScheduler(max_concurrency=3)
+    send = SlowSend(scheduler)
+
+    async def run():
+        threads = [
+            threading.Thread(target=lambda: [scheduler.call(send, endpoint="thread") for _ in range(5)])
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        await asyncio.gather(*(scheduler.call_async(send.send_async, endpoint="task") for _ in range(20)))
+        for thread in threads:
+            thread.join()
+
+    asyncio.run(run())
+    assert send.calls == 35
+    assert send.peak <= 3
+    assert scheduler.in_flight == 0
+
+
+# A freed slot goes to the caller that has waited longest, not back to the one
+# that released it
+def test_slots_are_handed_over_in_order():
+    scheduler = RequestScheduler(max_concurrency=1)
+    order = []
+
+    def take(name):
+        scheduler.acquire()
+        order.append(name)
+        scheduler.release(False)
+
+    scheduler.acquire()
+    waiter = threading.Thread(target=take, args=("waiter",))
+    waiter.start()
+    while not scheduler.waiters:
+        time.sleep(0.001)
+    scheduler.release(False)
+    take("releaser")
+    waiter.join()
+    assert order == ["waiter", "releaser"]
+
+
+def test_async_slots_are_handed_over_in_order():
+    scheduler = RequestScheduler(max_concurrency=1)
+    order = []
+
+    async def take(name):
+        await scheduler.acquire_async()
+        order.append(name)
+        scheduler.release(False)
+
+    async def run():
+        await scheduler.acquire_async()
+        waiter = asyncio.ensure_future(take("waiter"))
+        await asyncio.sleep(0)
+        scheduler.release(False)
+        await take("releaser")
+        await waiter
+
+        # A coroutine cancelled while it waits doesn't keep a slot
+        await scheduler.acquire_async()
+        cancelled = asyncio.ensure_future(take("cancelled"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        scheduler.release(False)
+        await asyncio.sleep(0)
+        await take("after cancel")
+
+    asyncio.run(run())
+    assert order == ["waiter", "releaser", "after cancel"]
+    assert scheduler.in_flight == 0
+
+def test_call_async_retries():
+    scheduler = RequestScheduler(max_concurrency=4, base_delay=0.01)
+    send = SlowSend(scheduler, statuses=[429, 503])
+    result = asyncio.run(scheduler.call_async(send.send_async, endpoint="search_orders"))
+    assert result.status_code == 200
+    assert send.calls == 3
+    stats = scheduler.stats.to_dict()["search_orders"]
+    assert (stats["calls"], stats["retries"], stats["errors"]) == (3, 2, 2)
+    # The limit was halved for the rate limited request
+    assert scheduler.limit < 4
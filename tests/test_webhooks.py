@@ -0,0 +1,115 @@
+import base64, datetime, hashlib, hmac, json, threading, urllib.error, urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+
+class EventLog:
+    def __init__(self):
+        self.events = []
+
+    def handle_event(self, event):
+        self.events.append(event)
+        return "ignored"
+
+
+@pytest.fixture
+def webhook_server(report):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), report.report_request_handler())
+    server.daemon_threads = True
+    server.service = EventLog()
+    server.webhook_signature_key = "signature-key"
+    server.webhook_url = "https://example.com/webhooks"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post_event(server, body, signature=None):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_address[1]}/webhooks", data=body, method="POST",
+        headers={"x-square-hmacsha256-signature": signature} if signature is not None else {},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_webhook_signature(webhook_server):
+    body = json.dumps({"event_id": "event-1", "type": "order.updated"}).encode()
+    signature = base64.b64encode(hmac.new(
+        b"signature-key", b"https://example.com/webhooks" + body, hashlib.sha256
+    ).digest()).decode()
+
+    assert post_event(webhook_server, body, signature) == (200, {"result": "ignored"})
+    assert post_event(webhook_server, body + b" ", signature)[0] == 403
+    assert post_event(webhook_server, body, base64.b64encode(b"not the signature").decode())[0] == 403
+    assert post_event(webhook_server, body)[0] == 403
+    assert webhook_server.service.events == [json.loads(body)]
+
+    webhook_server.webhook_signature_key = None
+    assert post_event(webhook_server, body)[0] == 200
+
+
+# An event that fails is handled again when Square delivers it again
+def test_failed_event_is_not_a_duplicate(report):
+    service = report.ReportService(1, 60, 1, 1, 60)
+    attempts = []
+
+    def apply_event(event):
+        attempts.append(event)
+        if len(attempts) == 1:
+            raise ConnectionError("BatchRetrieveOrders failed")
+        return "ignored"
+
+    service.apply_event = apply_event
+    event = {"event_id": "event-1", "type": "order.updated"}
+    with pytest.raises(ConnectionError):
+        service.handle_event(event)
+    assert service.handle_event(event) == "ignored"
+    assert service.handle_event(event) == "duplicate"
+    assert len(attempts) == 2
+
+
+def closed_order(order_id, day):
+    return {
+        "id": order_id, "location_id": "L1", "closed_at": day.isoformat() + "T12:00:00Z",
+        "line_items": [{
+            "catalog_object_id": "ITEM1", "quantity": "2", "name": "Tea", "variation_name": "Green",
+            "base_price_money": {"amount": 350, "currency": "USD"},
+        }],
+    }
+
+
+# Orders tallied by a refresh that fails part way are counted by the next refresh
+def test_failed_refresh_loses_no_orders(report, monkeypatch):
+    service = report.ReportService(1, 60, 1, 1, 60)
+    day = service.first_day
+    searches = []
+
+    def search_order_pages(locations, start_at, end_at, last_shard):
+        searches.append(start_at)
+        yield [closed_order("ORDER1", day)], "cursor"
+        if len(searches) == 1:
+            raise SystemExit(1)
+        yield [closed_order("ORDER2", day)], None
+
+    monkeypatch.setattr(report, "location_ids", ["L1"], raising=False)
+    monkeypatch.setattr(report, "search_order_pages", search_order_pages)
+    monkeypatch.setattr(report, "get_catalog_info_bulk", lambda item_ids: [])
+    monkeypatch.setattr(report, "get_inventory_counts_bulk", lambda item_ids: [])
+
+    with pytest.raises(SystemExit):
+        service.refresh()
+    assert (service.daily, service.counted) == ({}, {})
+    assert not service.claimed
+
+    service.refresh()
+    assert searches[0] == searches[1]
+    assert service.counted == {"ORDER1": day, "ORDER2": day}
+    assert not service.claimed
+    [(_, tally)] = service.sections(day, day + datetime.timedelta(days=1))
+    assert sum(item.sales_total for item in tally.values()) == 1400
@@ -0,0 +1,33 @@
+import datetime
+
+import pytest
+
+
+def window_dates(windows):
+    return {window.name: (window.start_at, window.end_at) for window in windows}
+
+
+def test_parse_windows(report):
+    today = datetime.date(2024, 5, 15)  # a Wednesday
+    windows = report.parse_windows("today, wtd,mtd,ytd-ly,wtd-ly,q1=2024-01-01/2024-04-01", today)
+    assert window_dates(windows) == {
+        "today": ("2024-05-15", "2024-05-16"),
+        "wtd": ("2024-05-13", "2024-05-16"),
+        "mtd": ("2024-05-01", "2024-05-16"),
+        "ytd-ly": ("2023-01-01", "2023-05-16"),
+        # 52 weeks back, so it starts on a Monday too
+        "wtd-ly": ("2023-05-15", "2023-05-18"),
+        "q1": ("2024-01-01", "2024-04-01"),
+    }
+
+    # A window ending on 29 February ends on the 28th last year
+    windows = report.parse_windows("mtd-ly", datetime.date(2024, 2, 28))
+    assert window_dates(windows) == {"mtd-ly": ("2023-02-01", "2023-02-28")}
+
+
+@pytest.mark.parametrize("spec", [
+    "", "fortnight", "q1=2024-01-01", "q1=2024-04-01/2024-01-01", "q 1=2024-01-01/2024-04-01", "mtd,mtd",
+])
+def test_parse_windows_rejects(report, spec):
+    with pytest.raises(ValueError):
+        report.parse_windows(spec, datetime.date(2024, 5, 15))